@@ -0,0 +1,76 @@
+"""
+Remembers the CDN URLs Discord gives to images the bot uploads, so the same image can be shown
+again by URL instead of being uploaded again.
+
+Attachment URLs are signed and stop working after a while (the 'ex' query parameter is the expiry
+time, in hex Unix seconds), so entries are only returned until shortly before they expire. An
+attachment is also deleted when the message holding it is edited to drop it or deleted, which breaks
+every message showing its URL: only record uploads from messages that are never edited or deleted.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from metrics import metrics
+
+# Stop using a URL this many seconds before Discord's expiry time
+EXPIRY_MARGIN = 3600
+# Lifetime assumed for URLs without an 'ex' parameter
+DEFAULT_TTL = 12 * 3600
+MAX_ENTRIES = 2048
+
+
+def content_key(*parts):
+    """Stable key for the content an image was generated from, e.g. content_key(url, style, color)."""
+    return hashlib.sha1("\0".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def url_expiry(url):
+    """Returns when an attachment URL expires (Unix time), from its 'ex' parameter or DEFAULT_TTL."""
+    try:
+        return int(parse_qs(urlsplit(url).query)['ex'][0], 16)
+    except (KeyError, IndexError, ValueError):
+        return time.time() + DEFAULT_TTL
+
+
+class AttachmentURLCache:
+    """Content key -> CDN URL of an uploaded attachment."""
+
+    def __init__(self, name, max_entries=MAX_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (url, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns a usable URL for key, or None if there isn't one (never uploaded, or expiring)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] - EXPIRY_MARGIN <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.cache(self.name, entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, url):
+        """Records the URL Discord returned for an upload of key's content."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (url, url_expiry(url))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_upload(self, key, message, filename):
+        """put() for the attachment called filename on a sent message. Returns its URL, or None if it has none."""
+        for attachment in getattr(message, 'attachments', None) or ():
+            if attachment.filename == filename:
+                self.put(key, attachment.url)
+                return attachment.url
+        return None
+
+
+# URLs of QR code images uploaded to QR_IMAGE_CHANNEL_ID by /qrcode and its style menu
+qr_attachment_urls = AttachmentURLCache('qr_cdn')
@@ -0,0 +1,348 @@
+"""
+Benchmarks for the bot's hot paths: timetable lookups, activity formatting, QR code and timetable
+image rendering and embed construction.
+
+    python benchmarks/bench.py                     # run everything and print a table
+    python benchmarks/bench.py -k timetable        # only benchmarks whose name contains 'timetable'
+    python benchmarks/bench.py --json out.json     # also write the results as JSON
+    python benchmarks/bench.py --save-baseline     # store the results in benchmarks/baseline.json
+    python benchmarks/bench.py --compare           # exit 1 if anything regressed against the baseline
+
+Timings depend on the machine, so no baseline is committed (benchmarks/baseline.json is ignored by
+git): run --save-baseline on the machine you deploy to, e.g. on the last release, before using
+--compare there. --compare exits 2 if there is no baseline yet.
+
+Each benchmark is calibrated to run for about 0.2 s per round and repeated (with the garbage
+collector off, as timeit does); the median time per call is compared with the baseline. Peak
+memory per call is measured separately with tracemalloc. Inputs are generated from fixed seeds
+and get_activities runs against fake_upstream.py, so runs are reproducible and offline.
+Benchmarks whose dependencies aren't installed are skipped.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+# Keep benchmark runs away from the bot's shared cache, snapshots and logs
+_scratch_dir = tempfile.mkdtemp(prefix='event-schedule-bench-')
+os.environ.setdefault('SHARED_CACHE', '0')
+os.environ.setdefault('SNAPSHOT_PATH', os.path.join(_scratch_dir, 'upstream_snapshot.json.gz'))
+os.environ.setdefault('LOG_DIR', os.path.join(_scratch_dir, 'log'))
+
+from fake_upstream import FakeUpstream, synthetic_feed
+
+BENCHMARKS = []
+
+def benchmark(name, requires=()):
+    """Registers a benchmark factory: setup code runs once, and the function it returns is timed."""
+    def decorator(factory):
+        BENCHMARKS.append((name, requires, factory))
+        return factory
+    return decorator
+
+
+# Benchmarks
+
+@benchmark('get_cycle_day[json]', requires=('requests',))
+def bench_cycle_day_json():
+    from timetable_functions import get_cycle_day
+    from timetable_store import JsonTimetable
+    store = JsonTimetable.from_files()
+    return lambda: get_cycle_day('03/09/2024', store)
+
+
+@benchmark('get_cycle_day[compiled]', requires=('requests',))
+def bench_cycle_day_compiled():
+    from timetable_functions import get_cycle_day
+    from timetable_store import compile_timetable, CompiledTimetable
+    path = os.path.join(tempfile.mkdtemp(), 'timetable.bin')
+    compile_timetable(out_path=path)
+    store = CompiledTimetable(path)
+    return lambda: get_cycle_day('03/09/2024', store)
+
+
+@benchmark('get_timetable[compiled]', requires=('requests',))
+def bench_get_timetable():
+    from timetable_functions import get_timetable
+    from timetable_store import compile_timetable, CompiledTimetable
+    path = os.path.join(tempfile.mkdtemp(), 'timetable.bin')
+    compile_timetable(out_path=path)
+    store = CompiledTimetable(path)
+    return lambda: get_timetable('3A', '03/09/2024', lambda: store)
+
+
+@benchmark('DayIndex.index_row', requires=('requests',))
+def bench_index_row():
+    from event_feed import DayIndex
+    row = synthetic_feed()['rows']['3/9/2024']
+    index = DayIndex()
+    return lambda: index.index_row('3/9/2024', row)
+
+
+@benchmark('get_activities[cached]', requires=('requests',))
+def bench_activities_cached():
+    from timetable_functions import get_activities
+    from event_feed import EventFeed
+    upstream = FakeUpstream()
+    url = f"{upstream.start()}/event-schedule"
+    feed = EventFeed(url, max_age=3600)
+    feed.refresh()
+    return lambda: get_activities('03/09/2024', feed)
+
+
+@benchmark('get_activities[closest date]', requires=('requests',))
+def bench_activities_closest():
+    from timetable_functions import get_activities
+    from event_feed import EventFeed
+    upstream = FakeUpstream()
+    url = f"{upstream.start()}/event-schedule"
+    feed = EventFeed(url, max_age=3600)
+    feed.refresh()
+    return lambda: get_activities('15/08/2026', feed)
+
+
+@benchmark('get_activities[fetch]', requires=('requests',))
+def bench_activities_fetch():
+    from timetable_functions import get_activities
+    from event_feed import EventFeed
+    upstream = FakeUpstream()
+    url = f"{upstream.start()}/event-schedule"
+    feed = EventFeed(url, max_age=0, share_max_age=0)
+    return lambda: get_activities('03/09/2024', feed)
+
+
+@benchmark('render_week[draw]', requires=('PIL',))
+def bench_render_week():
+    import timetable_image
+    from timetable_store import JsonTimetable
+    store = JsonTimetable.from_files()
+
+    def render():
+        timetable_image._rendered.clear()
+        return timetable_image.render_week(store, '3A')
+    return render
+
+
+@benchmark('render_week[memoized]', requires=('PIL',))
+def bench_render_week_memoized():
+    from timetable_image import render_week
+    from timetable_store import JsonTimetable
+    store = JsonTimetable.from_files()
+    return lambda: render_week(store, '3A')
+
+
+def _qr_benchmark(style, color=None, fmt='png'):
+    def factory():
+        from qr_code import generate_qr_code
+        return lambda: generate_qr_code('https://iot.spyc.hk/event-schedule', style=style, color=color, fmt=fmt)
+    return factory
+
+
+for _style in ('solid', 'horizontal_gradient', 'vertical_gradient', 'radial_gradient'):
+    benchmark(f'generate_qr_code[{_style}]', requires=('qrcode', 'PIL'))(_qr_benchmark(_style))
+benchmark('generate_qr_code[solid, red]', requires=('qrcode', 'PIL'))(_qr_benchmark('solid', 'red'))
+benchmark('generate_qr_code[radial_gradient, svg]', requires=('qrcode', 'PIL'))(_qr_benchmark('radial_gradient', fmt='svg'))
+
+
+BOT_REQUIRES = ('discord', 'requests', 'dotenv')
+
+
+def _bot():
+    # Importing bot doesn't log in, so give it the user that embeds take their thumbnail from
+    import bot
+    from loadgen import FakeUser
+    bot.bot._connection.user = FakeUser(0)
+    return bot
+
+
+@benchmark('embed[activities]', requires=BOT_REQUIRES)
+def bench_activities_embed():
+    bot = _bot()
+    from datetime import date
+    from event_feed import DayIndex
+    from schedule import Result, DayActivities
+    index = DayIndex()
+    index.index_row('3/9/2024', synthetic_feed()['rows']['3/9/2024'])
+    _, slots, remark = index.find(date(2024, 9, 3))
+    result = Result(DayActivities('03/09/2024', slots, remark))
+    return lambda: bot.build_activities_embed('03/09/2024', result).to_dict()
+
+
+@benchmark('embed[timetable]', requires=BOT_REQUIRES)
+def bench_timetable_embed():
+    bot = _bot()
+    from timetable_functions import get_timetable
+    from timetable_store import JsonTimetable
+    store = JsonTimetable.from_files()
+    result = get_timetable('3A', '03/09/2024', lambda: store)
+    return lambda: bot.build_timetable_embed('3A', '03/09/2024', result).to_dict()
+
+
+@benchmark('timetable_reply', requires=BOT_REQUIRES)
+def bench_timetable_reply():
+    # The whole /timetable reply: lookup in a worker thread, embed, personalised copy and view
+    import asyncio
+    bot = _bot()
+    from loadgen import FakeInteraction
+    loop = asyncio.new_event_loop()
+    interaction = FakeInteraction(1)
+
+    def reply():
+        bot.timetable_replies._recent.clear()  # time building the reply, not reusing the last one
+        embed, view = loop.run_until_complete(bot.timetable_reply(interaction, '3A', '03/09/2024'))
+        return embed.to_dict(), view
+    return reply
+
+
+# Harness
+
+def _missing(requires):
+    missing = []
+    for module_name in requires:
+        try:
+            __import__(module_name)
+        except ImportError:
+            missing.append(module_name)
+    return missing
+
+
+def measure(func, repeat=7, round_time=0.2):
+    """
+    Times func and measures its peak memory.
+
+    Returns:
+        dict: 'number' (calls per round), per-call 'min', 'median', 'mean' and 'stdev' in
+        seconds, and 'peak_bytes' (tracemalloc peak during one call)
+    """
+    func()  # warm up caches and lazy imports
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * round_time / max(elapsed, 1e-9)))
+    per_call = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'number': number,
+        'min': min(per_call),
+        'median': statistics.median(per_call),
+        'mean': statistics.fmean(per_call),
+        'stdev': statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        'peak_bytes': peak,
+    }
+
+
+def run(selected=None, repeat=7):
+    results = {}
+    skipped = {}
+    for name, requires, factory in BENCHMARKS:
+        if selected and selected not in name:
+            continue
+        missing = _missing(requires)
+        if missing:
+            skipped[name] = f"missing {', '.join(missing)}"
+            continue
+        results[name] = measure(factory(), repeat=repeat)
+        print(f"  {name:<36} {_format_time(results[name]['median']):>10}", file=sys.stderr)
+    return results, skipped
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline.
+
+    Returns:
+        list: (name, what, baseline value, current value, ratio) for each regression
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['median'] / base['median'] if base['median'] else 1.0
+        if ratio > 1 + tolerance:
+            regressions.append((name, 'time', base['median'], result['median'], ratio))
+        # Small allocations vary between runs, so memory needs to grow by 1 KB as well
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance) + 1024:
+            regressions.append((name, 'memory', base['peak_bytes'], result['peak_bytes'],
+                                result['peak_bytes'] / max(base['peak_bytes'], 1)))
+    return regressions
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's hot paths")
+    parser.add_argument('-k', dest='selected', help="Only run benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=7, help="Rounds per benchmark")
+    parser.add_argument('--json', dest='json_path', help="Write results to this file")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Store results in {os.path.relpath(BASELINE_PATH, ROOT)}")
+    parser.add_argument('--compare', action='store_true', help="Compare with the baseline; exit 1 on regressions")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Baseline file to compare with or save to")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    print("Running benchmarks...", file=sys.stderr)
+    results, skipped = run(args.selected, args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+        'skipped': skipped,
+    }
+
+    print(f"\n{'benchmark':<36} {'median':>10} {'min':>10} {'stdev':>10} {'peak mem':>10}")
+    for name, result in results.items():
+        print(f"{name:<36} {_format_time(result['median']):>10} {_format_time(result['min']):>10} "
+              f"{_format_time(result['stdev']):>10} {result['peak_bytes'] / 1024:>8.1f}KB")
+    for name, reason in skipped.items():
+        print(f"{name:<36} skipped ({reason})")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    if args.compare:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+        except FileNotFoundError:
+            print(f"\nNo baseline at {args.baseline}. Timings are machine-specific, so none is committed: check out "
+                  f"the last release, run with --save-baseline, then check out this version and --compare again.",
+                  file=sys.stderr)
+            sys.exit(2)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for name, what, base, current, ratio in regressions:
+                if what == 'time':
+                    print(f"  {name}: {_format_time(base)} -> {_format_time(current)} ({ratio:.2f}x)")
+                else:
+                    print(f"  {name}: peak memory {base / 1024:.1f}KB -> {current / 1024:.1f}KB ({ratio:.2f}x)")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,48 @@
+if __name__ == "__main__":
+    # Started as `python bot.py`: run main.py instead. It becomes __main__ while the bot runs, so
+    # multiprocessing workers re-import that empty script rather than this module
+    import os
+    import runpy
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'), run_name="__main__")
+    raise SystemExit
+
+from startup_profile import mark, timed_import, report as startup_report
 import discord
 from discord import app_commands
+from discord.ext import tasks
+import asyncio
+import time
 from dotenv import load_dotenv
+load_dotenv()
 import os
 from datetime import datetime, timedelta
 import logging
-from logging.handlers import TimedRotatingFileHandler
-import json
+from logging_setup import setup_logging, QRCODE_LOGGER
 from timetable_functions import get_timetable, get_activities
-from request_AI import gpt_35_api
-from qr_code import generate_qr_code
+from schedule import GRADES
+from timetable_sync import SyncError
+from event_feed import FeedError, display_date
+from school_registry import datasets
+from subscriptions import activity_alert_channels
+from command_sync import sync_command_tree
+from metrics import metrics, start_http_server, METRICS_PORT
+from loop_watchdog import loop_watchdog
+import attachment_urls
+from single_flight import SingleFlight
 import io
-from weather import *
+
+# qr_code and timetable_image (PIL), request_AI (OpenAI SDK) and weather are imported on first use or by
+# warm_up() after the bot is ready, so they don't delay connecting to Discord
+mark("imports")
 
 
-# Set up general bot logging
-log_file = os.path.join(os.getcwd(), 'log\logs.log')
+# Logging goes through a queue, so log lines never wait on disk I/O on the event loop (see logging_setup.py)
+setup_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-file_handler = TimedRotatingFileHandler(log_file, when='midnight', interval=1, backupCount=30, encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-file_handler.suffix = "%Y-%m-%d"
-logger.addHandler(file_handler)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(console_handler)
-
-# Set up QR code specific logging
-qrcode_log_file = os.path.join(os.getcwd(), 'log\qrcode_logs.log')
-qrcode_logger = logging.getLogger('qrcode')
-qrcode_logger.setLevel(logging.INFO)
-qrcode_file_handler = TimedRotatingFileHandler(qrcode_log_file, when='midnight', interval=1, backupCount=30, encoding='utf-8')
-qrcode_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-qrcode_file_handler.suffix = "%Y-%m-%d"
-qrcode_logger.addHandler(qrcode_file_handler)
-
-# Load environment variables
-load_dotenv()
+# QR code requests are also written to log/qrcode_logs.log
+qrcode_logger = logging.getLogger(QRCODE_LOGGER)
+
+# Environment variables are loaded above, before modules that read them at import
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 
 # Initialize bot with intents
@@ -43,35 +50,181 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
 intents.messages = True
-bot = discord.Client(intents=intents)
-tree = app_commands.CommandTree(bot)
+
+# Sharding: SHARD_COUNT ('auto' or a number) runs the bot as an AutoShardedClient, and SHARD_IDS
+# (e.g. '0,1') limits this process to some of the shards. launcher.py starts one process per group.
+SHARD_COUNT = os.getenv('SHARD_COUNT')
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()] or None
+if SHARD_COUNT:
+    bot = discord.AutoShardedClient(
+        intents=intents,
+        shard_count=None if SHARD_COUNT == 'auto' else int(SHARD_COUNT),
+        shard_ids=SHARD_IDS
+    )
+else:
+    bot = discord.Client(intents=intents)
+
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """Command tree that records each slash command's latency and errors in metrics."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started_at'] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        record_command_metrics(interaction, error=True)
+        await super().on_error(interaction, error)
+
+def record_command_metrics(interaction: discord.Interaction, error: bool = False):
+    started_at = interaction.extras.get('started_at')
+    if started_at is not None and interaction.command is not None:
+        metrics.observe('command', interaction.command.qualified_name, time.perf_counter() - started_at, error=error)
+
+tree = InstrumentedCommandTree(bot)
+
+def _default_executor_queue_depth():
+    # asyncio.to_thread work waiting for a free thread in the loop's default executor
+    executor = getattr(bot.loop, '_default_executor', None)
+    return executor._work_queue.qsize() if executor is not None else 0
+
+metrics.gauge('event_loop_tasks', lambda: len(asyncio.all_tasks(bot.loop)), "Tasks pending on the event loop")
+metrics.gauge('executor_queue_depth', _default_executor_queue_depth, "Blocking calls waiting for a worker thread")
+metrics.gauge('loaded_schools', lambda: len(datasets.loaded()), "School datasets held in memory")
 
 # Developer user ID
 DEV_USER_ID = "931848512633700384"
 
-def get_available_classes():
-    """Load available classes from timetale.json."""
+# Set DEV_GUILD_ID to sync commands to one server instantly while developing, instead of globally.
+# Commands are only re-synced when their definitions change, unless FORCE_COMMAND_SYNC=1.
+DEV_GUILD_ID = os.getenv('DEV_GUILD_ID')
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC') == '1'
+
+# Channel (only the bot should post there) that QR images are uploaded to, so that they can be shown
+# again by URL. Replies to /qrcode are edited by their style menu, which deletes their attachments,
+# so only uploads to this channel are reused. Unset: every QR image is attached to its reply.
+QR_IMAGE_CHANNEL_ID = int(os.getenv('QR_IMAGE_CHANNEL_ID', '0')) or None
+
+# How often the event-schedule feed (and its search index) is refreshed in the background
+FEED_REFRESH_MINUTES = 5
+
+# How often the timetable and cycle calendar are re-fetched from the school's endpoints
+TIMETABLE_SYNC_MINUTES = 30
+
+def guild_dataset(interaction: discord.Interaction):
+    """Return the dataset of the school the interaction's server is bound to."""
+    return datasets.for_guild(interaction.guild_id)
+
+async def load_guild_dataset(interaction: discord.Interaction):
+    """guild_dataset, loading the school's data in a worker thread if it isn't in memory."""
+    dataset = datasets.loaded_dataset(datasets.school_for_guild(interaction.guild_id))
+    if dataset is None:
+        dataset = await asyncio.to_thread(guild_dataset, interaction)
+    return dataset
+
+def get_available_classes(dataset):
+    """Load available classes from a school's timetable data."""
     try:
-        file_path = os.path.join('test_data', 'timetale.json')
-        resolved_path = os.path.abspath(file_path)
-        logger.info(f"Loading classes from: {resolved_path}")
-        with open(file_path, 'r', encoding='utf-8') as file:
-            timetable_data = json.load(file)
-        classes = list(timetable_data.keys())
+        classes = dataset.load_store().classes()
         if not classes:
             logger.error("No classes found in timetale.json")
             return None
         return classes[:25]
-    except FileNotFoundError:
-        logger.error(f"timetale.json not found at {resolved_path}")
+    except FileNotFoundError as e:
+        logger.error(f"Timetable data not found at {os.path.abspath(e.filename or '')}")
         return None
-    except json.JSONDecodeError:
-        logger.error("Invalid JSON in timetale.json")
+    except ValueError as e:
+        logger.error(f"Invalid timetable data: {str(e)}")
         return None
     except Exception as e:
         logger.error(f"Error loading classes: {str(e)}")
         return None
 
+# Timetable and activities replies shared by identical concurrent requests (see single_flight.py)
+timetable_replies = SingleFlight('timetable_reply')
+activities_replies = SingleFlight('activities_reply')
+
+def personalize(embed: discord.Embed, interaction: discord.Interaction) -> discord.Embed:
+    """Copy of a shared embed with the footer for the interaction's user."""
+    embed = embed.copy()
+    embed.set_footer(
+        text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
+        icon_url=interaction.user.avatar.url if interaction.user.avatar else None
+    )
+    return embed
+
+def build_timetable_embed(class_name: str, date: str, result) -> discord.Embed:
+    """Embed for a get_timetable result, without the requester's footer (see personalize)."""
+    embed = discord.Embed(
+        title=f"Timetable for {class_name} on {date}",
+        description="Schedule for the requested class and date.",
+        color=0x00b7eb
+    )
+    embed.set_thumbnail(url=bot.user.avatar.url)
+    
+    if not result.ok:
+        lessons = result.error
+    elif not result.value.school_day:
+        lessons = f"No school on {result.value.date}"
+    else:
+        lessons = "\n".join(result.value.lines())
+    embed.add_field(name="Lessons", value=lessons, inline=False)
+    return embed
+
+def build_activities_embed(date: str, result, grade: str = None, slot: str = None) -> discord.Embed:
+    """Embed for a get_activities result, without the requester's footer (see personalize)."""
+    filters = ", ".join(part for part in (grade, slot) if part)
+    embed = discord.Embed(
+        title=f"Activities on {date}" + (f" ({filters})" if filters else ""),
+        description="Activities and remarks for the requested date.",
+        color=0x00b7eb
+    )
+    embed.set_thumbnail(url=bot.user.avatar.url)
+    
+    add_activities_fields(embed, result)
+    return embed
+
+async def timetable_reply(interaction: discord.Interaction, class_name: str, date: str):
+    """
+    Embed and view showing a class's timetable on a date (DD/MM/YYYY). The embed is shared with
+    identical concurrent requests; each interaction gets its own copy and its own view.
+    """
+    dataset = await load_guild_dataset(interaction)
+    store = dataset.loaded_store
+    if store is None:
+        # First use since the school was loaded: read or map its timetable off the loop
+        try:
+            store = await asyncio.to_thread(dataset.load_store)
+        except (FileNotFoundError, ValueError):
+            pass  # get_timetable reports the error
+    version = store.version if store is not None else None
+
+    async def build():
+        # Off the loop, so identical requests arriving meanwhile wait for this lookup instead of repeating it
+        result, classes = await asyncio.to_thread(
+            lambda: (get_timetable(class_name, date, dataset.load_store), get_available_classes(dataset))
+        )
+        return build_timetable_embed(class_name, date, result), classes
+
+    key = ('timetable', dataset.profile.school_id, class_name, date, version)
+    embed, classes = await timetable_replies.run(key, build)
+    return personalize(embed, interaction), create_timetable_view(class_name, date, classes)
+
+async def activities_reply(interaction: discord.Interaction, date: str, grade: str = None, slot: str = None):
+    """
+    Embed and view showing the activities on a date (DD/MM/YYYY), optionally for one grade and/or
+    slot. As in timetable_reply, only the embed is shared between identical requests.
+    """
+    dataset = await load_guild_dataset(interaction)
+
+    async def build():
+        # May fetch the schedule from the school's server
+        result = await asyncio.to_thread(get_activities, date, dataset.feed, grade=grade, slot=slot)
+        return build_activities_embed(date, result, grade, slot)
+
+    key = ('activities', dataset.profile.school_id, date, grade, slot, dataset.feed.digest)
+    embed = await activities_replies.run(key, build)
+    return personalize(embed, interaction), create_activities_view(date, grade, slot)
+
 @app_commands.command(name="timetable", description="Get the timetable for a specific class and date")
 @app_commands.describe(
     class_name="Class name (e.g., 1A, 2B, 3C, 4D)",
@@ -97,35 +250,94 @@ async def timetable(interaction: discord.Interaction, class_name: str, date: str
         await interaction.response.send_message("Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)", ephemeral=True)
         return
     
-    result = get_timetable(class_name, normalized_date)
+    embed, view = await timetable_reply(interaction, class_name, normalized_date)
+    
+    await interaction.response.send_message(embed=embed, view=view)
+
+@app_commands.command(name="timetable_week", description="Get a class's timetable for the whole cycle as an image")
+@app_commands.describe(
+    class_name="Class name (e.g., 1A, 2B, 3C, 4D)"
+)
+async def timetable_week(interaction: discord.Interaction, class_name: str):
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /timetable_week - Inputs: class_name={class_name}")
     
+    if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
+        logger.error(f"Bot lacks send_messages permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to send messages in this channel.", ephemeral=True)
+        return
+    if not interaction.channel.permissions_for(interaction.guild.me).attach_files:
+        logger.error(f"Bot lacks attach_files permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to attach files in this channel.", ephemeral=True)
+        return
+    
+    try:
+        store = guild_dataset(interaction).load_store()
+    except Exception as e:
+        logger.error(f"Error loading timetable data: {str(e)}")
+        await interaction.response.send_message(f"Error: {str(e)}", ephemeral=True)
+        return
+    if not store.has_class(class_name):
+        await interaction.response.send_message(f"Error: Class {class_name} not found in timetale.json", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
+    # Drawing takes tens of milliseconds the first time; repeat requests are served from memory
+    timetable_image = timed_import('timetable_image')
+    png = await asyncio.to_thread(timetable_image.render_week, store, class_name)
+    if png is None:
+        await interaction.followup.send(f"Error: No timetable found for class {class_name}", ephemeral=True)
+        return
+    
+    filename = f"timetable_{class_name}.png"
     embed = discord.Embed(
-        title=f"Timetable for {class_name} on {normalized_date}",
-        description="Schedule for the requested class and date.",
+        title=f"Timetable for {class_name}",
+        description="Every cycle day at a glance.",
         color=0x00b7eb
     )
-    embed.set_thumbnail(url=bot.user.avatar.url)
+    embed.set_image(url=f"attachment://{filename}")
     embed.set_footer(
-        text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
+        text="Use /timetable for a specific date. Contact the bot owner for issues.",
         icon_url=interaction.user.avatar.url if interaction.user.avatar else None
     )
     
-    if isinstance(result, str):
-        embed.add_field(name="Lessons", value=result, inline=False)
+    await interaction.followup.send(embed=embed, file=discord.File(io.BytesIO(png), filename=filename))
+
+# Discord rejects embeds with a field value longer than this
+EMBED_FIELD_LIMIT = 1024
+
+def add_activities_fields(embed: discord.Embed, result):
+    """Add the fields for a get_activities result to an embed."""
+    if not result.ok:
+        embed.add_field(name="Error", value=result.error, inline=False)
+        return
+    day = result.value
+    if day.stale_note:
+        embed.add_field(name="Offline", value=day.stale_note, inline=False)
+    if day.closest_date_note:
+        embed.add_field(name="Note", value=day.closest_date_note, inline=False)
+    if not day.slots:
+        filters = f" ({day.filter_label})" if day.filter_label else ""
+        embed.add_field(name="Activities", value=f"No activities scheduled on {day.date}{filters}", inline=False)
     else:
-        lessons = "\n".join(result) if result else "No lessons scheduled."
-        embed.add_field(name="Lessons", value=lessons, inline=False)
-    
-    view = create_timetable_view(class_name, normalized_date)
-    
-    await interaction.response.send_message(embed=embed, view=view)
+        activities_text = "\n".join(
+            f"**{slot.name}**:\n" + "\n".join(f"- {line}" for line in slot.lines())
+            for slot in day.slots
+        )
+        if len(activities_text) > EMBED_FIELD_LIMIT:
+            # Cut at a line break, leaving room for the hint
+            hint = "\n… more not shown; use the grade or slot options to narrow it down."
+            activities_text = activities_text[:EMBED_FIELD_LIMIT - len(hint)].rsplit("\n", 1)[0] + hint
+        embed.add_field(name="Activities", value=activities_text, inline=False)
+    embed.add_field(name="Remarks", value=day.remark if day.remark else "None", inline=False)
 
-def create_activities_view(current_date: str) -> discord.ui.View:
+def create_activities_view(current_date: str, grade: str = None, slot: str = None) -> discord.ui.View:
     """Helper function to create a view with activities buttons."""
     view = discord.ui.View(timeout=None)
     
+    @metrics.timed('button', 'previous_day_activities')
     async def previous_day_activities(interaction: discord.Interaction):
-        logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Previous Day Activities button - Inputs: date={current_date}")
+        logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Previous Day Activities button - Inputs: date={current_date}, grade={grade}, slot={slot}")
         try:
             date_obj = datetime.strptime(current_date, '%d/%m/%Y')
             prev_day = date_obj - timedelta(days=1)
@@ -135,36 +347,7 @@ def create_activities_view(current_date: str) -> discord.ui.View:
             await interaction.response.send_message("Error: Invalid date format in button action.", ephemeral=True)
             return
         
-        result = get_activities(prev_date)
-        
-        embed = discord.Embed(
-            title=f"Activities on {prev_date}",
-            description="Activities and remarks for the requested date.",
-            color=0x00b7eb
-        )
-        embed.set_thumbnail(url=bot.user.avatar.url)
-        embed.set_footer(
-            text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
-            icon_url=interaction.user.avatar.url if interaction.user.avatar else None
-        )
-        
-        if isinstance(result, str):
-            embed.add_field(name="Error", value=result, inline=False)
-        else:
-            if 'message' in result:
-                embed.add_field(name="Note", value=result['message'], inline=False)
-            activities = result['activities']
-            if 'message' in activities:
-                embed.add_field(name="Activities", value=activities['message'], inline=False)
-            else:
-                activities_text = ""
-                for slot, activities_list in activities.items():
-                    activities_text += f"**{slot}**:\n" + "\n".join([f"- {activity}" for activity in activities_list]) + "\n"
-                embed.add_field(name="Activities", value=activities_text.strip() or "None", inline=False)
-            remark = result.get('remark', '')
-            embed.add_field(name="Remarks", value=remark if remark else "None", inline=False)
-        
-        new_view = create_activities_view(prev_date)
+        embed, new_view = await activities_reply(interaction, prev_date, grade, slot)
         
         await interaction.response.edit_message(embed=embed, view=new_view)
     
@@ -172,8 +355,9 @@ def create_activities_view(current_date: str) -> discord.ui.View:
     previous_day_button.callback = previous_day_activities
     view.add_item(previous_day_button)
     
+    @metrics.timed('button', 'next_day_activities')
     async def next_day_activities(interaction: discord.Interaction):
-        logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Next Day Activities button - Inputs: date={current_date}")
+        logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Next Day Activities button - Inputs: date={current_date}, grade={grade}, slot={slot}")
         try:
             date_obj = datetime.strptime(current_date, '%d/%m/%Y')
             next_day = date_obj + timedelta(days=1)
@@ -183,36 +367,7 @@ def create_activities_view(current_date: str) -> discord.ui.View:
             await interaction.response.send_message("Error: Invalid date format in button action.", ephemeral=True)
             return
         
-        result = get_activities(next_date)
-        
-        embed = discord.Embed(
-            title=f"Activities on {next_date}",
-            description="Activities and remarks for the requested date.",
-            color=0x00b7eb
-        )
-        embed.set_thumbnail(url=bot.user.avatar.url)
-        embed.set_footer(
-            text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
-            icon_url=interaction.user.avatar.url if interaction.user.avatar else None
-        )
-        
-        if isinstance(result, str):
-            embed.add_field(name="Error", value=result, inline=False)
-        else:
-            if 'message' in result:
-                embed.add_field(name="Note", value=result['message'], inline=False)
-            activities = result['activities']
-            if 'message' in activities:
-                embed.add_field(name="Activities", value=activities['message'], inline=False)
-            else:
-                activities_text = ""
-                for slot, activities_list in activities.items():
-                    activities_text += f"**{slot}**:\n" + "\n".join([f"- {activity}" for activity in activities_list]) + "\n"
-                embed.add_field(name="Activities", value=activities_text.strip() or "None", inline=False)
-            remark = result.get('remark', '')
-            embed.add_field(name="Remarks", value=remark if remark else "None", inline=False)
-        
-        new_view = create_activities_view(next_date)
+        embed, new_view = await activities_reply(interaction, next_date, grade, slot)
         
         await interaction.response.edit_message(embed=embed, view=new_view)
     
@@ -222,11 +377,10 @@ def create_activities_view(current_date: str) -> discord.ui.View:
     
     return view
 
-def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View:
+def create_timetable_view(class_name: str, current_date: str, classes: list) -> discord.ui.View:
     """Helper function to create a view with timetable buttons and class dropdown."""
     view = discord.ui.View(timeout=None)
     
-    classes = get_available_classes()
     if classes:
         class_select = discord.ui.Select(
             placeholder="Select another class...",
@@ -238,36 +392,19 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
             max_values=1
         )
         
+        @metrics.timed('button', 'class_select')
         async def class_select_callback(interaction: discord.Interaction):
             selected_class = class_select.values[0]
             logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Timetable class selection - Inputs: class_name={selected_class}, date={current_date}")
             
-            result = get_timetable(selected_class, current_date)
-            
-            embed = discord.Embed(
-                title=f"Timetable for {selected_class} on {current_date}",
-                description="Schedule for the requested class and date.",
-                color=0x00b7eb
-            )
-            embed.set_thumbnail(url=bot.user.avatar.url)
-            embed.set_footer(
-                text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
-                icon_url=interaction.user.avatar.url if interaction.user.avatar else None
-            )
-            
-            if isinstance(result, str):
-                embed.add_field(name="Lessons", value=result, inline=False)
-            else:
-                lessons = "\n".join(result) if result else "No lessons scheduled."
-                embed.add_field(name="Lessons", value=lessons, inline=False)
-            
-            new_view = create_timetable_view(selected_class, current_date)
+            embed, new_view = await timetable_reply(interaction, selected_class, current_date)
             
             await interaction.response.edit_message(embed=embed, view=new_view)
         
         class_select.callback = class_select_callback
         view.add_item(class_select)
     
+    @metrics.timed('button', 'show_activities')
     async def show_activities(interaction: discord.Interaction):
         logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Show Activities button - Inputs: date={current_date}")
         try:
@@ -278,36 +415,7 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
             await interaction.response.send_message("Error: Invalid date format in button action.", ephemeral=True)
             return
         
-        result = get_activities(button_date)
-        
-        embed = discord.Embed(
-            title=f"Activities on {button_date}",
-            description="Activities and remarks for the requested date.",
-            color=0x00b7eb
-        )
-        embed.set_thumbnail(url=bot.user.avatar.url)
-        embed.set_footer(
-            text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
-            icon_url=interaction.user.avatar.url if interaction.user.avatar else None
-        )
-        
-        if isinstance(result, str):
-            embed.add_field(name="Error", value=result, inline=False)
-        else:
-            if 'message' in result:
-                embed.add_field(name="Note", value=result['message'], inline=False)
-            activities = result['activities']
-            if 'message' in activities:
-                embed.add_field(name="Activities", value=activities['message'], inline=False)
-            else:
-                activities_text = ""
-                for slot, activities_list in activities.items():
-                    activities_text += f"**{slot}**:\n" + "\n".join([f"- {activity}" for activity in activities_list]) + "\n"
-                embed.add_field(name="Activities", value=activities_text.strip() or "None", inline=False)
-            remark = result.get('remark', '')
-            embed.add_field(name="Remarks", value=remark if remark else "None", inline=False)
-        
-        activities_view = create_activities_view(button_date)
+        embed, activities_view = await activities_reply(interaction, button_date)
         
         await interaction.response.send_message(embed=embed, view=activities_view, ephemeral=True)
     
@@ -315,6 +423,7 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
     activities_button.callback = show_activities
     view.add_item(activities_button)
     
+    @metrics.timed('button', 'previous_day_timetable')
     async def previous_day_timetable(interaction: discord.Interaction):
         logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Previous Day Timetable button - Inputs: class_name={class_name}, date={current_date}")
         try:
@@ -326,26 +435,7 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
             await interaction.response.send_message("Error: Invalid date format in button action.", ephemeral=True)
             return
         
-        result = get_timetable(class_name, prev_date)
-        
-        embed = discord.Embed(
-            title=f"Timetable for {class_name} on {prev_date}",
-            description="Schedule for the requested class and date.",
-            color=0x00b7eb
-        )
-        embed.set_thumbnail(url=bot.user.avatar.url)
-        embed.set_footer(
-            text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
-            icon_url=interaction.user.avatar.url if interaction.user.avatar else None
-        )
-        
-        if isinstance(result, str):
-            embed.add_field(name="Lessons", value=result, inline=False)
-        else:
-            lessons = "\n".join(result) if result else "No lessons scheduled."
-            embed.add_field(name="Lessons", value=lessons, inline=False)
-        
-        new_view = create_timetable_view(class_name, prev_date)
+        embed, new_view = await timetable_reply(interaction, class_name, prev_date)
         
         await interaction.response.edit_message(embed=embed, view=new_view)
     
@@ -353,6 +443,7 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
     previous_day_button.callback = previous_day_timetable
     view.add_item(previous_day_button)
 
+    @metrics.timed('button', 'next_day_timetable')
     async def next_day_timetable(interaction: discord.Interaction):
         logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Action: Next Day Timetable button - Inputs: class_name={class_name}, date={current_date}")
         try:
@@ -364,26 +455,7 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
             await interaction.response.send_message("Error: Invalid date format in button action.", ephemeral=True)
             return
         
-        result = get_timetable(class_name, next_date)
-        
-        embed = discord.Embed(
-            title=f"Timetable for {class_name} on {next_date}",
-            description="Schedule for the requested class and date.",
-            color=0x00b7eb
-        )
-        embed.set_thumbnail(url=bot.user.avatar.url)
-        embed.set_footer(
-            text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
-            icon_url=interaction.user.avatar.url if interaction.user.avatar else None
-        )
-        
-        if isinstance(result, str):
-            embed.add_field(name="Lessons", value=result, inline=False)
-        else:
-            lessons = "\n".join(result) if result else "No lessons scheduled."
-            embed.add_field(name="Lessons", value=lessons, inline=False)
-        
-        new_view = create_timetable_view(class_name, next_date)
+        embed, new_view = await timetable_reply(interaction, class_name, next_date)
         
         await interaction.response.edit_message(embed=embed, view=new_view)
     
@@ -397,10 +469,13 @@ def create_timetable_view(class_name: str, current_date: str) -> discord.ui.View
 
 @app_commands.command(name="activities", description="Get activities for a specific date from the server")
 @app_commands.describe(
-    date="Date in DD/MM/YYYY format (defaults to today)"
+    date="Date in DD/MM/YYYY format (defaults to today)",
+    grade="Only show this form's activities (and whole-school ones)",
+    slot="Only show this time slot (e.g., AM, PM)"
 )
-async def activities(interaction: discord.Interaction, date: str = None):
-    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /activities - Inputs: date={date}")
+@app_commands.choices(grade=[app_commands.Choice(name=grade, value=grade) for grade in GRADES])
+async def activities(interaction: discord.Interaction, date: str = None, grade: str = None, slot: str = None):
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /activities - Inputs: date={date}, grade={grade}, slot={slot}")
     
     if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
         logger.error(f"Bot lacks send_messages permission in channel {interaction.channel_id}")
@@ -419,47 +494,207 @@ async def activities(interaction: discord.Interaction, date: str = None):
         await interaction.response.send_message("Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)", ephemeral=True)
         return
     
-    result = get_activities(normalized_date)
+    embed, view = await activities_reply(interaction, normalized_date, grade, slot)
+    
+    await interaction.response.send_message(embed=embed, view=view)
+
+@activities.autocomplete("slot")
+async def slot_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=name[:100], value=name)
+        for name in guild_dataset(interaction).feed.days.slot_names()
+        if current.lower() in name.lower()
+    ][:25]
+
+@app_commands.command(name="search_activities", description="Search all scheduled activities and remarks")
+@app_commands.describe(
+    query="Words to search for (e.g., sports day, 陸運會)"
+)
+async def search_activities(interaction: discord.Interaction, query: str):
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /search_activities - Inputs: query={query}")
+    
+    if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
+        logger.error(f"Bot lacks send_messages permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to send messages in this channel.", ephemeral=True)
+        return
+    
+    feed = guild_dataset(interaction).feed
+    
+    # Only the first search after startup (or after a long outage) has to wait for the feed
+    if feed.needs_refresh():
+        await interaction.response.defer()
+    
+    try:
+        matches = await asyncio.to_thread(feed.search, query, 25)
+        error = None
+    except FeedError as e:
+        matches = []
+        error = str(e)
     
     embed = discord.Embed(
-        title=f"Activities on {normalized_date}",
-        description="Activities and remarks for the requested date.",
+        title=f"Activities matching \"{query}\"",
+        description=f"Searched every date in the event schedule (updated {feed.fetched_at_display()}).",
         color=0x00b7eb
     )
     embed.set_thumbnail(url=bot.user.avatar.url)
     embed.set_footer(
-        text="Use DD/MM/YYYY for dates. Contact the bot owner for issues.",
+        text="Use /activities to see everything on a date. Contact the bot owner for issues.",
         icon_url=interaction.user.avatar.url if interaction.user.avatar else None
     )
     
-    if isinstance(result, str):
-        embed.add_field(name="Error", value=result, inline=False)
+    if error:
+        embed.add_field(name="Error", value=error, inline=False)
+    elif not matches:
+        embed.add_field(name="Results", value="No matching activities found.", inline=False)
     else:
-        if 'message' in result:
-            embed.add_field(name="Note", value=result['message'], inline=False)
-        activities = result['activities']
-        if 'message' in activities:
-            embed.add_field(name="Activities", value=activities['message'], inline=False)
-        else:
-            activities_text = ""
-            for slot, activities_list in activities.items():
-                activities_text += f"**{slot}**:\n" + "\n".join([f"- {activity}" for activity in activities_list]) + "\n"
-            embed.add_field(name="Activities", value=activities_text.strip() or "None", inline=False)
-        remark = result.get('remark', '')
-        embed.add_field(name="Remarks", value=remark if remark else "None", inline=False)
+        results_text = ""
+        for match in matches:
+            line = f"**{match['date']}** ({match['slot']}) {match['activity']}\n"
+            if len(results_text) + len(line) > 1024:
+                break
+            results_text += line
+        embed.add_field(name="Results", value=results_text.strip(), inline=False)
+    
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=embed)
+    else:
+        await interaction.response.send_message(embed=embed)
+
+@app_commands.command(name="activity_alerts", description="Turn event schedule change notices on or off for this channel")
+@app_commands.describe(
+    enabled="Whether this channel should receive a notice when activities are added or changed"
+)
+@app_commands.default_permissions(manage_channels=True)
+async def activity_alerts(interaction: discord.Interaction, enabled: bool):
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /activity_alerts - Inputs: enabled={enabled}, channel={interaction.channel_id}")
     
-    view = create_activities_view(normalized_date)
+    if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
+        logger.error(f"Bot lacks send_messages permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to send messages in this channel.", ephemeral=True)
+        return
     
-    await interaction.response.send_message(embed=embed, view=view)
+    if enabled:
+        changed = activity_alert_channels.add(interaction.channel_id)
+        message = "This channel will now be notified when the event schedule changes." if changed else "This channel is already receiving event schedule change notices."
+    else:
+        changed = activity_alert_channels.remove(interaction.channel_id)
+        message = "This channel will no longer receive event schedule change notices." if changed else "This channel was not receiving event schedule change notices."
+    
+    await interaction.response.send_message(message, ephemeral=True)
 
-@app_commands.command(name="qrcode", description="Generate a QR code for a given URL with a selected style and color")
+def build_feed_changes_embed(diff) -> discord.Embed:
+    """Build the notice posted to subscribed channels when the event schedule changes."""
+    embed = discord.Embed(
+        title="Event Schedule Updated",
+        description=f"{len(diff.added)} date(s) added, {len(diff.changed)} changed, {len(diff.removed)} removed.",
+        color=0x00b7eb
+    )
+    embed.set_thumbnail(url=bot.user.avatar.url)
+    embed.set_footer(text="Use /activity_alerts to turn these notices off.")
+    
+    for date_key in diff.dates()[:10]:
+        added, removed = diff.entries[date_key]
+        lines = [f"+ ({slot}) {text}" for slot, text in added] + [f"- ({slot}) {text}" for slot, text in removed]
+        value = "\n".join(lines) or "Details changed."
+        if len(value) > 1024:
+            value = value[:1020] + "\n..."
+        embed.add_field(name=display_date(date_key), value=value, inline=False)
+    if len(diff) > 10:
+        embed.add_field(name="More", value=f"{len(diff) - 10} more date(s) changed. Use /activities to check them.", inline=False)
+    return embed
+
+async def post_feed_changes(school_id: str, diff):
+    """Send a change notice to every subscribed channel in servers bound to the school."""
+    embed = build_feed_changes_embed(diff)
+    for channel_id in activity_alert_channels:
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            # With SHARD_IDS set, the channel's server may belong to another shard process, which posts it
+            if SHARD_IDS is None:
+                logger.warning(f"Activity alert channel {channel_id} not found, skipping")
+            continue
+        if datasets.school_for_guild(channel.guild.id) != school_id:
+            continue
+        try:
+            await channel.send(embed=embed)
+        except discord.errors.Forbidden:
+            logger.error(f"Bot lacks permission to post activity alerts in channel {channel_id}")
+        except discord.errors.HTTPException as e:
+            logger.error(f"Failed to post activity alert to channel {channel_id}: {e}")
+
+def on_feed_changed(school_id: str, diff):
+    # Called from whichever thread refreshed the feed
+    logger.info(f"Event schedule for {school_id} changed on {len(diff)} date(s)")
+    if len(activity_alert_channels) and bot.is_ready():
+        asyncio.run_coroutine_threadsafe(post_feed_changes(school_id, diff), bot.loop)
+
+datasets.add_feed_listener(on_feed_changed)
+
+@app_commands.command(name="school", description="Show or change which school this server's timetable and activities come from")
+@app_commands.describe(
+    school="The school to use in this server (leave empty to see the current one)"
+)
+@app_commands.default_permissions(manage_guild=True)
+async def school_command(interaction: discord.Interaction, school: str = None):
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /school - Inputs: school={school}, guild={interaction.guild_id}")
+    
+    if not interaction.guild:
+        await interaction.response.send_message("Error: This command can only be used in a server.", ephemeral=True)
+        return
+    
+    if school is not None:
+        try:
+            datasets.bind_guild(interaction.guild_id, school)
+        except KeyError:
+            await interaction.response.send_message(f"Error: Unknown school {school}.", ephemeral=True)
+            return
+    
+    profile = datasets.profiles[datasets.school_for_guild(interaction.guild_id)]
+    message = f"This server now uses **{profile.name}**." if school is not None else f"This server uses **{profile.name}**."
+    await interaction.response.send_message(message, ephemeral=True)
+
+@school_command.autocomplete("school")
+async def school_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=profile.name[:100], value=school_id)
+        for school_id, profile in datasets.profiles.items()
+        if current.lower() in school_id.lower() or current.lower() in profile.name.lower()
+    ][:25]
+
+async def qr_image(url: str, style: str, color: str = None):
+    """
+    Returns (embed image URL, files to attach) for a QR code.
+
+    With QR_IMAGE_CHANNEL_ID set, the image is uploaded there once and shown from its CDN URL until
+    that is about to expire. Otherwise, or if that upload fails, it is attached as qrcode.png.
+    """
+    key = attachment_urls.content_key(url, style, color)
+    if QR_IMAGE_CHANNEL_ID is not None:
+        cdn_url = attachment_urls.qr_attachment_urls.get(key)
+        if cdn_url is not None:
+            return cdn_url, []
+    data = await asyncio.to_thread(timed_import('qr_code').qr_code_bytes, url, style=style, color=color)
+    if QR_IMAGE_CHANNEL_ID is not None:
+        try:
+            message = await bot.get_partial_messageable(QR_IMAGE_CHANNEL_ID).send(
+                file=discord.File(io.BytesIO(data), filename="qrcode.png")
+            )
+        except discord.errors.HTTPException as e:
+            logger.error(f"Failed to upload QR image to channel {QR_IMAGE_CHANNEL_ID}, attaching it instead: {e}")
+        else:
+            cdn_url = attachment_urls.qr_attachment_urls.record_upload(key, message, "qrcode.png")
+            if cdn_url is not None:
+                return cdn_url, []
+    return "attachment://qrcode.png", [discord.File(io.BytesIO(data), filename="qrcode.png")]
+
+@app_commands.command(name="qrcode",description="Generate a QR code for a given URL with a selected style and color")
 @app_commands.describe(
     url="The URL to encode in the QR code (e.g., https://example.com)",
-    color="QR code color (e.g., red, #FF0000, blue; defaults to black)"
+    color="QR code color (e.g., red, #FF0000, blue; defaults to black)",
+    svg="Also attach the QR code as an SVG vector file, for printing"
 )
-async def qrcode(interaction: discord.Interaction, url: str, color: str = None):
-    log_message = f"User: {interaction.user.id} ({interaction.user.name}) - Command: /qrcode - Inputs: url={url}, style=horizontal_gradient, color={color or 'black'}"
-    logger.info(log_message)
+async def qrcode(interaction: discord.Interaction, url: str, color: str = None, svg: bool = False):
+    log_message = f"User: {interaction.user.id} ({interaction.user.name}) - Command: /qrcode - Inputs: url={url}, style=horizontal_gradient, color={color or 'black'}, svg={svg}"
     qrcode_logger.info(log_message)
     
     if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
@@ -479,21 +714,23 @@ async def qrcode(interaction: discord.Interaction, url: str, color: str = None):
     await interaction.response.defer()
     
     try:
-        qr_bytes = generate_qr_code(url, style="horizontal_gradient", color=color)
+        image_url, files = await qr_image(url, "horizontal_gradient", color)
+        if svg:
+            svg_bytes = await asyncio.to_thread(
+                timed_import('qr_code').qr_code_bytes, url, style="horizontal_gradient", color=color, fmt="svg"
+            )
+            files.append(discord.File(io.BytesIO(svg_bytes), filename="qrcode.svg"))
     except Exception as e:
-        logger.error(f"Failed to generate QR code: {str(e)}")
         qrcode_logger.error(f"User: {interaction.user.id} ({interaction.user.name}) - Failed to generate QR code: {str(e)}")
         await interaction.followup.send("Error: Failed to generate QR code. Please try again or contact the bot owner.", ephemeral=True)
         return
     
-    qr_file = discord.File(qr_bytes, filename="qrcode.png")
-    
     embed = discord.Embed(
         title="QR Code",
         description=f"QR code for: {url}\nStyle: Horizontal Gradient\nColor: {color or 'Black'}",
         color=0x00b7eb
     )
-    embed.set_image(url="attachment://qrcode.png")
+    embed.set_image(url=image_url)
     embed.set_thumbnail(url=bot.user.avatar.url)
     embed.set_footer(
         text="Select a style below to regenerate the QR code.",
@@ -502,7 +739,67 @@ async def qrcode(interaction: discord.Interaction, url: str, color: str = None):
     
     view = create_qr_view(url, current_style="horizontal_gradient", current_color=color)
     
-    await interaction.followup.send(embed=embed, file=qr_file, view=view)
+    await interaction.followup.send(embed=embed, files=files, view=view)
+
+@app_commands.command(name="qrcode_bulk", description="Generate QR codes for a list of URLs as a ZIP file")
+@app_commands.describe(
+    file="Text or CSV file with one URL per line, optionally as 'label,url'",
+    style="QR code style (defaults to solid)",
+    color="QR code color (e.g., red, #FF0000, blue; defaults to black)",
+    format="Image format (defaults to PNG)"
+)
+@app_commands.choices(style=[
+    app_commands.Choice(name="Solid Color", value="solid"),
+    app_commands.Choice(name="Horizontal Gradient", value="horizontal_gradient"),
+    app_commands.Choice(name="Vertical Gradient", value="vertical_gradient"),
+    app_commands.Choice(name="Radial Gradient", value="radial_gradient")
+], format=[
+    app_commands.Choice(name="PNG", value="png"),
+    app_commands.Choice(name="SVG (vector, for printing)", value="svg")
+])
+async def qrcode_bulk(interaction: discord.Interaction, file: discord.Attachment, style: str = "solid", color: str = None, format: str = "png"):
+    log_message = f"User: {interaction.user.id} ({interaction.user.name}) - Command: /qrcode_bulk - Inputs: file={file.filename} ({file.size} bytes), style={style}, color={color or 'black'}, format={format}"
+    qrcode_logger.info(log_message)
+    
+    if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
+        logger.error(f"Bot lacks send_messages permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to send messages in this channel.", ephemeral=True)
+        return
+    if not interaction.channel.permissions_for(interaction.guild.me).attach_files:
+        logger.error(f"Bot lacks attach_files permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to attach files in this channel.", ephemeral=True)
+        return
+    if file.size > 256 * 1024:
+        await interaction.response.send_message("Error: The URL list must be under 256 KB.", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
+    qr_bulk = timed_import('qr_bulk')
+    try:
+        entries, skipped = qr_bulk.parse_url_list(await file.read())
+        archive = await asyncio.to_thread(qr_bulk.build_qr_zip, entries, style, color, format)
+    except qr_bulk.BulkQRError as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+    except Exception as e:
+        qrcode_logger.error(f"User: {interaction.user.id} ({interaction.user.name}) - Failed to generate QR codes: {str(e)}")
+        await interaction.followup.send("Error: Failed to generate QR codes. Please try again or contact the bot owner.", ephemeral=True)
+        return
+    
+    embed = discord.Embed(
+        title="QR Codes",
+        description=f"{len(entries)} QR code(s) ({format.upper()}) in the attached ZIP, with a manifest.csv listing each file's label and URL.",
+        color=0x00b7eb
+    )
+    if skipped:
+        embed.add_field(name=f"Skipped {len(skipped)} line(s)", value="\n".join(skipped[:10])[:1024], inline=False)
+    embed.set_footer(
+        text="Use /qrcode to style a single code. Contact the bot owner for issues.",
+        icon_url=interaction.user.avatar.url if interaction.user.avatar else None
+    )
+    
+    await interaction.followup.send(embed=embed, file=discord.File(io.BytesIO(archive), filename="qrcodes.zip"))
 
 def create_qr_view(url: str, current_style: str, current_color: str = None) -> discord.ui.View:
     """Helper function to create a view with QR code style dropdown."""
@@ -542,22 +839,21 @@ def create_qr_view(url: str, current_style: str, current_color: str = None) -> d
         max_values=1
     )
     
+    @metrics.timed('button', 'qr_style_select')
     async def style_select_callback(interaction: discord.Interaction):
         selected_style = style_select.values[0]
         log_message = f"User: {interaction.user.id} ({interaction.user.name}) - Action: QR code style selection - Inputs: url={url}, style={selected_style}, color={current_color or 'black'}"
-        logger.info(log_message)
         qrcode_logger.info(log_message)
         
+        # Rendering and uploading the image can take longer than Discord's 3 s to answer
+        await interaction.response.defer()
         try:
-            qr_bytes = generate_qr_code(url, style=selected_style, color=current_color)
+            image_url, attachments = await qr_image(url, selected_style, current_color)
         except Exception as e:
-            logger.error(f"Failed to generate QR code: {str(e)}")
             qrcode_logger.error(f"User: {interaction.user.id} ({interaction.user.name}) - Failed to generate QR code: {str(e)}")
-            await interaction.response.send_message("Error: Failed to generate QR code. Please try again or contact the bot owner.", ephemeral=True)
+            await interaction.followup.send("Error: Failed to generate QR code. Please try again or contact the bot owner.", ephemeral=True)
             return
         
-        qr_file = discord.File(qr_bytes, filename="qrcode.png")
-        
         style_names = {
             "solid": "Solid Color",
             "horizontal_gradient": "Horizontal Gradient",
@@ -569,7 +865,7 @@ def create_qr_view(url: str, current_style: str, current_color: str = None) -> d
             description=f"QR code for: {url}\nStyle: {style_names[selected_style]}\nColor: {current_color or 'Black'}",
             color=0x00b7eb
         )
-        embed.set_image(url="attachment://qrcode.png")
+        embed.set_image(url=image_url)
         embed.set_thumbnail(url=bot.user.avatar.url)
         embed.set_footer(
             text="Select a style below to regenerate the QR code.",
@@ -578,7 +874,7 @@ def create_qr_view(url: str, current_style: str, current_color: str = None) -> d
         
         new_view = create_qr_view(url, current_style=selected_style, current_color=current_color)
         
-        await interaction.response.edit_message(embed=embed, attachments=[qr_file], view=new_view)
+        await interaction.edit_original_response(embed=embed, attachments=attachments, view=new_view)
     
     style_select.callback = style_select_callback
     view.add_item(style_select)
@@ -606,7 +902,7 @@ async def ask_ai(interaction: discord.Interaction, query: str, model: str = "gpt
     
     messages = [{'role': 'user', 'content': query}]
     
-    response = gpt_35_api(messages, model=model)
+    response = timed_import('request_AI').gpt_35_api(messages, model=model)
     
     embed = discord.Embed(
         title="AI Response",
@@ -738,17 +1034,19 @@ async def suggestion_command(interaction: discord.Interaction, message: str):
         logger.error(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /suggestion - Failed to send suggestion: {str(e)}")
         await interaction.followup.send(f"Error: Failed to send suggestion: {str(e)}", ephemeral=True)
 
-@app_commands.command(name="dev", description="Developer command to view bot server info")
+dev_group = app_commands.Group(name="dev", description="Developer commands")
+
+@dev_group.command(name="servers", description="Developer command to view bot server info")
 @app_commands.describe(
     server_name="Name of a specific server to view details (optional)"
 )
-async def dev_command(interaction: discord.Interaction, server_name: str = None):
+async def dev_servers(interaction: discord.Interaction, server_name: str = None):
     if str(interaction.user.id) != DEV_USER_ID:
-        logger.warning(f"Unauthorized user {interaction.user.id} ({interaction.user.name}) attempted /dev command")
+        logger.warning(f"Unauthorized user {interaction.user.id} ({interaction.user.name}) attempted /dev servers command")
         await interaction.response.send_message("Error: This command is restricted to the bot developer.", ephemeral=True)
         return
     
-    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev - Inputs: server_name={server_name}")
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev servers - Inputs: server_name={server_name}")
     
     await interaction.response.defer(ephemeral=True)
     
@@ -786,7 +1084,107 @@ async def dev_command(interaction: discord.Interaction, server_name: str = None)
         embed.add_field(name="Servers", value=guild_names, inline=False)
     
     await interaction.followup.send(embed=embed, ephemeral=True)
-    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev - Response sent")
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev servers - Response sent")
+
+def format_latency_rows(rows, limit=10):
+    """Format metrics summary rows as one line per command, button or upstream."""
+    lines = []
+    for label, count, errors, p50, p95, p99 in rows[:limit]:
+        lines.append(
+            f"`{label}` n={count} err={errors} "
+            f"p50 {p50 * 1000:.0f}ms · p95 {p95 * 1000:.0f}ms · p99 {p99 * 1000:.0f}ms"
+        )
+    value = "\n".join(lines)
+    return value if len(value) <= 1024 else value[:1020] + "\n..."
+
+@dev_group.command(name="stats", description="Developer command to view latency, cache and queue metrics")
+async def dev_stats(interaction: discord.Interaction):
+    if str(interaction.user.id) != DEV_USER_ID:
+        logger.warning(f"Unauthorized user {interaction.user.id} ({interaction.user.name}) attempted /dev stats command")
+        await interaction.response.send_message("Error: This command is restricted to the bot developer.", ephemeral=True)
+        return
+    
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev stats")
+    
+    summary = metrics.summary()
+    embed = discord.Embed(
+        title="Bot Metrics",
+        description="Latency percentiles are estimated from histogram buckets since the bot started.",
+        color=0x00b7eb
+    )
+    titles = {'command': "Commands", 'button': "Buttons", 'upstream': "Upstream Calls"}
+    for metric, title in titles.items():
+        rows = summary['latency'].get(metric)
+        embed.add_field(name=title, value=format_latency_rows(rows) if rows else "No data yet", inline=False)
+    loop_lag = summary['latency'].get('loop_lag')
+    if loop_lag:
+        _, _, _, _, p95, p99 = loop_lag[0]
+        stall_lines = [f"Lag p95 {p95 * 1000:.0f}ms · p99 {p99 * 1000:.0f}ms, {len(loop_watchdog.stalls)} recent stall(s)"]
+        stall_lines += [
+            f"`{stall.at.strftime('%H:%M:%S')}` {stall.duration * 1000:.0f}ms in `{stall.handler}` ({stall.location()})"
+            for stall in loop_watchdog.recent_stalls()
+        ]
+        value = "\n".join(stall_lines)
+        embed.add_field(name="Event Loop", value=value if len(value) <= 1024 else value[:1020] + "\n...", inline=False)
+    if summary['caches']:
+        embed.add_field(name="Caches", value="\n".join(
+            f"`{name}` {hits}/{hits + misses} hits ({hits / (hits + misses):.0%})"
+            for name, hits, misses in summary['caches']
+        ), inline=False)
+    if summary['gauges']:
+        embed.add_field(name="Queues", value="\n".join(
+            f"`{name}` {value:g}" for name, value in summary['gauges'].items()
+        ), inline=False)
+    embed.set_footer(
+        text="Developer command",
+        icon_url=interaction.user.avatar.url if interaction.user.avatar else None
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@dev_group.command(name="profile", description="Developer command to profile the live bot for a few seconds")
+@app_commands.describe(
+    seconds="How long to sample for (1-60, defaults to 10)",
+    output="Collapsed stacks for flame graphs, or a pstats file"
+)
+@app_commands.choices(output=[
+    app_commands.Choice(name="Collapsed stacks", value="collapsed"),
+    app_commands.Choice(name="pstats", value="pstats")
+])
+async def dev_profile(interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 60] = 10, output: str = "collapsed"):
+    if str(interaction.user.id) != DEV_USER_ID:
+        logger.warning(f"Unauthorized user {interaction.user.id} ({interaction.user.name}) attempted /dev profile command")
+        await interaction.response.send_message("Error: This command is restricted to the bot developer.", ephemeral=True)
+        return
+    
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev profile - Inputs: seconds={seconds}, output={output}")
+    
+    await interaction.response.defer(ephemeral=True)
+    
+    sampling_profiler = timed_import('sampling_profiler')
+    try:
+        profiler = await asyncio.to_thread(sampling_profiler.SamplingProfiler().run, seconds)
+    except sampling_profiler.ProfilerBusy:
+        await interaction.followup.send("Error: A profile is already running. Try again when it finishes.", ephemeral=True)
+        return
+    
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    if output == "pstats":
+        try:
+            profile_file = discord.File(io.BytesIO(profiler.pstats_bytes()), filename=f"profile-{timestamp}.pstats")
+        except sampling_profiler.NoSamples:
+            await interaction.followup.send(
+                f"Error: No stacks were sampled in {profiler.duration:.1f}s, so there is no pstats file. Try a longer profile.",
+                ephemeral=True
+            )
+            return
+    else:
+        profile_file = discord.File(io.BytesIO(profiler.collapsed().encode('utf-8')), filename=f"profile-{timestamp}.collapsed.txt")
+    await interaction.followup.send(
+        f"Sampled {profiler.sample_count} times over {profiler.duration:.1f}s ({len(profiler.samples)} distinct stacks).",
+        file=profile_file,
+        ephemeral=True
+    )
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /dev profile - Profile sent")
 
 @app_commands.command(name="pm", description="Developer command to send a DM to a user")
 @app_commands.describe(
@@ -839,7 +1237,9 @@ async def weather(interaction: discord.Interaction):
     
     await interaction.response.defer()
     
-    forecast_data = get_weather()
+    # Off the loop: it may wait for another process's fetch of the forecast
+    report = await asyncio.to_thread(timed_import('weather').get_weather_report)
+    forecast_data = report['forecast']
     
     embed = discord.Embed(
         title="Hong Kong 9-Day Weather Forecast",
@@ -852,6 +1252,9 @@ async def weather(interaction: discord.Interaction):
         icon_url=interaction.user.avatar.url if interaction.user.avatar else None
     )
     
+    if report['stale']:
+        embed.add_field(name="Offline", value=f"Hong Kong Observatory unavailable. Showing saved forecast from {report['fetched_at']}.", inline=False)
+    
     if forecast_data and forecast_data[0].startswith("Error:"):
         embed.add_field(name="Error", value=forecast_data[0], inline=False)
     else:
@@ -860,6 +1263,66 @@ async def weather(interaction: discord.Interaction):
     
     await interaction.followup.send(embed=embed)
 
+@app_commands.command(name="bus", description="Get bus arrival times at the stops nearest the school")
+@app_commands.describe(
+    stops="Number of nearby stops to show (1-5, defaults to 3)"
+)
+async def bus_command(interaction: discord.Interaction, stops: app_commands.Range[int, 1, 5] = 3):
+    logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /bus - Inputs: stops={stops}")
+    
+    if not interaction.channel.permissions_for(interaction.guild.me).send_messages:
+        logger.error(f"Bot lacks send_messages permission in channel {interaction.channel_id}")
+        await interaction.response.send_message("Error: Bot lacks permission to send messages in this channel.", ephemeral=True)
+        return
+    
+    await interaction.response.defer()
+    
+    profile = datasets.profiles[datasets.school_for_guild(interaction.guild_id)]
+    embed = discord.Embed(
+        title=f"Buses near {profile.name}",
+        description="Next arrivals at the nearest bus stops.",
+        color=0x00b7eb
+    )
+    embed.set_thumbnail(url=bot.user.avatar.url)
+    embed.set_footer(
+        text="Source: KMB open data. Times are estimates. Contact the bot owner for issues.",
+        icon_url=interaction.user.avatar.url if interaction.user.avatar else None
+    )
+    
+    # The reply is deferred, so every failure has to end in a follow-up or the user waits forever
+    try:
+        bus = timed_import('bus')
+        try:
+            report = await asyncio.to_thread(bus.get_bus_report, profile.location, stops)
+        except bus.BusError as e:
+            embed.add_field(name="Error", value=str(e), inline=False)
+            report = None
+        
+        if report is not None and not report:
+            embed.add_field(name="No stops", value="There are no bus stops near the school.", inline=False)
+        for stop, distance, arrivals in report or ():
+            name = f"{stop.name_tc or stop.name_en} ({distance:.0f} m)"
+            if isinstance(arrivals, bus.BusError):
+                value = str(arrivals)
+            else:
+                lines = []
+                for arrival in arrivals[:6]:
+                    minutes = arrival.minutes()
+                    if minutes is None:
+                        when = arrival.remark or "No scheduled service"
+                    else:
+                        when = "Arriving" if minutes == 0 else f"{minutes} min"
+                    lines.append(f"**{arrival.route}** → {arrival.destination}: {when}")
+                value = "\n".join(lines) or f"No arrivals. Routes: {', '.join(stop.routes) or 'none'}"
+            embed.add_field(name=name[:256], value=value[:1024], inline=False)
+    except Exception as e:
+        logger.error(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /bus - Failed to get bus arrivals: {str(e)}",
+                     exc_info=True)
+        await interaction.followup.send("Error: Failed to get bus arrivals. Please try again later.")
+        return
+    
+    await interaction.followup.send(embed=embed)
+
 @app_commands.command(name="help", description="Show help for using the bot's commands")
 async def help_command(interaction: discord.Interaction):
     logger.info(f"User: {interaction.user.id} ({interaction.user.name}) - Command: /help - Inputs: None")
@@ -888,6 +1351,39 @@ async def help_command(interaction: discord.Interaction):
     
     # ... (Other command descriptions unchanged)
     
+    embed.add_field(
+        name="/activities",
+        value=(
+            "**Description**: Get the activities and remarks for a date.\n"
+            "**Parameters**: `date` (DD/MM/YYYY, optional), `grade` (S1–S6, optional) and `slot` (e.g. AM, PM, optional)\n"
+            "**Output**: Embed with the activities in each slot; `grade` also keeps whole-school activities.\n"
+            "**Example**: `/activities date:03/09/2024 grade:S3`\n"
+        ),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="/search_activities",
+        value=(
+            "**Description**: Search every date in the event schedule for activities and remarks.\n"
+            "**Parameters**: `query` (words to search for)\n"
+            "**Output**: Embed listing matching activities with their dates and slots.\n"
+            "**Example**: `/search_activities query:sports day`\n"
+        ),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="/activity_alerts",
+        value=(
+            "**Description**: Get a notice in this channel whenever the school adds or changes an activity.\n"
+            "**Parameters**: `enabled` (True to subscribe, False to unsubscribe)\n"
+            "**Output**: Confirmation message; notices are posted when the event schedule changes.\n"
+            "**Example**: `/activity_alerts enabled:True`\n"
+        ),
+        inline=False
+    )
+    
     embed.add_field(
         name="/weather",
         value=(
@@ -898,6 +1394,39 @@ async def help_command(interaction: discord.Interaction):
         ),
         inline=False
     )
+    
+    embed.add_field(
+        name="/qrcode_bulk",
+        value=(
+            "**Description**: Generate QR codes for many URLs at once, e.g. for a handout.\n"
+            "**Parameters**: `file` (text or CSV, one URL per line, optionally `label,url`), `style`, `color` and `format` (optional)\n"
+            "**Output**: ZIP file with one PNG or SVG per URL and a manifest.csv.\n"
+            "**Example**: `/qrcode_bulk file:links.csv style:Solid Color`\n"
+        ),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="/timetable_week",
+        value=(
+            "**Description**: Get a class's timetable for every cycle day (A-H) as one image.\n"
+            "**Parameters**: `class_name` (e.g., 3A)\n"
+            "**Output**: Image of the cycle with subjects and venues for each lesson.\n"
+            "**Example**: `/timetable_week class_name:3A`\n"
+        ),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="/bus",
+        value=(
+            "**Description**: Get the next bus arrivals at the stops nearest your school.\n"
+            "**Parameters**: `stops` (optional, 1-5 stops; defaults to 3)\n"
+            "**Output**: Embed with routes, destinations and minutes until arrival for each stop.\n"
+            "**Example**: `/bus stops:2`\n"
+        ),
+        inline=False
+    )
 
 @bot.event
 async def on_message(message: discord.Message):
@@ -930,7 +1459,7 @@ async def on_message(message: discord.Message):
         
         messages = [{'role': 'user', 'content': query}]
         
-        response = gpt_35_api(messages)
+        response = timed_import('request_AI').gpt_35_api(messages)
         
         embed = discord.Embed(
             title="AI Response",
@@ -952,14 +1481,108 @@ async def on_message(message: discord.Message):
     
     await bot.process_commands(message)
 
+def alert_school_ids():
+    """Schools of the servers with /activity_alerts channels (in this shard), whose feeds must keep refreshing."""
+    school_ids = set()
+    for channel_id in activity_alert_channels:
+        channel = bot.get_channel(channel_id)
+        if channel is not None and channel.guild is not None:
+            school_ids.add(datasets.school_for_guild(channel.guild.id))
+    return school_ids
+
+@tasks.loop(minutes=FEED_REFRESH_MINUTES)
+async def refresh_activity_feed():
+    """Keep loaded schools' activity search indexes current, and drop schools nobody is using."""
+    datasets.keep_loaded(alert_school_ids())
+    datasets.evict_idle()
+    for dataset in datasets.loaded():
+        try:
+            await asyncio.to_thread(dataset.feed.refresh)
+        except FeedError as e:
+            logger.error(f"Background activity feed refresh failed for {dataset.profile.school_id}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error refreshing the activity feed for {dataset.profile.school_id}: {e}",
+                         exc_info=True)
+
+@tasks.loop(minutes=TIMETABLE_SYNC_MINUTES)
+async def sync_timetable():
+    """Pick up timetable changes without a redeploy; the new data is built off the event loop and swapped in."""
+    for dataset in datasets.loaded():
+        if dataset.sync is None:
+            continue
+        try:
+            await asyncio.to_thread(dataset.sync.sync)
+        except SyncError as e:
+            logger.error(f"Timetable sync failed for {dataset.profile.school_id}, keeping current timetable: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected timetable sync error for {dataset.profile.school_id}, keeping current timetable: {e}",
+                         exc_info=True)
+
+def warm_up():
+    """Load heavy subsystems and cached data in the background so the first commands using them are fast."""
+    for module_name in ('qr_code', 'request_AI', 'weather', 'timetable_image'):
+        try:
+            timed_import(module_name)
+        except Exception as e:
+            logger.error(f"Warm-up failed to import {module_name}: {e}")
+    try:
+        timed_import('request_AI').get_client()
+    except Exception as e:
+        logger.error(f"Warm-up failed to create the OpenAI client: {e}")
+    try:
+        # Serve the last good upstream data straight away, even before the first fetch succeeds
+        timed_import('weather').restore_weather_snapshot()
+        datasets.get(datasets.default_school_id).load_store()
+    except Exception as e:
+        logger.error(f"Warm-up failed to load cached data: {e}")
+
+def _warm_up_and_report():
+    warm_up()
+    mark("warm-up")
+    logger.info(startup_report())
+
+_warmed_up = False
+_commands_synced = False
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    record_command_metrics(interaction)
+
 @bot.event
 async def on_ready():
+    global _warmed_up, _commands_synced
     logger.info(f'{bot.user} has connected to Discord!')
+    if not _warmed_up:
+        _warmed_up = True
+        mark("connect")
+        loop_watchdog.start()
+        asyncio.get_running_loop().run_in_executor(None, _warm_up_and_report)
+        if METRICS_PORT:
+            # Each shard process serves on its own port: METRICS_PORT plus its first shard ID
+            port = int(METRICS_PORT) + (SHARD_IDS[0] if SHARD_IDS else 0)
+            try:
+                start_http_server(port)
+            except OSError as e:
+                logger.error(f"Failed to serve metrics on port {port}: {e}")
+    if not refresh_activity_feed.is_running():
+        refresh_activity_feed.start()
+    if not sync_timetable.is_running():
+        sync_timetable.start()
+    if _commands_synced:
+        # Gateway reconnect: the command tree can't have changed since we synced it
+        return
+    if SHARD_IDS is not None and 0 not in SHARD_IDS:
+        # Commands are application-wide, so only the process running shard 0 syncs them
+        _commands_synced = True
+        return
     try:
-        logger.info("Attempting to sync slash commands globally...")
-        synced_commands = await tree.sync()
-        logger.info(f"Slash commands synced globally: {len(synced_commands)} commands")
-        for command in synced_commands:
+        synced_commands = await sync_command_tree(
+            tree, bot.application_id,
+            guild_id=int(DEV_GUILD_ID) if DEV_GUILD_ID else None,
+            force=FORCE_COMMAND_SYNC
+        )
+        _commands_synced = True
+        for command in synced_commands or []:
             logger.info(f"Synced command: {command.name}")
     except discord.errors.Forbidden:
         logger.error("Bot lacks permission to sync commands. Ensure it has 'applications.commands' scope.")
@@ -970,16 +1593,31 @@ async def on_ready():
 
 # Register commands
 tree.add_command(timetable)
+tree.add_command(timetable_week)
 tree.add_command(activities)
+tree.add_command(search_activities)
+tree.add_command(activity_alerts)
+tree.add_command(school_command)
 tree.add_command(qrcode)
+tree.add_command(qrcode_bulk)
 tree.add_command(ask_ai)
 tree.add_command(help_command)
 tree.add_command(avatar_command)
 tree.add_command(server_command)
 tree.add_command(suggestion_command)
-tree.add_command(dev_command)
+tree.add_command(dev_group)
 tree.add_command(pm_command)
 tree.add_command(weather)
+tree.add_command(bus_command)
+
+# Name the command callbacks so event loop stalls can be attributed to them
+for command in tree.walk_commands():
+    if isinstance(command, app_commands.Command):
+        metrics.name_handler(command.callback, f"command:{command.qualified_name}")
+
+mark("setup")
 
-# Run the bot
-bot.run(TOKEN)
\ No newline at end of file
+def main():
+    """Runs the bot until it is stopped (see main.py)."""
+    # Logging is already set up; don't let discord.py add its own console handler
+    bot.run(TOKEN, log_handler=None)
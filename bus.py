@@ -1 +1,270 @@
-too fucking difficult to understand
\ No newline at end of file
+"""
+Bus arrival times at the stops nearest a school, from the KMB open data API.
+
+The stop list and the routes serving each stop are downloaded once (and refreshed daily) into a
+grid index for nearest-stop queries. ETAs are fetched per stop, several stops at a time over
+pooled connections, and cached for BUS_ETA_MAX_AGE seconds in the shared cache: however many
+/bus commands arrive at once, each stop is fetched from the API at most once per interval.
+"""
+import json
+import math
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from shared_cache import get_cache, CacheEntry
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Point BUS_API_BASE_URL at fake_upstream.py to run against local fixtures
+BUS_API_BASE_URL = os.getenv('BUS_API_BASE_URL', "https://data.etabus.gov.hk").rstrip('/')
+STOPS_URL = f"{BUS_API_BASE_URL}/v1/transport/kmb/stop"
+ROUTE_STOPS_URL = f"{BUS_API_BASE_URL}/v1/transport/kmb/route-stop"
+STOP_ETA_URL = f"{BUS_API_BASE_URL}/v1/transport/kmb/stop-eta"
+# Where /bus looks for stops when the school's profile has no location (lat, lon)
+SCHOOL_LOCATION = (float(os.getenv('BUS_SCHOOL_LAT', '22.2747')), float(os.getenv('BUS_SCHOOL_LON', '114.1586')))
+# The API updates ETAs about once a minute
+BUS_ETA_MAX_AGE = 20
+# Stops and routes rarely change
+BUS_STOPS_MAX_AGE = 24 * 3600
+# Request timeouts in seconds; the stop and route-stop lists are large
+ETA_TIMEOUT = 5
+STOPS_TIMEOUT = 15
+ROUTE_STOPS_TIMEOUT = 30
+# Stops further than this (metres) from the school are never shown
+MAX_STOP_DISTANCE = 800
+# Grid cell size in degrees (about 550 m north-south)
+GRID_CELL = 0.005
+
+# One pooled session for every bus request; the pool is as large as the ETA worker pool
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=8))
+_session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=8))
+_eta_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='bus-eta')
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class BusError(Exception):
+    """Raised when bus data cannot be fetched or parsed. The message is user-facing."""
+
+
+class Stop:
+    """A bus stop and the routes that serve it."""
+
+    __slots__ = ('stop_id', 'name_en', 'name_tc', 'lat', 'lon', 'routes')
+
+    def __init__(self, stop_id, name_en, name_tc, lat, lon, routes=()):
+        self.stop_id = stop_id
+        self.name_en = name_en
+        self.name_tc = name_tc
+        self.lat = lat
+        self.lon = lon
+        self.routes = tuple(routes)
+
+
+class Arrival:
+    """One predicted arrival of a route at a stop."""
+
+    __slots__ = ('route', 'destination', 'eta', 'remark')
+
+    def __init__(self, route, destination, eta, remark=''):
+        self.route = route
+        self.destination = destination
+        self.eta = eta  # aware datetime, or None when the API gives only a remark
+        self.remark = remark
+
+    def minutes(self, now=None):
+        """Whole minutes until arrival (0 if due), or None if there is no time."""
+        if self.eta is None:
+            return None
+        now = now or datetime.now(timezone.utc)
+        return max(0, int((self.eta - now).total_seconds() // 60))
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Distance in metres (equirectangular approximation, accurate to well under 1% at city scale)."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371000 * math.hypot(x, y)
+
+
+class StopIndex:
+    """Uniform grid over stop coordinates for nearest-stop queries."""
+
+    def __init__(self, stops, cell=GRID_CELL):
+        self.cell = cell
+        self.stops = {stop.stop_id: stop for stop in stops}
+        self._grid = {}  # (row, column) -> list of stops
+        for stop in stops:
+            self._grid.setdefault(self._cell_of(stop.lat, stop.lon), []).append(stop)
+
+    def __len__(self):
+        return len(self.stops)
+
+    def _cell_of(self, lat, lon):
+        return int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell))
+
+    def nearest(self, lat, lon, limit=3, max_distance=MAX_STOP_DISTANCE):
+        """
+        Finds the stops closest to a point.
+
+        Args:
+            lat (float): Latitude
+            lon (float): Longitude
+            limit (int): Maximum number of stops
+            max_distance (float): Ignore stops further than this many metres
+
+        Returns:
+            list: (Stop, distance in metres) tuples, nearest first
+        """
+        row, column = self._cell_of(lat, lon)
+        # A cell is at least this many metres across (the east-west side shrinks with latitude)
+        cell_metres = distance_m(lat, lon, lat, lon + self.cell)
+        rings = int(math.ceil(max_distance / cell_metres)) + 1
+        found = []
+        for ring in range(rings + 1):
+            for cell_row in range(row - ring, row + ring + 1):
+                for cell_column in range(column - ring, column + ring + 1):
+                    # Only the cells on the edge of the ring are new
+                    if max(abs(cell_row - row), abs(cell_column - column)) != ring:
+                        continue
+                    for stop in self._grid.get((cell_row, cell_column), ()):
+                        distance = distance_m(lat, lon, stop.lat, stop.lon)
+                        if distance <= max_distance:
+                            found.append((stop, distance))
+            # Anything in further rings is at least ring * cell_metres away
+            found.sort(key=lambda item: item[1])
+            if len(found) >= limit and found[limit - 1][1] <= ring * cell_metres:
+                break
+        return found[:limit]
+
+
+def _get_json(url, timeout=ETA_TIMEOUT):
+    try:
+        response = _session.get(url, timeout=timeout)
+    except requests.Timeout:
+        raise BusError("Error: Bus data server timed out. Please try again later.")
+    except RequestException as e:
+        raise BusError(f"Error: Failed to fetch bus data: {str(e)}")
+    if response.status_code != 200:
+        raise BusError(f"Error: Failed to fetch bus data. HTTP {response.status_code}")
+    try:
+        data = response.json()
+    except ValueError:
+        raise BusError("Error: Invalid bus data received from server")
+    if not isinstance(data, dict) or not isinstance(data.get('data'), list):
+        raise BusError("Error: Invalid bus data received from server")
+    return data['data']
+
+
+@metrics.timed('upstream', 'bus_stops')
+def _fetch_stops_entry(previous):
+    stops = _get_json(STOPS_URL, timeout=STOPS_TIMEOUT)
+    route_stops = _get_json(ROUTE_STOPS_URL, timeout=ROUTE_STOPS_TIMEOUT)
+    routes = {}
+    for item in route_stops:
+        routes.setdefault(item.get('stop'), set()).add(item.get('route'))
+    compact = [
+        [stop['stop'], stop.get('name_en', ''), stop.get('name_tc', ''), float(stop['lat']), float(stop['long']),
+         sorted(routes.get(stop['stop'], ()))]
+        for stop in stops
+    ]
+    return CacheEntry(json.dumps(compact, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def get_stop_index():
+    """
+    Returns the stop index, building it on first use (or once the cached stop list is a day old).
+
+    Raises:
+        BusError: If the stop list cannot be fetched
+    """
+    global _index
+    with _index_lock:
+        if _index is not None and time.time() - _index[0] <= BUS_STOPS_MAX_AGE:
+            return _index[1]
+        entry = get_cache().get_or_fetch(f"bus_stops:{STOPS_URL}", BUS_STOPS_MAX_AGE, _fetch_stops_entry,
+                                         fetch_budget=STOPS_TIMEOUT + ROUTE_STOPS_TIMEOUT)
+        stops = [Stop(*item) for item in json.loads(entry.value)]
+        _index = (entry.fetched_at, StopIndex(stops))
+        logger.info(f"Loaded {len(stops)} bus stop(s) into the stop index")
+        return _index[1]
+
+
+def _parse_eta(text):
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+@metrics.timed('upstream', 'bus_eta')
+def _fetch_eta_entry(previous, stop_id):
+    arrivals = [
+        [item.get('route'), item.get('dest_tc') or item.get('dest_en') or '', item.get('eta'), item.get('rmk_tc') or '']
+        for item in _get_json(f"{STOP_ETA_URL}/{stop_id}", timeout=ETA_TIMEOUT)
+    ]
+    return CacheEntry(json.dumps(arrivals, ensure_ascii=False).encode('utf-8'))
+
+
+def get_stop_arrivals(stop_id):
+    """
+    Returns the arrivals at one stop, soonest first, from the cache if they are recent enough.
+
+    Raises:
+        BusError: If the ETAs cannot be fetched
+    """
+    entry = get_cache().get_or_fetch(f"bus_eta:{STOP_ETA_URL}/{stop_id}", BUS_ETA_MAX_AGE,
+                                     lambda previous: _fetch_eta_entry(previous, stop_id), fetch_budget=ETA_TIMEOUT)
+    arrivals = [Arrival(route, destination, _parse_eta(eta), remark)
+                for route, destination, eta, remark in json.loads(entry.value)]
+    far_future = datetime.max.replace(tzinfo=timezone.utc)
+    arrivals.sort(key=lambda arrival: (arrival.eta or far_future, arrival.route))
+    return arrivals
+
+
+def get_arrivals(stop_ids):
+    """
+    Fetches the arrivals at several stops concurrently.
+
+    Returns:
+        dict: stop ID -> list of Arrival, or the BusError raised for that stop
+    """
+    futures = {stop_id: _eta_pool.submit(get_stop_arrivals, stop_id) for stop_id in stop_ids}
+    results = {}
+    for stop_id, future in futures.items():
+        try:
+            results[stop_id] = future.result()
+        except BusError as e:
+            results[stop_id] = e
+    return results
+
+
+def get_bus_report(location=None, limit=3):
+    """
+    Arrival times at the stops nearest a location.
+
+    Args:
+        location (tuple): (lat, lon); defaults to SCHOOL_LOCATION
+        limit (int): Number of stops
+
+    Returns:
+        list: (Stop, distance in metres, list of Arrival or a BusError) tuples, nearest stop first
+
+    Raises:
+        BusError: If the stop list cannot be loaded
+    """
+    lat, lon = location or SCHOOL_LOCATION
+    nearest = get_stop_index().nearest(lat, lon, limit=limit)
+    arrivals = get_arrivals([stop.stop_id for stop, _ in nearest])
+    return [(stop, distance, arrivals[stop.stop_id]) for stop, distance in nearest]
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import logging
+import discord
+from subscriptions import write_json_atomic, DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+SYNC_STATE_PATH = os.path.join(DATA_DIR, 'command_sync.json')
+
+
+def _command_payload(command, tree):
+    # discord.py 2.4+ needs the tree to build the payload; older versions take no argument
+    try:
+        return command.to_dict(tree)
+    except TypeError:
+        return command.to_dict()
+
+
+def tree_signature(tree, guild=None):
+    """
+    Returns a hash of the command definitions that would be synced to Discord.
+
+    Args:
+        tree (app_commands.CommandTree): The bot's command tree
+        guild (discord.abc.Snowflake): Hash the guild's commands instead of the global ones
+
+    Returns:
+        str: Hex digest that changes whenever a name, description, option or permission changes
+    """
+    payload = sorted(
+        (_command_payload(command, tree) for command in tree.get_commands(guild=guild)),
+        key=lambda item: (item.get('type', 1), item['name'])
+    )
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _load_state():
+    try:
+        with open(SYNC_STATE_PATH, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        return state if isinstance(state, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"Invalid command sync state at {os.path.abspath(SYNC_STATE_PATH)}, will re-sync")
+        return {}
+
+
+async def sync_command_tree(tree, application_id, guild_id=None, force=False):
+    """
+    Syncs the command tree to Discord only if its definitions changed since the last sync.
+
+    The hash of the last synced definitions is stored per application and scope (global or guild)
+    in data/command_sync.json, so restarts and gateway reconnects skip the slow, rate-limited call.
+
+    Args:
+        tree (app_commands.CommandTree): The bot's command tree
+        application_id (int): The bot's application ID
+        guild_id (int): Sync to this guild only (instant; for development) instead of globally
+        force (bool): Sync even if nothing changed
+
+    Returns:
+        list: The synced commands, or None if the sync was skipped
+
+    Raises:
+        discord.errors.HTTPException: If Discord rejects the sync
+    """
+    guild = discord.Object(id=guild_id) if guild_id else None
+    if guild is not None:
+        tree.copy_global_to(guild=guild)
+    scope = f"{application_id}:guild:{guild_id}" if guild_id else f"{application_id}:global"
+    signature = tree_signature(tree, guild=guild)
+    state = _load_state()
+    if not force and state.get(scope) == signature:
+        logger.info(f"Slash commands unchanged since last sync ({scope}), skipping sync")
+        return None
+
+    where = f"to guild {guild_id}" if guild_id else "globally"
+    logger.info(f"Attempting to sync slash commands {where}...")
+    synced_commands = await tree.sync(guild=guild)
+    state[scope] = signature
+    write_json_atomic(SYNC_STATE_PATH, state)
+    logger.info(f"Slash commands synced {where}: {len(synced_commands)} commands")
+    return synced_commands
@@ -0,0 +1,582 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+import threading
+import time
+import logging
+from datetime import date, datetime
+import requests
+from requests.exceptions import RequestException
+import snapshot
+from shared_cache import get_cache, CacheEntry
+from metrics import metrics
+from resilience import CircuitBreaker, CircuitOpenError, retry, hedged, hedge_delay
+from schedule import GRADES, ActivitySlot
+
+logger = logging.getLogger(__name__)
+
+# Point SCHOOL_API_BASE_URL at fake_upstream.py to run against local fixtures
+SCHOOL_API_BASE_URL = os.getenv('SCHOOL_API_BASE_URL', "https://iot.spyc.hk").rstrip('/')
+FEED_URL = f"{SCHOOL_API_BASE_URL}/event-schedule"
+# Seconds one request may take, and all attempts of a refresh together (retries and hedges included)
+FETCH_TIMEOUT = 5
+FETCH_BUDGET = 8
+
+# Latin words/numbers are indexed whole; CJK text has no spaces, so each character is a token
+_TOKEN_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[^\W_]+")
+
+
+class FeedError(Exception):
+    """
+    Raised when the event-schedule feed cannot be fetched or parsed. The message is user-facing.
+
+    retryable is True for failures that an immediate retry may get past (connection errors, HTTP
+    429 and 5xx responses).
+    """
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase search tokens.
+
+    Args:
+        text (str): Free text (activity name, remark or search query)
+
+    Returns:
+        list: Tokens in order of appearance
+    """
+    return [token.lower() for token in _TOKEN_RE.findall(text or '')]
+
+
+def display_date(date_key):
+    """Converts a feed date key (D/M/YYYY) to DD/MM/YYYY, leaving unparseable keys unchanged."""
+    try:
+        day, month, year = (int(part) for part in date_key.split('/'))
+        return f"{day:02d}/{month:02d}/{year}"
+    except ValueError:
+        return date_key
+
+
+def _sort_key(date_key):
+    try:
+        day, month, year = (int(part) for part in date_key.split('/'))
+        return (year, month, day)
+    except ValueError:
+        return (9999, 99, 99)
+
+
+def _ordinal(date_key):
+    """Day number of a feed date key (see date.toordinal), or None if it isn't a valid date."""
+    try:
+        return date(*_sort_key(date_key)).toordinal()
+    except ValueError:
+        return None
+
+
+def row_entries(row):
+    """
+    Flattens one feed row into (slot, text) entries, in the same form shown by /activities.
+
+    Args:
+        row (dict): A row from the feed ({'slots': {...}, 'remark': '...'})
+
+    Returns:
+        list: List of (slot, text) tuples; the remark is reported under the 'Remark' slot
+    """
+    entries = []
+    for slot_name, slot_data in (row.get('slots') or {}).items():
+        for grade in GRADES:
+            for activity in slot_data.get(grade) or []:
+                entries.append((slot_name, f"{grade}: {activity}"))
+        for activity in slot_data.get('otherActivities') or []:
+            entries.append((slot_name, activity))
+    remark = row.get('remark') or ''
+    if remark:
+        entries.append(('Remark', remark))
+    return entries
+
+
+def row_hash(row):
+    """Returns a stable content hash for a feed row, independent of key order."""
+    encoded = json.dumps(row, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class FeedDiff:
+    """Per-date differences between two versions of the feed."""
+
+    def __init__(self):
+        self.added = []    # date keys new in the feed
+        self.removed = []  # date keys no longer in the feed
+        self.changed = []  # date keys whose row content changed
+        self.entries = {}  # date key -> (added entries, removed entries), as (slot, text) tuples
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def dates(self):
+        """Returns every affected date key, sorted by date."""
+        return sorted(self.added + self.removed + self.changed, key=_sort_key)
+
+
+def diff_rows(old_rows, old_hashes, new_rows):
+    """
+    Compares a new set of feed rows against the previous snapshot using per-row content hashes.
+
+    Args:
+        old_rows (dict): Previous rows keyed by D/M/YYYY date
+        old_hashes (dict): Content hash of each previous row
+        new_rows (dict): Newly fetched rows
+
+    Returns:
+        tuple: (FeedDiff, dict of content hashes for new_rows)
+    """
+    diff = FeedDiff()
+    new_hashes = {}
+    for date_key, row in new_rows.items():
+        digest = row_hash(row)
+        new_hashes[date_key] = digest
+        old_digest = old_hashes.get(date_key)
+        if old_digest == digest:
+            continue
+        old_entries = row_entries(old_rows[date_key]) if old_digest is not None else []
+        new_entries = row_entries(row)
+        (diff.changed if old_digest is not None else diff.added).append(date_key)
+        diff.entries[date_key] = (
+            [entry for entry in new_entries if entry not in old_entries],
+            [entry for entry in old_entries if entry not in new_entries],
+        )
+    for date_key in old_hashes.keys() - new_hashes.keys():
+        diff.removed.append(date_key)
+        diff.entries[date_key] = ([], row_entries(old_rows[date_key]))
+    return diff, new_hashes
+
+
+class ActivityIndex:
+    """Token inverted index over the activities and remarks of every date in the feed."""
+
+    def __init__(self):
+        self._postings = {}  # token -> set of date keys
+        self._entries = {}   # date key -> list of (slot, text, frozenset of tokens)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def index_row(self, date_key, row):
+        """Indexes (or re-indexes) a single date's row."""
+        entries = [(slot, text, frozenset(tokenize(text))) for slot, text in row_entries(row)]
+        with self._lock:
+            self._remove(date_key)
+            if not entries:
+                return
+            self._entries[date_key] = entries
+            for token in set().union(*(tokens for _, _, tokens in entries)):
+                self._postings.setdefault(token, set()).add(date_key)
+
+    def remove_row(self, date_key):
+        """Drops a date from the index."""
+        with self._lock:
+            self._remove(date_key)
+
+    def _remove(self, date_key):
+        entries = self._entries.pop(date_key, None)
+        if not entries:
+            return
+        for token in set().union(*(tokens for _, _, tokens in entries)):
+            dates = self._postings.get(token)
+            if dates is not None:
+                dates.discard(date_key)
+                if not dates:
+                    del self._postings[token]
+
+    def search(self, query, limit=25):
+        """
+        Finds activities containing every token of the query.
+
+        Args:
+            query (str): Search text (e.g., 'sports day', '陸運會')
+            limit (int): Maximum number of matches to return
+
+        Returns:
+            list: Matches sorted by date, each a dict with 'date' (DD/MM/YYYY), 'slot' and 'activity'
+        """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with self._lock:
+            candidates = None
+            # Intersect from the rarest token so the candidate set shrinks as fast as possible
+            for token in sorted(tokens, key=lambda t: len(self._postings.get(t, ()))):
+                dates = self._postings.get(token)
+                if not dates:
+                    return []
+                candidates = set(dates) if candidates is None else candidates & dates
+                if not candidates:
+                    return []
+            matches = []
+            for date_key in sorted(candidates, key=_sort_key):
+                for slot, text, entry_tokens in self._entries[date_key]:
+                    if tokens <= entry_tokens:
+                        matches.append({'date': display_date(date_key), 'slot': slot, 'activity': text})
+                        if len(matches) >= limit:
+                            return matches
+            return matches
+
+
+class DayIndex:
+    """
+    Each date's activities as ActivitySlot objects, for the whole school and for each grade.
+
+    Rows are indexed when they are added or changed, so looking up a date (or the closest date
+    the feed has) doesn't go through the feed's rows or format anything.
+    """
+
+    def __init__(self):
+        self._days = {}      # (date key, grade or None) -> tuple of ActivitySlot
+        self._remarks = {}   # date key -> remark
+        self._ordinals = []  # sorted (day number, date key) of every indexed date
+        self._slot_names = {}  # slot name -> number of dates using it
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._remarks)
+
+    def index_row(self, date_key, row):
+        """Indexes (or re-indexes) a single date's row."""
+        slots = [ActivitySlot.from_feed(name, data or {}) for name, data in (row.get('slots') or {}).items()]
+        slots = tuple(slot for slot in slots if slot)
+        by_grade = {grade: tuple(filter(None, (slot.for_grade(grade) for slot in slots))) for grade in GRADES}
+        ordinal = _ordinal(date_key)
+        with self._lock:
+            self._remove(date_key)
+            self._days[(date_key, None)] = slots
+            for grade, grade_slots in by_grade.items():
+                self._days[(date_key, grade)] = grade_slots
+            self._remarks[date_key] = row.get('remark') or ''
+            if ordinal is not None:
+                bisect.insort(self._ordinals, (ordinal, date_key))
+            for slot in slots:
+                self._slot_names[slot.name] = self._slot_names.get(slot.name, 0) + 1
+
+    def remove_row(self, date_key):
+        """Drops a date from the index."""
+        with self._lock:
+            self._remove(date_key)
+
+    def _remove(self, date_key):
+        if self._remarks.pop(date_key, None) is None:
+            return
+        for slot in self._days.pop((date_key, None)):
+            count = self._slot_names[slot.name] - 1
+            if count:
+                self._slot_names[slot.name] = count
+            else:
+                del self._slot_names[slot.name]
+        for grade in GRADES:
+            self._days.pop((date_key, grade), None)
+        ordinal = _ordinal(date_key)
+        if ordinal is not None:
+            position = bisect.bisect_left(self._ordinals, (ordinal, date_key))
+            if position < len(self._ordinals) and self._ordinals[position] == (ordinal, date_key):
+                del self._ordinals[position]
+
+    def find(self, day, grade=None):
+        """
+        Looks up a date's activities, falling back to the closest date in the feed.
+
+        Args:
+            day (date): Date to look up
+            grade (str): Only include this grade's activities (and whole-school ones), e.g. 'S3'
+
+        Returns:
+            tuple: (date key, tuple of ActivitySlot, remark), or None if no valid date is indexed
+        """
+        ordinal = day.toordinal()
+        with self._lock:
+            if not self._ordinals:
+                return None
+            position = bisect.bisect_left(self._ordinals, (ordinal, ''))
+            candidates = self._ordinals[max(0, position - 1):position + 1]
+            # Closest date, the earlier one on a tie
+            _, date_key = min(candidates, key=lambda entry: (abs(entry[0] - ordinal), entry[0]))
+            return date_key, self._days[(date_key, grade)], self._remarks[date_key]
+
+    def slot_names(self):
+        """Names of the slots used in the feed (e.g. 'AM', 'PM_L'), most used first."""
+        with self._lock:
+            return sorted(self._slot_names, key=lambda name: -self._slot_names[name])
+
+
+@metrics.timed('upstream', 'event_schedule')
+def fetch_event_data(url=FEED_URL, timeout=FETCH_TIMEOUT, etag=None, last_modified=None):
+    """
+    Downloads and parses the event-schedule feed.
+
+    Args:
+        url (str): Feed URL
+        timeout (float): Request timeout in seconds
+        etag (str): ETag of the copy already held, sent as If-None-Match
+        last_modified (str): Last-Modified of the copy already held, sent as If-Modified-Since
+
+    Returns:
+        tuple: (parsed feed or None if the server reports it unchanged, response headers)
+
+    Raises:
+        FeedError: With a user-facing message when the feed cannot be fetched or is malformed
+    """
+    try:
+        logger.info(f"Attempting to fetch activities from: {url}")
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        response = requests.get(url, timeout=timeout, headers=headers)
+    except requests.Timeout:
+        raise FeedError("Error: Request to server timed out. Please try again later.")
+    except requests.ConnectionError:
+        raise FeedError("Error: Failed to connect to server. Check your internet connection.", retryable=True)
+    except RequestException as e:
+        raise FeedError(f"Error: Failed to fetch activities: {str(e)}")
+
+    if response.status_code == 304:
+        return None, response.headers
+
+    if response.status_code != 200:
+        retryable = response.status_code == 429 or response.status_code >= 500
+        raise FeedError(f"Error: Failed to fetch activities. HTTP {response.status_code}", retryable=retryable)
+
+    try:
+        event_data = response.json()
+    except ValueError:
+        raise FeedError("Error: Invalid JSON data received from server")
+
+    if not isinstance(event_data, dict) or not isinstance(event_data.get('rows'), dict):
+        raise FeedError("Error: Invalid JSON data received from server")
+    return event_data, response.headers
+
+
+class EventFeed:
+    """Keeps the latest copy of an event-schedule feed, its search index and its day index up to date."""
+
+    def __init__(self, url=FEED_URL, max_age=300, retry_after=30, share_max_age=60, hedge=True):
+        self.url = url
+        self.max_age = max_age
+        self.retry_after = retry_after
+        # A copy fetched by another bot process at most this many seconds ago is used instead of refetching
+        self.share_max_age = share_max_age
+        # After 3 failed fetches in a row, stop calling the server for a minute and serve the saved copy
+        self.breaker = CircuitBreaker('event_schedule', failure_threshold=3, reset_timeout=60)
+        # Send a second request when the first is slower than the p95 fetch time
+        self.hedge = hedge
+        self.rows = {}
+        self.row_hashes = {}
+        self.digest = None
+        self.fetched_at = None
+        self.failed_at = None
+        self.index = ActivityIndex()
+        self.days = DayIndex()
+        self._listeners = []
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def snapshot_section(self):
+        return f"event_feed:{self.url}"
+
+    def restore_snapshot(self):
+        """
+        Loads the last good copy of the feed from the on-disk snapshot, if there is one.
+
+        Returns:
+            bool: True if a snapshot was restored
+        """
+        saved = snapshot.load_section(self.snapshot_section)
+        if not saved or not isinstance(saved.get('rows'), dict):
+            return False
+        with self._refresh_lock:
+            self.rows = saved['rows']
+            self.row_hashes = {date_key: row_hash(row) for date_key, row in self.rows.items()}
+            for date_key, row in self.rows.items():
+                self.index.index_row(date_key, row)
+                self.days.index_row(date_key, row)
+            self.fetched_at = saved.get('fetched_at')
+        logger.info(f"Restored {len(self.rows)} date(s) of activities from snapshot ({self.fetched_at_display()})")
+        return True
+
+    def _save_snapshot(self):
+        snapshot.save_section(self.snapshot_section, {
+            'rows': self.rows,
+            'fetched_at': self.fetched_at,
+        })
+
+    def add_listener(self, callback):
+        """
+        Registers a callback for feed changes.
+
+        The callback receives a FeedDiff whenever a refresh (after the first one) changes the feed.
+        It is called from whichever thread performed the refresh.
+        """
+        self._listeners.append(callback)
+
+    def _fetch(self, etag, last_modified):
+        """
+        Calls fetch_event_data through the circuit breaker, retrying retryable failures with
+        jittered backoff and hedging attempts that run past the usual p95 latency. Blocking: run it
+        off the event loop. All attempts together take about FETCH_BUDGET seconds at most.
+        """
+        deadline = time.monotonic() + FETCH_BUDGET
+
+        def attempt():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise FeedError("Error: Request to server timed out. Please try again later.")
+            hedge_after = hedge_delay('upstream', 'event_schedule') if self.hedge else None
+            timeout = min(FETCH_TIMEOUT, remaining)
+            return hedged(lambda: fetch_event_data(self.url, timeout=timeout, etag=etag, last_modified=last_modified),
+                          hedge_after, name='event_schedule')
+
+        try:
+            return self.breaker.call(
+                lambda: retry(attempt, attempts=3, base_delay=0.2, max_delay=1.0,
+                              should_retry=lambda e: getattr(e, 'retryable', False), name='event_schedule',
+                              deadline=deadline),
+                failure_types=(FeedError,),
+            )
+        except CircuitOpenError:
+            raise FeedError(f"Error: The activities server is not responding. "
+                            f"Trying again in {self.breaker.retry_in():.0f}s.")
+
+    def _fetch_entry(self, previous):
+        """Fetches the feed for the shared cache, conditionally if a previous copy is cached."""
+        meta = previous.meta if previous is not None else {}
+        event_data, headers = self._fetch(meta.get('etag'), meta.get('last_modified'))
+        if event_data is None:
+            # 304 Not Modified: keep the cached copy, now confirmed current
+            return CacheEntry(previous.value, meta=meta)
+        body = json.dumps(event_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return CacheEntry(body, meta={
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'digest': hashlib.sha1(body).hexdigest(),
+        })
+
+    def refresh(self):
+        """
+        Fetches the feed (or takes a copy another process fetched within share_max_age seconds)
+        and applies it incrementally.
+
+        Returns:
+            dict: The current feed ({'rows': {...}})
+
+        Raises:
+            FeedError: When the feed cannot be fetched
+        """
+        try:
+            entry = get_cache().get_or_fetch(f"event_feed:{self.url}", self.share_max_age, self._fetch_entry,
+                                             fetch_budget=FETCH_BUDGET)
+        except FeedError:
+            self.failed_at = time.time()
+            raise
+        self.failed_at = None
+        digest = entry.meta.get('digest')
+        if digest is not None and digest == self.digest:
+            # Same content as we already applied: nothing to diff or re-index
+            self.fetched_at = entry.fetched_at
+            return {'rows': self.rows}
+        event_data = json.loads(entry.value)
+        diff = self.update(event_data['rows'])
+        self.digest = digest
+        self.fetched_at = entry.fetched_at
+        if diff:
+            self._save_snapshot()
+        return event_data
+
+    def get(self):
+        """
+        Returns the feed, fetching it only when the cached copy is older than max_age.
+
+        If the server cannot be reached, the last good copy (from memory or the on-disk snapshot)
+        is served instead and flagged as stale. After a failure, the server is not retried for
+        retry_after seconds so that every request doesn't wait for the full timeout, and after
+        repeated failures the circuit breaker fails refreshes immediately (see _fetch).
+
+        Returns:
+            tuple: (feed dict, stale flag)
+
+        Raises:
+            FeedError: When the feed cannot be fetched and no copy is available
+        """
+        if not self.needs_refresh():
+            metrics.cache('event_feed_memory', True)
+            return {'rows': self.rows}, False
+        metrics.cache('event_feed_memory', False)
+        if self.rows and self.failed_at is not None and time.time() - self.failed_at < self.retry_after:
+            return {'rows': self.rows}, True
+        try:
+            return self.refresh(), False
+        except FeedError as e:
+            if not self.rows:
+                raise
+            logger.warning(f"Serving saved activities from {self.fetched_at_display()} after refresh failed: {e}")
+            return {'rows': self.rows}, True
+
+    def update(self, rows):
+        """
+        Replaces the cached rows, re-indexing only dates whose row was added, changed or removed.
+
+        Args:
+            rows (dict): Feed rows keyed by D/M/YYYY date
+
+        Returns:
+            FeedDiff: What changed compared with the previous rows
+        """
+        with self._refresh_lock:
+            first_load = self.fetched_at is None and not self.rows
+            diff, hashes = diff_rows(self.rows, self.row_hashes, rows)
+            for date_key in diff.added + diff.changed:
+                self.index.index_row(date_key, rows[date_key])
+                self.days.index_row(date_key, rows[date_key])
+            for date_key in diff.removed:
+                self.index.remove_row(date_key)
+                self.days.remove_row(date_key)
+            self.rows = rows
+            self.row_hashes = hashes
+            self.fetched_at = time.time()
+        logger.info(f"Activity feed updated: {len(diff.added)} added, {len(diff.changed)} changed, "
+                    f"{len(diff.removed)} removed, {len(rows)} date(s) in feed")
+        if diff and not first_load:
+            for callback in self._listeners:
+                try:
+                    callback(diff)
+                except Exception as e:
+                    logger.error(f"Activity feed listener failed: {e}")
+        return diff
+
+    def needs_refresh(self):
+        """Returns True if the feed has never been fetched or is older than max_age seconds."""
+        return self.fetched_at is None or time.time() - self.fetched_at > self.max_age
+
+    def search(self, query, limit=25):
+        """Refreshes the feed if it is out of date, then searches the index. See ActivityIndex.search."""
+        self.get()
+        return self.index.search(query, limit=limit)
+
+    def fetched_at_display(self):
+        """Returns the time of the last successful fetch as a string, or 'never'."""
+        if self.fetched_at is None:
+            return "never"
+        return datetime.fromtimestamp(self.fetched_at).strftime('%d/%m/%Y %H:%M:%S')
+
+
+# Shared feed used by the bot
+activity_feed = EventFeed()
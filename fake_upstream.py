@@ -0,0 +1,283 @@
+"""
+Local stand-in for the school API (event schedule, timetable, cycle calendar), the HKO
+weather API and the KMB bus API, for benchmarks, load tests and working offline.
+
+    python fake_upstream.py --port 8099 --latency 80 --jitter 40 --error-rate 0.05
+
+then start the bot (or loadgen.py) with
+
+    SCHOOL_API_BASE_URL=http://127.0.0.1:8099 HKO_API_BASE_URL=http://127.0.0.1:8099 BUS_API_BASE_URL=http://127.0.0.1:8099
+
+Responses come from fixtures: test_data/event_schedule.json and test_data/hko_fnd_tc.json if
+present (`python fake_upstream.py --record` saves the live responses there), otherwise a feed
+generated from a fixed seed; the timetable, cycle calendar and bus stops come from test_data/,
+and bus ETAs are generated relative to the current time. Latency, jitter and errors are drawn
+from a seeded random generator, so runs are repeatable.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import logging
+from datetime import date as Date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = 'test_data'
+EVENT_SCHEDULE_FIXTURE = os.path.join(FIXTURES_DIR, 'event_schedule.json')
+HKO_FIXTURE = os.path.join(FIXTURES_DIR, 'hko_fnd_tc.json')
+TIMETABLE_FIXTURE = os.path.join(FIXTURES_DIR, 'timetale.json')
+CYCLE_FIXTURE = os.path.join(FIXTURES_DIR, 'cycleal.json')
+BUS_STOPS_FIXTURE = os.path.join(FIXTURES_DIR, 'kmb_stop.json')
+BUS_ROUTE_STOPS_FIXTURE = os.path.join(FIXTURES_DIR, 'kmb_route_stop.json')
+STOP_ETA_PREFIX = '/v1/transport/kmb/stop-eta/'
+
+GRADES = ['S1', 'S2', 'S3', 'S4', 'S5', 'S6']
+SLOTS = ['AM', 'AM_L', 'PM', 'PM_L', 'After School']
+ACTIVITY_WORDS = ['Assembly', 'Sports Day', 'Music Practice', 'Test', 'Field Trip', 'Debate', '模擬考試', '陸運會']
+
+
+def synthetic_feed(days=365, seed=42, start=Date(2024, 9, 1)):
+    """
+    Generates an event-schedule feed with activities on every school day.
+
+    Args:
+        days (int): Number of calendar days to cover
+        seed (int): Random seed; the same seed always gives the same feed
+        start (date): First day of the feed
+
+    Returns:
+        dict: Feed in the event-schedule format ({'rows': {'D/M/YYYY': {'slots': ..., 'remark': ...}}})
+    """
+    rng = random.Random(seed)
+    rows = {}
+    for day in range(days):
+        current = start + timedelta(days=day)
+        if current.weekday() >= 5:
+            continue
+        slots = {}
+        for slot in SLOTS:
+            slot_data = {grade: [] for grade in GRADES}
+            for grade in GRADES:
+                if rng.random() < 0.3:
+                    slot_data[grade].append(f"{rng.choice(ACTIVITY_WORDS)} {rng.randint(1, 99)}")
+            slot_data['otherActivities'] = [rng.choice(ACTIVITY_WORDS)] if rng.random() < 0.2 else []
+            slots[slot] = slot_data
+        rows[f"{current.day}/{current.month}/{current.year}"] = {
+            'slots': slots,
+            'remark': rng.choice(['', '', 'Half day', '半日上課']),
+        }
+    return {'rows': rows}
+
+
+def scale_feed(feed, scale):
+    """
+    Resizes a feed: scale < 1 keeps that fraction of the dates, scale > 1 adds copies of the
+    rows shifted by whole years, so lookups and indexes work on a proportionally larger feed.
+    """
+    rows = list(feed['rows'].items())
+    if scale <= 1:
+        return {'rows': dict(rows[:max(1, int(len(rows) * scale))])}
+    scaled = dict(rows)
+    for copy in range(1, math.ceil(scale)):
+        for date_key, row in rows[:int(len(rows) * min(1, scale - copy))]:
+            day, month, year = date_key.split('/')
+            scaled[f"{day}/{month}/{int(year) + copy}"] = row
+    return {'rows': scaled}
+
+
+def _load_json_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class FakeUpstream:
+    """
+    HTTP server imitating the upstream APIs.
+
+    Args:
+        latency (float): Added delay per response, in milliseconds
+        jitter (float): Extra random delay of up to this many milliseconds
+        error_rate (float): Fraction (0-1) of requests answered with HTTP 503
+        etag (bool): Send ETags and answer matching If-None-Match requests with 304
+        feed_scale (float): Size of the event-schedule feed relative to the fixture
+        seed (int): Seed for generated data, latency and errors
+    """
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, etag=True, feed_scale=1, seed=42):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.error_rate = error_rate
+        self.etag = etag
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.requests = 0
+        self.server = None
+
+        if os.path.exists(EVENT_SCHEDULE_FIXTURE):
+            feed = json.loads(_load_json_bytes(EVENT_SCHEDULE_FIXTURE))
+        else:
+            feed = synthetic_feed(seed=seed)
+        if feed_scale != 1:
+            feed = scale_feed(feed, feed_scale)
+        self.routes = {
+            '/event-schedule': json.dumps(feed, ensure_ascii=False).encode('utf-8'),
+            '/timetable': _load_json_bytes(TIMETABLE_FIXTURE),
+            '/cyclecal': _load_json_bytes(CYCLE_FIXTURE),
+            '/weatherAPI/opendata/weather.php': _load_json_bytes(HKO_FIXTURE),
+            '/v1/transport/kmb/stop': _load_json_bytes(BUS_STOPS_FIXTURE),
+            '/v1/transport/kmb/route-stop': _load_json_bytes(BUS_ROUTE_STOPS_FIXTURE),
+        }
+        self.stop_routes = {}
+        for item in json.loads(self.routes['/v1/transport/kmb/route-stop'])['data']:
+            self.stop_routes.setdefault(item['stop'], []).append(item['route'])
+        self.etags = {path: f'"{hashlib.sha1(body).hexdigest()}"' for path, body in self.routes.items()}
+
+    def set_route(self, path, payload):
+        """Replaces the body served for a path (e.g. to simulate a feed update)."""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.routes[path] = body
+        self.etags[path] = f'"{hashlib.sha1(body).hexdigest()}"'
+
+    def _draw(self):
+        with self._rng_lock:
+            self.requests += 1
+            delay = self.latency + (self._rng.random() * self.jitter if self.jitter else 0)
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+        return delay, fail
+
+    def stop_eta(self, stop_id):
+        """Generates the next three arrivals of every route at a stop, or None for an unknown stop."""
+        routes = self.stop_routes.get(stop_id)
+        if routes is None:
+            return None
+        now = datetime.now(timezone(timedelta(hours=8))).replace(microsecond=0)
+        arrivals = []
+        with self._rng_lock:
+            for route in routes:
+                first = self._rng.randint(0, 12)
+                for eta_seq in range(1, 4):
+                    eta = now + timedelta(minutes=first + (eta_seq - 1) * self._rng.randint(6, 15))
+                    arrivals.append({
+                        'co': 'KMB', 'route': route, 'dir': 'O', 'service_type': 1, 'stop': stop_id,
+                        'dest_en': f"ROUTE {route} TERMINUS", 'dest_tc': f"{route}號線總站",
+                        'eta_seq': eta_seq, 'eta': eta.isoformat(), 'rmk_en': '', 'rmk_tc': '',
+                        'data_timestamp': now.isoformat(),
+                    })
+        return json.dumps({'type': 'StopETA', 'data': arrivals}, ensure_ascii=False).encode('utf-8')
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                delay, fail = upstream._draw()
+                if delay:
+                    time.sleep(delay)
+                if path.startswith(STOP_ETA_PREFIX):
+                    body = upstream.stop_eta(path[len(STOP_ETA_PREFIX):])
+                    if body is not None and not fail:
+                        self._send(200, body)
+                        return
+                else:
+                    body = upstream.routes.get(path)
+                if body is None:
+                    self._send(404, b'{"error": "not found"}')
+                elif fail:
+                    self._send(503, b'{"error": "injected failure"}')
+                elif upstream.etag and self.headers.get('If-None-Match') == upstream.etags[path]:
+                    self._send(304, b'', {'ETag': upstream.etags[path]})
+                else:
+                    self._send(200, body, {'ETag': upstream.etags[path]} if upstream.etag else {})
+
+            def _send(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        """Starts serving in a background thread. Returns the base URL (e.g. http://127.0.0.1:8099)."""
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-upstream', daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def record_fixtures():
+    """Saves the live event-schedule and HKO responses as fixtures."""
+    import requests
+    from event_feed import FEED_URL
+    from weather import WEATHER_URL
+    for url, path in ((FEED_URL, EVENT_SCHEDULE_FIXTURE), (f"{WEATHER_URL}?dataType=fnd&lang=tc", HKO_FIXTURE)):
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(response.json(), file, ensure_ascii=False, indent=2)
+        logger.info(f"Recorded {url} to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the school and HKO APIs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0, help="Delay per response (ms)")
+    parser.add_argument('--jitter', type=float, default=0, help="Extra random delay of up to this many ms")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fraction of requests answered with 503")
+    parser.add_argument('--no-etag', action='store_true', help="Don't send ETags or answer with 304")
+    parser.add_argument('--feed-scale', type=float, default=1, help="Event-schedule size relative to the fixture")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--record', action='store_true', help="Save the live responses as fixtures and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.record:
+        record_fixtures()
+        return
+    upstream = FakeUpstream(args.latency, args.jitter, args.error_rate, not args.no_etag, args.feed_scale, args.seed)
+    base_url = upstream.start(args.host, args.port)
+    logger.info(f"Serving fake upstream on {base_url} (set SCHOOL_API_BASE_URL and HKO_API_BASE_URL to it)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
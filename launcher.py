@@ -0,0 +1,75 @@
+"""
+Runs the bot as several processes, each connected to a group of shards.
+
+    python launcher.py --shards 4 --processes 2
+
+starts two copies of the bot (main.py) with SHARD_COUNT=4 and SHARD_IDS=0,1 / 2,3. The processes share
+upstream data through the cache in shared_cache.py, so the event schedule, weather and timetable
+are still fetched once per refresh. Workers that exit are restarted; Ctrl+C stops them all.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def shard_groups(shard_count, processes):
+    """Splits shard IDs 0..shard_count-1 into contiguous groups, one per process."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def start_worker(shard_count, shard_ids):
+    env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=','.join(str(i) for i in shard_ids))
+    logger.info(f"Starting bot process for shards {env['SHARD_IDS']} of {shard_count}")
+    return subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as several shard processes")
+    parser.add_argument('--shards', type=int, required=True, help="Total number of shards")
+    parser.add_argument('--processes', type=int, default=1, help="Number of bot processes")
+    parser.add_argument('--restart-delay', type=float, default=5, help="Seconds to wait before restarting a worker")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    groups = shard_groups(args.shards, args.processes)
+    workers = [start_worker(args.shards, group) for group in groups]
+    try:
+        while True:
+            time.sleep(1)
+            for index, worker in enumerate(workers):
+                code = worker.poll()
+                if code is None:
+                    continue
+                logger.error(f"Bot process for shards {groups[index]} exited with code {code}, restarting")
+                time.sleep(args.restart_delay)
+                workers[index] = start_worker(args.shards, groups[index])
+    except KeyboardInterrupt:
+        logger.info("Stopping bot processes...")
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""
+Synthetic load for the bot's command and button handlers.
+
+    python loadgen.py --concurrency 20 --duration 30 --mix timetable=5,timetable_next=3,activities=2
+
+drives the real callbacks in bot.py with stand-in Interaction objects, against fake_upstream.py
+(started in-process, or pass --upstream to use one already running), and reports throughput,
+latency percentiles per operation and event loop lag. Nothing is sent to Discord.
+
+Operations:
+    timetable         /timetable for a random class and school day
+    timetable_next    /timetable, then the ➡️ button on its view
+    timetable_week    /timetable_week for a random class
+    show_activities   /timetable, then the Show Activities button
+    activities        /activities for a random school day
+    activities_next   /activities, then the Next Day Activities button
+    activities_grade  /activities for a random school day and grade
+    search            /search_activities for a random word
+    weather           /weather
+    bus               /bus for the three stops nearest the school
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date as Date, timedelta
+from schedule import GRADES
+
+OPERATIONS = ['timetable', 'timetable_next', 'timetable_week', 'show_activities', 'activities', 'activities_next', 'activities_grade', 'search', 'weather', 'bus']
+SEARCH_WORDS = ['assembly', 'test', 'debate', 'music', '考試', 'trip']
+
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"loadgen{user_id}"
+        self.avatar = FakeAvatar()
+
+
+class FakePermissions:
+    send_messages = True
+    attach_files = True
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    def permissions_for(self, member):
+        return FakePermissions()
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.me = FakeUser(0)
+
+
+class FakeResponse:
+    """Records what a handler sent instead of calling Discord."""
+
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.record(content, kwargs)
+
+    async def edit_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.record(content, kwargs)
+
+    async def defer(self, **kwargs):
+        self._done = True
+        self._interaction.deferred = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.record(content, kwargs)
+
+
+class FakeInteraction:
+    """The parts of discord.Interaction that bot.py's handlers use."""
+
+    def __init__(self, user_id, guild_id=1, channel_id=1):
+        self.user = FakeUser(user_id)
+        self.guild = FakeGuild(guild_id)
+        self.guild_id = guild_id
+        self.channel = FakeChannel(channel_id)
+        self.channel_id = channel_id
+        self.command = None
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.content = None
+        self.embed = None
+        self.view = None
+        self.deferred = False
+        self.replies = 0
+        self.error_replies = 0
+
+    def record(self, content, kwargs):
+        self.content = content
+        self.embed = kwargs.get('embed', self.embed)
+        self.view = kwargs.get('view', self.view)
+        self.replies += 1
+        if _is_error_reply(content, kwargs.get('embed')):
+            self.error_replies += 1
+
+    @property
+    def failed(self):
+        # Any error reply, or a deferred interaction that never got its follow-up (the user would
+        # see "thinking..." until Discord gives up)
+        return self.error_replies > 0 or (self.deferred and self.replies == 0)
+
+
+def _is_error_reply(content, embed):
+    """Whether a reply is one of the bot's error messages: 'Error: ...' text, or an embed reporting an error."""
+    if content is not None and str(content).startswith("Error"):
+        return True
+    if embed is None:
+        return False
+    if (embed.title or '').startswith("Error") or (embed.description or '').startswith("Error:"):
+        return True
+    return any(field.name == "Error" or str(field.value).startswith("Error:") for field in embed.fields)
+
+
+def _button(view, label):
+    for item in view.children:
+        if getattr(item, 'label', None) == label:
+            return item
+    raise LookupError(f"No '{label}' button on the view")
+
+
+class LoadGenerator:
+    """Runs a request mix against bot.py's handlers and collects per-operation latencies."""
+
+    def __init__(self, bot_module, mix, seed=42):
+        self.bot = bot_module
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.rng = random.Random(seed)
+        self.latencies = {name: [] for name in self.operations}
+        self.errors = {name: 0 for name in self.operations}
+        self.classes = self.bot.get_available_classes(self.bot.datasets.get(self.bot.datasets.default_school_id)) or ['1A']
+        store = self.bot.datasets.get(self.bot.datasets.default_school_id).load_store()
+        start = Date(2024, 9, 1)
+        self.school_days = [
+            day.strftime('%d/%m/%Y')
+            for day in (start + timedelta(days=offset) for offset in range(300))
+            if store.cycle_day(day.strftime('%d/%m/%Y')) not in (None, '/')
+        ] or ['03/09/2024']
+        self._next_user = 0
+
+    def _interaction(self):
+        self._next_user += 1
+        return FakeInteraction(1000 + self._next_user % 500)
+
+    async def _run_operation(self, name):
+        bot = self.bot
+        interaction = self._interaction()
+        day = self.rng.choice(self.school_days)
+        if name in ('timetable', 'timetable_next', 'show_activities'):
+            await bot.timetable.callback(interaction, class_name=self.rng.choice(self.classes), date=day)
+            if name == 'timetable_next':
+                follow_up = self._interaction()
+                await _button(interaction.view, "➡️").callback(follow_up)
+                interaction = follow_up
+            elif name == 'show_activities':
+                follow_up = self._interaction()
+                await _button(interaction.view, "Show Activities").callback(follow_up)
+                interaction = follow_up
+        elif name == 'timetable_week':
+            await bot.timetable_week.callback(interaction, class_name=self.rng.choice(self.classes))
+        elif name in ('activities', 'activities_next'):
+            await bot.activities.callback(interaction, date=day)
+            if name == 'activities_next':
+                follow_up = self._interaction()
+                await _button(interaction.view, "Next Day Activities").callback(follow_up)
+                interaction = follow_up
+        elif name == 'activities_grade':
+            await bot.activities.callback(interaction, date=day, grade=self.rng.choice(GRADES))
+        elif name == 'search':
+            await bot.search_activities.callback(interaction, query=self.rng.choice(SEARCH_WORDS))
+        elif name == 'weather':
+            await bot.weather.callback(interaction)
+        elif name == 'bus':
+            await bot.bus_command.callback(interaction, stops=3)
+        return interaction
+
+    async def _worker(self, deadline, interval):
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(self.operations, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                interaction = await self._run_operation(name)
+                failed = interaction.failed
+            except Exception as e:
+                # Includes exceptions after defer(), which would leave the user without a follow-up
+                print(f"{name} raised {type(e).__name__}: {e}", file=sys.stderr)
+                failed = True
+            elapsed = time.perf_counter() - start
+            self.latencies[name].append(elapsed)
+            if failed:
+                self.errors[name] += 1
+            if interval:
+                await asyncio.sleep(max(0.0, interval - elapsed))
+            else:
+                # Let other workers and the watchdog run between operations, as the gateway would
+                await asyncio.sleep(0)
+
+    async def run(self, concurrency, duration, rate=None):
+        """
+        Runs `concurrency` workers for `duration` seconds; with `rate`, the workers together aim for
+        that many operations per second instead of going as fast as possible.
+        """
+        interval = concurrency / rate if rate else None
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*(self._worker(deadline, interval) for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def report(generator, elapsed, metrics, loop_watchdog):
+    total = sum(len(values) for values in generator.latencies.values())
+    print(f"\n{total} operations in {elapsed:.1f}s: {total / elapsed:.1f} ops/s")
+    print(f"\n{'operation':<18} {'count':>7} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, values in generator.latencies.items():
+        if not values:
+            continue
+        print(f"{name:<18} {len(values):>7} {generator.errors[name]:>7} "
+              + " ".join(f"{_percentile(values, q) * 1000:>7.1f}ms" for q in (0.5, 0.95, 0.99))
+              + f" {max(values) * 1000:>7.1f}ms")
+    lag = metrics.summary()['latency'].get('loop_lag')
+    if lag:
+        _, count, _, p50, p95, p99 = lag[0]
+        print(f"\nEvent loop lag: p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms "
+              f"({count} samples, {len(loop_watchdog.stalls)} stall(s) over {loop_watchdog.threshold * 1000:.0f}ms)")
+        for stall in loop_watchdog.recent_stalls():
+            print(f"  {stall.duration * 1000:.0f}ms in {stall.handler} ({stall.location()})")
+
+
+async def main_async(args):
+    # bot.py reads its configuration at import, so the environment has to be ready first
+    upstream = None
+    base_url = args.upstream
+    if base_url is None:
+        from fake_upstream import FakeUpstream
+        upstream = FakeUpstream(latency=args.upstream_latency, jitter=args.upstream_jitter)
+        base_url = upstream.start()
+    os.environ['SCHOOL_API_BASE_URL'] = base_url
+    os.environ['HKO_API_BASE_URL'] = base_url
+    os.environ['BUS_API_BASE_URL'] = base_url
+    # Keep the run's snapshots and logs out of the bot's own data/ and log/ directories
+    scratch_dir = tempfile.mkdtemp(prefix='event-schedule-loadgen-')
+    os.environ.setdefault('SHARED_CACHE', '0')
+    os.environ.setdefault('SNAPSHOT_PATH', os.path.join(scratch_dir, 'upstream_snapshot.json.gz'))
+    os.environ.setdefault('LOG_DIR', os.path.join(scratch_dir, 'log'))
+    os.environ.setdefault('LOG_SAMPLE_RATE', '0')
+
+    import bot
+    from metrics import metrics
+    from loop_watchdog import loop_watchdog
+    # Embeds use the bot's avatar, which normally comes from logging in
+    bot.bot._connection.user = FakeUser(0)
+    loop_watchdog.start()
+
+    generator = LoadGenerator(bot, args.mix, seed=args.seed)
+    print(f"Running {args.concurrency} workers for {args.duration:.0f}s against {base_url}...", file=sys.stderr)
+    elapsed = await generator.run(args.concurrency, args.duration, args.rate)
+    report(generator, elapsed, metrics, loop_watchdog)
+    if upstream is not None:
+        upstream.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the bot's handlers with synthetic interactions")
+    parser.add_argument('--concurrency', type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds to run for")
+    parser.add_argument('--rate', type=float, help="Target operations per second (default: as fast as possible)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('timetable=4,timetable_next=2,show_activities=1,activities=2,activities_next=1'),
+                        help="Operation weights, e.g. timetable=5,activities=2,weather=1")
+    parser.add_argument('--upstream', help="Base URL of a running fake_upstream.py (default: start one in-process)")
+    parser.add_argument('--upstream-latency', type=float, default=20, help="Latency of the in-process fake upstream (ms)")
+    parser.add_argument('--upstream-jitter', type=float, default=10, help="Jitter of the in-process fake upstream (ms)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Non-blocking logging for the bot.
+
+setup_logging() points the root logger at a QueueHandler, so logging a line only appends it to an
+in-memory queue; a QueueListener thread does the formatting and the file and console writes.
+Disk I/O therefore never runs on the event loop.
+
+Every record goes to log/logs.log and the console; records from the 'qrcode' logger also go to
+log/qrcode_logs.log. Both files rotate at midnight and keep 30 days.
+
+Environment:
+    LOG_DIR: Directory for log files (default: ./log)
+    LOG_FORMAT: 'json' for one JSON object per line instead of plain text
+    LOG_SAMPLE_RATE: Fraction (0-1) of INFO/DEBUG records to keep under heavy traffic (default: 1);
+        warnings and errors are always kept
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+LOG_DIR = os.getenv('LOG_DIR', os.path.join(os.getcwd(), 'log'))
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+QRCODE_LOGGER = 'qrcode'
+
+# Attributes every LogRecord has; anything else was passed via extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _extra_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class StructuredFormatter(logging.Formatter):
+    """The bot's usual 'time - level - message' lines, followed by any extra= fields as key=value."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += ' | ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random fraction of records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def _file_handler(path, formatter):
+    handler = TimedRotatingFileHandler(path, when='midnight', interval=1, backupCount=30, encoding='utf-8')
+    handler.suffix = "%Y-%m-%d"
+    handler.setFormatter(formatter)
+    return handler
+
+
+def setup_logging(log_dir=LOG_DIR, level=logging.INFO, log_format=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE):
+    """
+    Routes all logging through a queue to the bot's log files and the console.
+
+    Args:
+        log_dir (str): Directory for the log files, created if missing
+        level (int): Minimum level to log
+        log_format (str): 'text' or 'json'
+        sample_rate (float): Fraction of INFO/DEBUG records to keep
+
+    Returns:
+        QueueListener: The running listener; it is stopped (and the queue flushed) at exit
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    formatter = JsonFormatter() if log_format == 'json' else StructuredFormatter()
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    qrcode_handler = _file_handler(os.path.join(log_dir, 'qrcode_logs.log'), formatter)
+    qrcode_handler.addFilter(logging.Filter(QRCODE_LOGGER))
+    handlers = [_file_handler(os.path.join(log_dir, 'logs.log'), formatter), console_handler, qrcode_handler]
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    if sample_rate < 1:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
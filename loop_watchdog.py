@@ -0,0 +1,116 @@
+"""
+Event loop lag watchdog.
+
+A heartbeat coroutine wakes up every `interval` seconds and records how late it was (the loop's
+lag) in metrics. A separate thread watches the heartbeat: when it stops for longer than
+`threshold`, the loop is blocked, so the thread captures the loop thread's stack and names the
+command or button that is running it (handlers are named via metrics.timed / metrics.name_handler).
+Once the loop recovers the stall is logged, counted in metrics and kept for `/dev stats`.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import logging
+from collections import deque
+from datetime import datetime
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Blocking the loop for longer than this (in milliseconds) is reported as a stall
+LOOP_STALL_THRESHOLD_MS = int(os.getenv('LOOP_STALL_THRESHOLD_MS', '250'))
+
+
+class Stall:
+    """One period during which the event loop was blocked."""
+
+    __slots__ = ('at', 'duration', 'handler', 'stack')
+
+    def __init__(self, at, duration, handler, stack):
+        self.at = at
+        self.duration = duration
+        self.handler = handler
+        self.stack = stack
+
+    def location(self):
+        """The innermost frame of the captured stack, e.g. 'timetable_functions.py:150 in get_activities'."""
+        if not self.stack:
+            return "unknown location"
+        frame = self.stack[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+
+
+def _handler_for(frame):
+    # Walk outwards from the innermost frame to the first one that belongs to a named handler
+    while frame is not None:
+        name = metrics.handler_name(frame.f_code)
+        if name is not None:
+            return name
+        frame = frame.f_back
+    return None
+
+
+class LoopWatchdog:
+    """Measures event loop lag and reports what was running when the loop stalled."""
+
+    def __init__(self, threshold=LOOP_STALL_THRESHOLD_MS / 1000, interval=0.05, max_stalls=20):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(maxlen=max_stalls)
+        self._last_beat = time.perf_counter()
+        self._loop_thread_id = None
+        self._pending = None  # (handler, stack) captured while the current stall is in progress
+        self._task = None
+
+    def start(self):
+        """Starts the heartbeat on the running loop and the watching thread. Call from the loop."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat(), name='loop-watchdog')
+        threading.Thread(target=self._watch, name='loop-watchdog', daemon=True).start()
+        logger.info(f"Event loop watchdog started (stall threshold {self.threshold * 1000:.0f} ms)")
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            metrics.observe('loop_lag', 'event_loop', lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+            else:
+                self._pending = None
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            # The heartbeat is due every interval, so it is late by threshold once this much has passed
+            if self._pending is not None or time.perf_counter() - self._last_beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._pending = (_handler_for(frame), traceback.extract_stack(frame, limit=30))
+
+    def _record_stall(self, lag):
+        pending, self._pending = self._pending, None
+        handler, stack = pending if pending is not None else (None, None)
+        stall = Stall(datetime.now(), lag, handler or "unknown", stack)
+        self.stalls.append(stall)
+        metrics.increment('loop_stalls', stall.handler)
+        stack_text = ''.join(traceback.format_list(stack[-8:])) if stack else "  (stack not captured)\n"
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms in {stall.handler} at {stall.location()}:\n{stack_text.rstrip()}")
+
+    def recent_stalls(self, limit=5):
+        """Returns the most recent stalls, newest first."""
+        return list(self.stalls)[::-1][:limit]
+
+
+# Shared watchdog used by the bot
+loop_watchdog = LoopWatchdog()
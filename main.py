@@ -0,0 +1,11 @@
+"""
+Entry point for running the bot: python main.py (launcher.py and `python bot.py` start it too).
+
+Importing this module does nothing. Worker processes started with multiprocessing's spawn method
+(qr_bulk's QR pool) re-import the entry script, and if that were bot.py, every worker would set up
+logging, import discord.py and build the whole client again.
+"""
+
+if __name__ == "__main__":
+    import bot
+    bot.main()
@@ -0,0 +1,247 @@
+"""
+In-process metrics: latency histograms for commands, buttons and upstream calls, error counts,
+cache hit/miss counts and gauges (e.g. queue depths).
+
+Everything is kept in memory and is cheap enough to record on every interaction. summary() feeds
+`/dev stats`; prometheus_text() renders the Prometheus text format, served on localhost by
+start_http_server() when METRICS_PORT is set.
+"""
+import bisect
+import inspect
+import math
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = os.getenv('METRICS_PORT')
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their total, from which quantiles are estimated."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates the q-quantile (0-1) by interpolating within its bucket, as Prometheus does."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Thread-safe registry of the bot's histograms, counters and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (metric, label) -> Histogram
+        self._counters = {}    # (metric, label) -> int
+        self._gauges = {}      # name -> (callable returning a number, help text)
+        self._handler_names = {}  # code object -> 'metric:label', for attributing event loop stalls
+
+    def observe(self, metric, label, seconds, error=False):
+        """Records one timed operation, e.g. observe('command', 'timetable', 0.12)."""
+        with self._lock:
+            histogram = self._histograms.get((metric, label))
+            if histogram is None:
+                histogram = self._histograms[(metric, label)] = Histogram()
+            histogram.observe(seconds)
+            if error:
+                self._counters[(f"{metric}_errors", label)] = self._counters.get((f"{metric}_errors", label), 0) + 1
+
+    def increment(self, metric, label, amount=1):
+        with self._lock:
+            self._counters[(metric, label)] = self._counters.get((metric, label), 0) + amount
+
+    def cache(self, name, hit):
+        """Records a cache lookup for the named cache."""
+        self.increment('cache_hits' if hit else 'cache_misses', name)
+
+    def gauge(self, name, read, help_text=''):
+        """Registers a gauge whose value is read (by calling read()) when metrics are collected."""
+        with self._lock:
+            self._gauges[name] = (read, help_text)
+
+    def name_handler(self, func, name):
+        """Registers the name to report for stalls and profiles that happen inside func."""
+        self._handler_names[func.__code__] = name
+
+    def handler_name(self, code):
+        """Returns the name registered for a code object, or None."""
+        return self._handler_names.get(code)
+
+    def quantile(self, metric, label, q, min_count=1):
+        """Returns the estimated q-quantile of a latency, or None if it has fewer than min_count observations."""
+        with self._lock:
+            histogram = self._histograms.get((metric, label))
+            if histogram is None or histogram.count < min_count:
+                return None
+            return histogram.quantile(q)
+
+    @contextmanager
+    def timer(self, metric, label):
+        """Times the block; an exception escaping it is counted as an error and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(metric, label, time.perf_counter() - start, error=True)
+            raise
+        self.observe(metric, label, time.perf_counter() - start)
+
+    def timed(self, metric, label):
+        """Decorator form of timer() for sync or async functions, e.g. button callbacks."""
+        def decorator(func):
+            self.name_handler(func, f"{metric}:{label}")
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(metric, label):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(metric, label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _read_gauges(self):
+        values = {}
+        for name, (read, help_text) in list(self._gauges.items()):
+            try:
+                values[name] = (float(read()), help_text)
+            except Exception as e:
+                logger.debug(f"Gauge {name} unavailable: {e}")
+        return values
+
+    def summary(self):
+        """
+        Returns a snapshot for display.
+
+        Returns:
+            dict: 'latency' {metric: [(label, count, errors, p50, p95, p99), ...]} (seconds, busiest first),
+            'caches' [(name, hits, misses)] and 'gauges' {name: value}
+        """
+        with self._lock:
+            latency = {}
+            for (metric, label), histogram in self._histograms.items():
+                errors = self._counters.get((f"{metric}_errors", label), 0)
+                latency.setdefault(metric, []).append((
+                    label, histogram.count, errors,
+                    histogram.quantile(0.5), histogram.quantile(0.95), histogram.quantile(0.99)
+                ))
+            for rows in latency.values():
+                rows.sort(key=lambda row: row[1], reverse=True)
+            cache_names = sorted({label for metric, label in self._counters if metric in ('cache_hits', 'cache_misses')})
+            caches = [
+                (name, self._counters.get(('cache_hits', name), 0), self._counters.get(('cache_misses', name), 0))
+                for name in cache_names
+            ]
+        gauges = {name: value for name, (value, _) in self._read_gauges().items()}
+        return {'latency': latency, 'caches': caches, 'gauges': gauges}
+
+    def prometheus_text(self):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        seen = set()
+        for (metric, label), histogram in histograms:
+            name = f"bot_{metric}_seconds"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == math.inf else repr(float(bound))
+                lines.append(f'{name}_bucket{{name="{_escape(label)}",le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum{{name="{_escape(label)}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{name="{_escape(label)}"}} {histogram.count}')
+        for (metric, label), value in counters:
+            name = f"bot_{metric}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f'{name}{{name="{_escape(label)}"}} {value}')
+        for gauge_name, (value, help_text) in sorted(self._read_gauges().items()):
+            name = f"bot_{gauge_name}"
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label):
+    return str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the bot's log
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """
+    Serves /metrics in Prometheus format from a background thread.
+
+    Args:
+        port (int): Port to listen on
+        host (str): Interface to bind; localhost by default so the endpoint isn't public
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it)
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+# Shared registry used by the bot and its upstream clients
+metrics = Metrics()
@@ -0,0 +1,216 @@
+"""
+Bulk QR code generation for /qrcode_bulk: a list of URLs in, a ZIP of PNG or SVG files out.
+
+The list is a text or CSV file with one URL per line, optionally with a label
+('label,url' or 'url, label'). Codes not already in qr_code's cache are rendered in a pool of
+worker processes (QR encoding is pure Python, so threads wouldn't run it in parallel), and each
+image is written into the archive as soon as it is ready.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+import logging
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from PIL import ImageColor
+from qr_code import generate_qr_code, cached_qr_code, remember_qr_code, QR_TARGET_SIZE
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Limits per request, so one upload can't tie up the workers or exceed Discord's attachment size
+MAX_URLS = 200
+MAX_ARCHIVE_BYTES = 8 * 1024 * 1024
+QR_WORKERS = int(os.getenv('QR_WORKERS', min(4, os.cpu_count() or 1)))
+# Seconds an archive's codes may take to render in the pool before the request is given up
+QR_RENDER_TIMEOUT = 60
+
+_pool = None
+
+
+class BulkQRError(Exception):
+    """Raised when a URL list can't be turned into an archive. The message is user-facing."""
+
+
+def _worker_pool():
+    global _pool
+    if _pool is None:
+        # spawn, not fork: a forked worker would inherit the bot's threads' locks, possibly held. Spawned
+        # workers re-import the entry script, which is why the bot starts from the empty main.py
+        _pool = ProcessPoolExecutor(max_workers=QR_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _reset_pool():
+    # A worker died; the pool can't be used again, so the next request starts a new one
+    global _pool
+    logger.error("QR worker pool broke, starting a new one on the next request")
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _render(url, style, color, size, fmt):
+    # Runs in a worker process; the parent caches the result
+    return generate_qr_code(url, style=style, color=color, size=size, fmt=fmt).getvalue()
+
+
+def _is_url(text):
+    return text.startswith('http://') or text.startswith('https://')
+
+
+def _parse_line(line):
+    """
+    Returns (url, label or None) for one line of a URL list, or None if it has no URL.
+
+    URLs may contain commas, so unquoted lines aren't split as CSV: in 'label,url' the URL is
+    everything from the first http:// or https:// after a comma, and in 'url, label' (or
+    'url<tab>label') the URL ends at the first whitespace, which URLs never contain.
+    """
+    if line.startswith('"'):
+        # Quoted CSV cells, e.g. '"Room 1, Block A",https://...' or '"https://...,x",label'
+        cells = [cell.strip() for cell in next(csv.reader([line])) if cell.strip()]
+        urls = [cell for cell in cells if _is_url(cell)]
+        if not urls:
+            return None
+        labels = [cell for cell in cells if cell != urls[0]]
+        return urls[0], labels[0] if labels else None
+    if _is_url(line):
+        parts = line.split(None, 1)
+        url = parts[0].rstrip(',;')
+        label = parts[1].lstrip(',;').strip() if len(parts) > 1 else ''
+        return url, label or None
+    match = re.match(r'(.*?)\s*[,;\t]\s*(https?://\S+)\s*$', line)
+    if match is None:
+        return None
+    label = match.group(1).strip().strip('"')
+    return match.group(2), label or None
+
+
+def parse_url_list(data):
+    """
+    Reads URLs and optional labels from an uploaded file.
+
+    Args:
+        data (bytes): File contents (UTF-8 text or CSV)
+
+    Returns:
+        tuple: (list of (url, label or None), list of skipped line descriptions)
+
+    Raises:
+        BulkQRError: If the file isn't text, has no URLs or has more than MAX_URLS
+    """
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise BulkQRError("Error: The file must be UTF-8 text or CSV.")
+    entries = []
+    skipped = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        entry = _parse_line(line)
+        if entry is None:
+            # A header row ('label,url') or a line without a URL
+            if line_number > 1:
+                skipped.append(f"line {line_number}: no http:// or https:// URL")
+            continue
+        entries.append(entry)
+    if not entries:
+        raise BulkQRError("Error: No URLs found. Put one URL per line, optionally as 'label,url'.")
+    if len(entries) > MAX_URLS:
+        raise BulkQRError(f"Error: Too many URLs ({len(entries)}); the limit is {MAX_URLS} per file.")
+    return entries, skipped
+
+
+def _filename(index, url, label, used, extension):
+    base = label or re.sub(r'^https?://', '', url)
+    base = re.sub(r'[^\w\-. ]+', '_', base).strip(' ._')[:60] or 'qrcode'
+    name = f"{index:03d}_{base}.{extension}"
+    suffix = 2
+    while name in used:
+        name = f"{index:03d}_{base}_{suffix}.{extension}"
+        suffix += 1
+    used.add(name)
+    return name
+
+
+def _rendered(entries, style, color, fmt):
+    """Yields (url, label, image bytes) in input order, rendering cache misses in the worker pool."""
+    futures = {}
+    for url, _ in entries:
+        if url in futures:
+            continue
+        data = cached_qr_code(url, style, color, QR_TARGET_SIZE, fmt)
+        metrics.cache('qr_code', data is not None)
+        futures[url] = data if data is not None else _worker_pool().submit(_render, url, style, color, QR_TARGET_SIZE, fmt)
+    deadline = time.monotonic() + QR_RENDER_TIMEOUT
+    try:
+        for url, label in entries:
+            result = futures[url]
+            if not isinstance(result, bytes):
+                try:
+                    result = result.result(timeout=max(0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    raise BulkQRError("Error: Rendering the QR codes took too long. Please try again with fewer URLs.")
+                except BrokenProcessPool:
+                    _reset_pool()
+                    raise BulkQRError("Error: QR code rendering failed. Please try again.")
+                futures[url] = result
+                remember_qr_code(url, style, color, result, QR_TARGET_SIZE, fmt)
+            yield url, label, result
+    finally:
+        # Don't leave the rest of a failed archive queued in the pool
+        for result in futures.values():
+            if not isinstance(result, bytes):
+                result.cancel()
+
+
+def build_qr_zip(entries, style, color=None, fmt='png'):
+    """
+    Renders a QR code for every entry and packs them into a ZIP with a manifest.csv.
+
+    Blocking (it waits for the worker pool): run it off the event loop.
+
+    Args:
+        entries (list): (url, label or None) tuples from parse_url_list
+        style (str): QR code style (see qr_code.generate_qr_code)
+        color (str): QR code color, or None for black
+        fmt (str): 'png' or 'svg'
+
+    Returns:
+        bytes: The ZIP archive
+
+    Raises:
+        BulkQRError: If the color is invalid, rendering takes over QR_RENDER_TIMEOUT seconds or the
+            archive grows past MAX_ARCHIVE_BYTES
+    """
+    if color:
+        try:
+            ImageColor.getrgb(color)
+        except ValueError:
+            raise BulkQRError(f"Error: Unknown color {color}.")
+    output = io.BytesIO()
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(['file', 'label', 'url'])
+    used = set()
+    with metrics.timer('qr_bulk', style):
+        # PNGs are already compressed, so they are stored as-is; SVG text compresses well
+        compression = zipfile.ZIP_DEFLATED if fmt == 'svg' else zipfile.ZIP_STORED
+        with zipfile.ZipFile(output, 'w', compression=compression) as archive:
+            for index, (url, label, data) in enumerate(_rendered(entries, style, color, fmt), start=1):
+                name = _filename(index, url, label, used, fmt)
+                archive.writestr(name, data)
+                writer.writerow([name, label or '', url])
+                if output.tell() > MAX_ARCHIVE_BYTES:
+                    raise BulkQRError(f"Error: The archive is over {MAX_ARCHIVE_BYTES // (1024 * 1024)} MB; "
+                                      f"split the list into smaller files.")
+            archive.writestr('manifest.csv', manifest.getvalue())
+    logger.info(f"Built a QR archive of {len(entries)} code(s), {output.tell()} bytes")
+    return output.getvalue()
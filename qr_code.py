@@ -1,65 +1,154 @@
 import qrcode
-from PIL import Image, ImageDraw
+from PIL import Image, ImageColor
 import io
+import math
+import threading
+from collections import OrderedDict
 
-def generate_qr_code(url: str, style: str, color: str = None) -> io.BytesIO:
-    """Generate a QR code with the specified style and color."""
-    # Default color
-    fg_color = color if color else "black"
-    
-    # Create QR code
+# Rendered QR codes kept in memory by qr_code_bytes
+QR_CACHE_SIZE = 512
+_rendered = OrderedDict()  # (url, style, color, size, fmt) -> image bytes
+_rendered_lock = threading.Lock()
+
+# Default width/height in pixels; each module is drawn as a whole number of pixels, at least 2
+QR_TARGET_SIZE = 320
+QR_BORDER = 4
+STYLES = ('solid', 'horizontal_gradient', 'vertical_gradient', 'radial_gradient')
+
+
+def _matrix(url: str):
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+        border=QR_BORDER,
     )
     qr.add_data(url)
     qr.make(fit=True)
-    
-    # Create base image
+    # Rows of booleans (True = dark module), quiet zone included
+    return qr.get_matrix()
+
+
+def _gradient_color(style, x, y, width, height):
+    """Colour of a dark module centred at (x, y): blue fading to red across the code."""
+    if style == "horizontal_gradient":
+        t = x / width
+    elif style == "vertical_gradient":
+        t = y / height
+    elif style == "radial_gradient":
+        cx, cy = width / 2, height / 2
+        t = math.hypot(x - cx, y - cy) / math.hypot(width / 2, height / 2)
+    else:
+        return (0, 0, 0)
+    return (int(255 * t), 0, int(255 * (1 - t)))
+
+
+def _png(matrix, style, fg_color, size):
+    modules = len(matrix)
+    scale = max(2, size // modules)
     if style == "solid":
-        img = qr.make_image(fill_color=fg_color, back_color="white")
+        # Two-colour palette image: 1 bit per pixel once optimized
+        img = Image.new("P", (modules, modules), 0)
+        img.putpalette([255, 255, 255] + list(ImageColor.getrgb(fg_color)[:3]))
+        img.putdata([1 if dark else 0 for row in matrix for dark in row])
     else:
-        # Convert to PIL image for gradient styles
-        base_img = qr.make_image(fill_color="black", back_color="white")
-        img = Image.new("RGB", base_img.size, "white")
-        draw = ImageDraw.Draw(img)
-        
-        width, height = base_img.size
-        for y in range(height):
-            for x in range(width):
-                if base_img.getpixel((x, y)) == 0:  # Black pixel (QR code)
-                    if style == "horizontal_gradient":
-                        r = int(255 * (x / width))
-                        g = 0
-                        b = int(255 * (1 - x / width))
-                    elif style == "vertical_gradient":
-                        r = int(255 * (y / height))
-                        g = 0
-                        b = int(255 * (1 - y / height))
-                    elif style == "radial_gradient":
-                        cx, cy = width / 2, height / 2
-                        dist = ((x - cx) ** 2 + (y - cy) ** 2) ** 0.5
-                        max_dist = ((width / 2) ** 2 + (height / 2) ** 2) ** 0.5
-                        r = int(255 * (dist / max_dist))
-                        g = 0
-                        b = int(255 * (1 - dist / max_dist))
-                    else:
-                        r, g, b = 0, 0, 0  # Fallback
-                    draw.point((x, y), (r, g, b))
-    
-    # Override color for solid style if specified
-    if style == "solid" and color:
-        img = img.convert("RGB")
+        # Colour each module once at module resolution, then scale up without resampling
+        img = Image.new("RGB", (modules, modules), "white")
         pixels = img.load()
-        for y in range(img.size[1]):
-            for x in range(img.size[0]):
-                if pixels[x, y] == (0, 0, 0):  # Black pixel
-                    pixels[x, y] = Image.new("RGB", (1, 1), fg_color).getpixel((0, 0))
-    
-    # Save to BytesIO
+        for y, row in enumerate(matrix):
+            for x, dark in enumerate(row):
+                if dark:
+                    pixels[x, y] = _gradient_color(style, x + 0.5, y + 0.5, modules, modules)
+        # Linear gradients have one colour per row/column; radial ones are reduced to 256 colours
+        img = img.quantize(colors=256, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    img = img.resize((modules * scale, modules * scale), Image.Resampling.NEAREST)
     output = io.BytesIO()
-    img.save(output, format="PNG")
-    output.seek(0)
-    return output
\ No newline at end of file
+    img.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def _svg(matrix, style, fg_color):
+    modules = len(matrix)
+    # One rectangle per horizontal run of dark modules
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < modules:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < modules and row[x]:
+                x += 1
+            runs.append(f"M{start},{y}h{x - start}v1h-{x - start}z")
+    path = "".join(runs)
+    if style == "solid":
+        fill = "#%02x%02x%02x" % ImageColor.getrgb(fg_color)[:3]
+        defs = ""
+    else:
+        fill = "url(#g)"
+        stops = '<stop offset="0" stop-color="#0000ff"/><stop offset="1" stop-color="#ff0000"/>'
+        if style == "radial_gradient":
+            radius = math.hypot(modules / 2, modules / 2)
+            defs = (f'<defs><radialGradient id="g" gradientUnits="userSpaceOnUse" cx="{modules / 2}" '
+                    f'cy="{modules / 2}" r="{radius:.3f}">{stops}</radialGradient></defs>')
+        else:
+            x2, y2 = (modules, 0) if style == "horizontal_gradient" else (0, modules)
+            defs = (f'<defs><linearGradient id="g" gradientUnits="userSpaceOnUse" x1="0" y1="0" '
+                    f'x2="{x2}" y2="{y2}">{stops}</linearGradient></defs>')
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {modules} {modules}" '
+        f'shape-rendering="crispEdges">{defs}<rect width="100%" height="100%" fill="#ffffff"/>'
+        f'<path fill="{fill}" d="{path}"/></svg>'
+    )
+    return svg.encode("utf-8")
+
+
+def generate_qr_code(url: str, style: str, color: str = None, size: int = QR_TARGET_SIZE, fmt: str = "png") -> io.BytesIO:
+    """
+    Generate a QR code with the specified style and color.
+
+    Args:
+        url (str): Text to encode
+        style (str): One of STYLES; gradient styles ignore color
+        color (str): Colour for the solid style (e.g. 'red', '#FF0000'); defaults to black
+        size (int): Approximate width in pixels for PNG output. Modules are scaled by a whole
+            number of pixels, so the image is at most this size (or 2 pixels per module if larger)
+        fmt (str): 'png' (palette PNG) or 'svg'
+
+    Returns:
+        io.BytesIO: The encoded image
+    """
+    fg_color = color if color else "black"
+    matrix = _matrix(url)
+    if fmt == "svg":
+        data = _svg(matrix, style, fg_color)
+    else:
+        data = _png(matrix, style, fg_color, size)
+    return io.BytesIO(data)
+
+
+def cached_qr_code(url: str, style: str, color: str = None, size: int = QR_TARGET_SIZE, fmt: str = "png"):
+    """Bytes of a QR code rendered earlier, or None."""
+    key = (url, style, color, size, fmt)
+    with _rendered_lock:
+        data = _rendered.get(key)
+        if data is not None:
+            _rendered.move_to_end(key)
+        return data
+
+
+def remember_qr_code(url: str, style: str, color: str, data: bytes, size: int = QR_TARGET_SIZE, fmt: str = "png"):
+    """Adds rendered image bytes to the cache (e.g. ones rendered in a worker process)."""
+    with _rendered_lock:
+        _rendered[(url, style, color, size, fmt)] = data
+        while len(_rendered) > QR_CACHE_SIZE:
+            _rendered.popitem(last=False)
+
+
+def qr_code_bytes(url: str, style: str, color: str = None, size: int = QR_TARGET_SIZE, fmt: str = "png") -> bytes:
+    """Bytes of generate_qr_code(...), from the cache when it was rendered before."""
+    data = cached_qr_code(url, style, color, size, fmt)
+    if data is None:
+        data = generate_qr_code(url, style=style, color=color, size=size, fmt=fmt).getvalue()
+        remember_qr_code(url, style, color, data, size, fmt)
+    return data
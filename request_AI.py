@@ -1,16 +1,27 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
-import openai
+import threading
+from metrics import metrics
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the OpenAI client
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://api.chatanywhere.tech/v1"
-)
+# The OpenAI SDK is slow to import, so the client is created on first use (or by the bot's warm-up)
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url="https://api.chatanywhere.tech/v1"
+                )
+    return client
 
 def gpt_35_api(messages: list,model:str):
     """为提供的对话消息创建新的回答
@@ -18,15 +29,17 @@ def gpt_35_api(messages: list,model:str):
     Args:
         messages (list): 完整的对话消息
     """
+    import openai
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
+        with metrics.timer('upstream', 'openai'):
+            completion = get_client().chat.completions.create(
+                model=model,
+                messages=messages
+            )
         return completion.choices[0].message.content
     except openai.AuthenticationError:
         return "Error: Invalid API key or authentication failure. Please check OPENAI_API_KEY in .env."
     except openai.RateLimitError:
         return "Error: Rate limit exceeded. Please try again later."
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
@@ -0,0 +1,194 @@
+"""
+Failure handling for upstream fetches: a circuit breaker, retries with jittered backoff and hedged
+requests.
+
+These keep tail latency bounded when an upstream is degraded. The breaker stops calling an upstream
+that keeps failing (callers serve their saved copy instead), retries absorb brief connection blips,
+and a hedged request races a second copy of a call that is taking longer than usual.
+"""
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Hedged requests run here; the slower copy of each call finishes in the background
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedge')
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after repeated failures.
+
+    After failure_threshold consecutive failures the breaker opens and calls fail immediately with
+    CircuitOpenError. Once reset_timeout seconds have passed, one trial call is let through
+    (half-open): success closes the breaker, failure opens it again. clock is the time source
+    (time.monotonic; tests pass a fake one).
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def retry_in(self):
+        """Seconds until the next trial call is allowed (0 if calls are allowed now)."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def _allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def _record(self, success):
+        with self._lock:
+            self._trial_running = False
+            if success:
+                if self.state != self.CLOSED:
+                    logger.info(f"Circuit {self.name} closed: upstream recovered")
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit {self.name} opened after {self.failures} failure(s); "
+                                   f"failing fast for {self.reset_timeout}s")
+                    metrics.increment('circuit_opened', self.name)
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def call(self, func, failure_types=(Exception,)):
+        """
+        Calls func() unless the breaker is open.
+
+        Args:
+            func (callable): The upstream call
+            failure_types (tuple): Exceptions that count as upstream failures; others pass through
+                without affecting the breaker
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+        """
+        if not self._allow():
+            metrics.increment('circuit_rejected', self.name)
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+        try:
+            result = func()
+        except failure_types:
+            self._record(False)
+            raise
+        except BaseException:
+            with self._lock:
+                self._trial_running = False
+            raise
+        self._record(True)
+        return result
+
+
+def retry(func, attempts=3, base_delay=0.2, max_delay=2.0, should_retry=lambda e: True, name=None, deadline=None,
+          clock=time.monotonic, sleep=time.sleep, rng=random):
+    """
+    Calls func(), retrying failures with "full jitter" exponential backoff.
+
+    Args:
+        func (callable): The call to make
+        attempts (int): Maximum number of calls
+        base_delay (float): Backoff before the first retry is random in [0, base_delay] seconds
+        max_delay (float): Upper bound of the backoff
+        should_retry (callable): Given the exception, returns whether it is worth retrying
+        name (str): Name for the retry counter in metrics
+        deadline (float): clock() time after which no further attempt is started
+        clock, sleep, rng: Time source, sleep function and random source (tests pass fakes)
+
+    Raises:
+        Exception: The last failure, once attempts or time are used up or it isn't retryable
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts - 1 or not should_retry(e):
+                raise
+            delay = rng.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if deadline is not None and clock() + delay >= deadline:
+                raise
+            if name:
+                metrics.increment('retries', name)
+            logger.info(f"Retrying {name or 'call'} in {delay:.2f}s after: {e}")
+            sleep(delay)
+
+
+def hedged(func, hedge_after, name=None, pool=None):
+    """
+    Calls func() and, if it hasn't finished after hedge_after seconds, a second func() in parallel,
+    returning whichever succeeds first. The other copy is cancelled if it hasn't started yet.
+
+    Args:
+        func (callable): The call to make; must be safe to run twice concurrently
+        hedge_after (float): Seconds to wait before hedging, or None to never hedge
+        name (str): Name for the hedge counter in metrics
+        pool (Executor): Where the calls run (defaults to a shared pool)
+
+    Raises:
+        Exception: The failure of the last call to finish, if both fail
+    """
+    if hedge_after is None:
+        return func()
+    pool = pool or _hedge_pool
+    first = pool.submit(func)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+    if name:
+        metrics.increment('hedged_requests', name)
+    pending = {first, pool.submit(func)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            # A copy still queued behind other calls would only repeat the request
+            for other in pending:
+                other.cancel()
+            return result
+    raise error
+
+
+def hedge_delay(metric, label, quantile=0.95, min_samples=20, floor=0.05):
+    """
+    Returns how long to wait before hedging a call: its recent latency quantile from metrics, or
+    None (don't hedge) until there are enough samples to know what "slow" means.
+    """
+    delay = metrics.quantile(metric, label, quantile, min_samples)
+    return None if delay is None else max(floor, delay)
@@ -0,0 +1,116 @@
+"""
+Low-overhead sampling profiler for the running bot.
+
+Every `interval` seconds a background thread reads the stack of each thread with
+sys._current_frames() and counts it. Nothing is traced, so the bot runs at full speed while
+being profiled. Results are exported as collapsed stacks (one 'frame;frame;frame count' line per
+stack, for flamegraph.pl or speedscope) or as a pstats file (for pstats, snakeviz, etc.).
+"""
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Only one profile can run at a time
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is started while another one is running."""
+
+
+class NoSamples(Exception):
+    """Raised when exporting as pstats a profile that sampled no stacks (pstats can't read an empty file)."""
+
+
+def _frame_key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread (except its own) for a fixed duration."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()  # (thread name, (frame key, ...) outermost first) -> count
+        self.sample_count = 0
+        self.duration = 0.0
+
+    def run(self, duration):
+        """
+        Samples for `duration` seconds. Blocking: run it off the event loop.
+
+        Raises:
+            ProfilerBusy: If another profile is already running
+        """
+        if not _running.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            own_id = threading.get_ident()
+            start = time.perf_counter()
+            deadline = start + duration
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_key(frame.f_code))
+                        frame = frame.f_back
+                    self.samples[(names.get(thread_id, str(thread_id)), tuple(reversed(stack)))] += 1
+                self.sample_count += 1
+                time.sleep(self.interval)
+            self.duration = time.perf_counter() - start
+        finally:
+            _running.release()
+        return self
+
+    def collapsed(self):
+        """Returns the samples as collapsed stacks, busiest first ('' if there are none)."""
+        lines = []
+        for (thread_name, stack), count in self.samples.most_common():
+            frames = [thread_name.replace(';', ':')] + [
+                f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in stack
+            ]
+            lines.append(f"{';'.join(frames)} {count}")
+        return "".join(f"{line}\n" for line in lines)
+
+    def pstats_bytes(self):
+        """
+        Returns the samples in the marshalled format read by pstats.Stats(path).
+
+        Times are estimated from sample counts: a function's own time is the samples in which it
+        was the innermost frame, its cumulative time the samples in which it was anywhere on the
+        stack, and call counts are sample counts.
+
+        Raises:
+            NoSamples: If no stack was sampled
+        """
+        seconds_per_sample = self.duration / self.sample_count if self.sample_count else self.interval
+        own = Counter()
+        total = Counter()
+        callers = {}
+        for (_, stack), count in self.samples.items():
+            if not stack:
+                continue
+            own[stack[-1]] += count
+            for key in set(stack):
+                total[key] += count
+            for caller, callee in set(zip(stack, stack[1:])):
+                edges = callers.setdefault(callee, Counter())
+                edges[caller] += count
+        stats = {}
+        for key, count in total.items():
+            stats[key] = (
+                count, count, own[key] * seconds_per_sample, count * seconds_per_sample,
+                {
+                    caller: (edge, edge, 0.0, edge * seconds_per_sample)
+                    for caller, edge in callers.get(key, {}).items()
+                }
+            )
+        if not stats:
+            raise NoSamples("No stacks were sampled")
+        return marshal.dumps(stats)
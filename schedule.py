@@ -0,0 +1,150 @@
+"""
+Results of timetable and activity lookups.
+
+get_timetable and get_activities return a Result holding a DayTimetable or DayActivities, or an
+error message, so the bot formats structured data instead of telling strings apart. The classes
+use __slots__, and subject, venue and activity strings are interned, so every lesson of every
+class shares the same few hundred string objects.
+"""
+import sys
+
+PERIODS = 6
+GRADES = ('S1', 'S2', 'S3', 'S4', 'S5', 'S6')
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Lesson:
+    """One period of a class's timetable."""
+
+    __slots__ = ('period', 'subject', 'venue')
+
+    def __init__(self, period, subject, venue=None):
+        self.period = period
+        self.subject = _intern(subject)
+        self.venue = _intern(venue)
+
+    def __str__(self):
+        return f"Lesson {self.period}: {self.subject}"
+
+    def __repr__(self):
+        return f"Lesson({self.period!r}, {self.subject!r}, {self.venue!r})"
+
+
+class DayTimetable:
+    """A class's lessons on one date; cycle_day is '/' (and there are no lessons) on days without school."""
+
+    __slots__ = ('class_name', 'date', 'cycle_day', 'lessons')
+
+    def __init__(self, class_name, date, cycle_day, lessons=()):
+        self.class_name = _intern(class_name)
+        self.date = _intern(date)
+        self.cycle_day = _intern(cycle_day)
+        self.lessons = tuple(lessons)
+
+    @property
+    def school_day(self):
+        return self.cycle_day != '/'
+
+    def lines(self):
+        """'Lesson N: subject' for each lesson, padded with 'Lesson N: None' up to PERIODS lessons."""
+        lines = [str(lesson) for lesson in self.lessons]
+        lines.extend(f"Lesson {period}: None" for period in range(len(lines) + 1, PERIODS + 1))
+        return lines
+
+
+class ActivitySlot:
+    """The activities in one slot of a day (e.g. AM, PM): per grade, plus ones for the whole school."""
+
+    __slots__ = ('name', 'grades', 'other')
+
+    def __init__(self, name, grades=(), other=()):
+        self.name = _intern(name)
+        # ((grade, (activity, ...)), ...) for the grades with activities, in GRADES order
+        self.grades = tuple((_intern(grade), tuple(map(_intern, activities))) for grade, activities in grades)
+        self.other = tuple(map(_intern, other))
+
+    @classmethod
+    def from_feed(cls, name, slot_data):
+        """Builds a slot from the event-schedule feed's {'S1': [...], ..., 'otherActivities': [...]}."""
+        grades = [(grade, slot_data[grade]) for grade in GRADES if slot_data.get(grade)]
+        return cls(name, grades, slot_data.get('otherActivities') or ())
+
+    def for_grade(self, grade):
+        """The slot with only one grade's activities, plus the ones for the whole school."""
+        slot = ActivitySlot.__new__(ActivitySlot)
+        slot.name = self.name
+        slot.grades = tuple(entry for entry in self.grades if entry[0] == grade)
+        slot.other = self.other
+        return slot
+
+    def lines(self):
+        """'S1: activity' for each grade's activities, then the other activities."""
+        lines = [f"{grade}: {activity}" for grade, activities in self.grades for activity in activities]
+        lines.extend(self.other)
+        return lines
+
+    def __bool__(self):
+        return bool(self.grades or self.other)
+
+    def __repr__(self):
+        return f"ActivitySlot({self.name!r}, {self.grades!r}, {self.other!r})"
+
+
+class DayActivities:
+    """
+    The activities and remark for a date, optionally only one grade's and/or one slot's. When the
+    schedule has no row for the requested date, date is the closest date that has one; stale_since
+    is set when the schedule is a saved copy.
+    """
+
+    __slots__ = ('date', 'requested_date', 'slots', 'remark', 'stale_since', 'grade', 'slot')
+
+    def __init__(self, date, slots, remark='', requested_date=None, stale_since=None, grade=None, slot=None):
+        self.date = date
+        self.requested_date = requested_date or date
+        self.slots = tuple(slot for slot in slots if slot)
+        self.remark = remark or ''
+        self.stale_since = stale_since
+        self.grade = grade
+        self.slot = slot
+
+    @property
+    def filter_label(self):
+        """'S3', 'PM', 'S3, PM', or '' when showing everything."""
+        return ", ".join(part for part in (self.grade, self.slot) if part)
+
+    @property
+    def closest_date_note(self):
+        if self.requested_date == self.date:
+            return None
+        return f"No activities found for {self.requested_date}. Showing activities for closest date: {self.date}"
+
+    @property
+    def stale_note(self):
+        if self.stale_since is None:
+            return None
+        return f"Server unavailable. Showing saved schedule from {self.stale_since}."
+
+
+class Result:
+    """The value of a lookup, or the user-facing error message ('Error: ...') explaining why there isn't one."""
+
+    __slots__ = ('value', 'error')
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    @classmethod
+    def failure(cls, error):
+        return cls(error=error)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"Result(error={self.error!r})" if self.error is not None else f"Result({self.value!r})"
@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from event_feed import EventFeed, FEED_URL
+from subscriptions import write_json_atomic, DATA_DIR
+from timetable_store import load_timetable_store, close_replaced_store, TIMETABLE_JSON, CYCLE_JSON, TIMETABLE_BIN, SYNCED_BIN
+from timetable_sync import TimetableSync, TIMETABLE_URL, CYCLE_URL
+
+logger = logging.getLogger(__name__)
+
+SCHOOLS_CONFIG = 'schools.json'
+GUILD_BINDINGS_PATH = os.path.join(DATA_DIR, 'guild_schools.json')
+DEFAULT_SCHOOL_ID = 'spyc'
+
+# Built-in profile used when there is no schools.json (the original single-school setup)
+DEFAULT_PROFILE = {
+    'name': "St. Paul's Co-educational College",
+    'timetable_path': TIMETABLE_JSON,
+    'cycle_path': CYCLE_JSON,
+    'bin_path': TIMETABLE_BIN,
+    'synced_path': SYNCED_BIN,
+    'timetable_url': TIMETABLE_URL,
+    'cycle_url': CYCLE_URL,
+    'feed_url': FEED_URL,
+}
+
+
+class SchoolProfile:
+    """Where one school's timetable, cycle calendar and event-schedule feed come from."""
+
+    def __init__(self, school_id, name, timetable_path, cycle_path, feed_url,
+                 timetable_url=None, cycle_url=None, bin_path=None, synced_path=None, location=None):
+        self.school_id = school_id
+        self.name = name
+        self.timetable_path = timetable_path
+        self.cycle_path = cycle_path
+        self.feed_url = feed_url
+        self.timetable_url = timetable_url
+        self.cycle_url = cycle_url
+        self.bin_path = bin_path or os.path.join(os.path.dirname(timetable_path), 'timetable.bin')
+        self.synced_path = synced_path or os.path.join(DATA_DIR, f"timetable_{school_id}.bin")
+        # (lat, lon) used by /bus to find nearby stops; None means bus.SCHOOL_LOCATION
+        self.location = location
+
+    @classmethod
+    def from_config(cls, school_id, config):
+        missing = [key for key in ('timetable_path', 'cycle_path', 'feed_url') if not config.get(key)]
+        if missing:
+            raise ValueError(f"School {school_id} is missing {', '.join(missing)} in {SCHOOLS_CONFIG}")
+        return cls(
+            school_id,
+            config.get('name', school_id),
+            config['timetable_path'],
+            config['cycle_path'],
+            config['feed_url'],
+            timetable_url=config.get('timetable_url'),
+            cycle_url=config.get('cycle_url'),
+            bin_path=config.get('bin_path'),
+            synced_path=config.get('synced_path'),
+            location=tuple(config['location']) if config.get('location') else None,
+        )
+
+
+class SchoolDataset:
+    """One school's loaded data: timetable store, event feed and timetable sync job."""
+
+    def __init__(self, profile, feed_listeners=()):
+        self.profile = profile
+        self.last_used = time.monotonic()
+        self._store = None
+        self._store_lock = threading.Lock()
+        self.feed = EventFeed(profile.feed_url)
+        for callback in feed_listeners:
+            self.feed.add_listener(lambda diff, callback=callback: callback(profile.school_id, diff))
+        self.feed.restore_snapshot()
+        self.sync = None
+        if profile.timetable_url and profile.cycle_url:
+            self.sync = TimetableSync(profile.timetable_url, profile.cycle_url, out_path=profile.synced_path,
+                                      on_update=self.set_store)
+
+    def load_store(self):
+        """
+        Returns the school's timetable data, loading it on first use.
+
+        Raises:
+            FileNotFoundError: If the school's timetable files don't exist
+        """
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = load_timetable_store(self.profile.timetable_path, self.profile.cycle_path,
+                                                       self.profile.bin_path, self.profile.synced_path)
+        return self._store
+
+    @property
+    def loaded_store(self):
+        """The timetable store if it has been loaded, else None (without loading it)."""
+        return self._store
+
+    def set_store(self, store):
+        """Swaps in a new timetable store and closes the old one (see timetable_store.set_timetable_store)."""
+        with self._store_lock:
+            previous, self._store = self._store, store
+        close_replaced_store(previous, store)
+
+
+class DatasetRegistry:
+    """
+    Maps guilds to school profiles and keeps recently used schools' datasets in memory.
+
+    Datasets are loaded on first use. At most max_loaded are kept, least recently used first out,
+    and any dataset unused for idle_seconds is dropped by evict_idle(). The default school and the
+    schools passed to keep_loaded() are never evicted.
+    """
+
+    def __init__(self, config_path=SCHOOLS_CONFIG, bindings_path=GUILD_BINDINGS_PATH, max_loaded=4, idle_seconds=3600):
+        self.bindings_path = bindings_path
+        self.max_loaded = max_loaded
+        self.idle_seconds = idle_seconds
+        self.profiles, self.default_school_id = self._load_profiles(config_path)
+        self._bindings = self._load_bindings()
+        self._datasets = OrderedDict()
+        self._feed_listeners = []
+        self._kept = frozenset()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_profiles(config_path):
+        try:
+            with open(config_path, 'r', encoding='utf-8') as file:
+                config = json.load(file)
+        except FileNotFoundError:
+            return {DEFAULT_SCHOOL_ID: SchoolProfile.from_config(DEFAULT_SCHOOL_ID, DEFAULT_PROFILE)}, DEFAULT_SCHOOL_ID
+        profiles = {
+            school_id: SchoolProfile.from_config(school_id, school_config)
+            for school_id, school_config in config.get('schools', {}).items()
+        }
+        if not profiles:
+            raise ValueError(f"No schools configured in {os.path.abspath(config_path)}")
+        default_school_id = config.get('default', next(iter(profiles)))
+        if default_school_id not in profiles:
+            raise ValueError(f"Default school {default_school_id} is not configured in {os.path.abspath(config_path)}")
+        logger.info(f"Loaded {len(profiles)} school profile(s) from {os.path.abspath(config_path)}")
+        return profiles, default_school_id
+
+    def _load_bindings(self):
+        try:
+            with open(self.bindings_path, 'r', encoding='utf-8') as file:
+                bindings = {int(guild_id): school_id for guild_id, school_id in json.load(file).items()}
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, AttributeError, ValueError):
+            logger.error(f"Invalid guild bindings at {os.path.abspath(self.bindings_path)}, starting empty")
+            return {}
+        return {guild_id: school_id for guild_id, school_id in bindings.items() if school_id in self.profiles}
+
+    def add_feed_listener(self, callback):
+        """Registers callback(school_id, diff) for feed changes of every dataset, loaded now or later."""
+        self._feed_listeners.append(callback)
+        with self._lock:
+            for school_id, dataset in self._datasets.items():
+                dataset.feed.add_listener(lambda diff, school_id=school_id: callback(school_id, diff))
+
+    def school_for_guild(self, guild_id):
+        """Returns the school ID a guild is bound to, or the default school."""
+        return self._bindings.get(guild_id, self.default_school_id)
+
+    def bind_guild(self, guild_id, school_id):
+        """
+        Binds a guild to a school and persists the binding.
+
+        Raises:
+            KeyError: If the school isn't configured
+        """
+        if school_id not in self.profiles:
+            raise KeyError(school_id)
+        with self._lock:
+            self._bindings[guild_id] = school_id
+            write_json_atomic(self.bindings_path, {str(key): value for key, value in self._bindings.items()})
+        logger.info(f"Guild {guild_id} bound to school {school_id}")
+
+    def keep_loaded(self, school_ids):
+        """Sets the schools (besides the default one) whose datasets must stay loaded, e.g. for alerts."""
+        self._kept = frozenset(school_ids)
+
+    def _evictable(self, school_id):
+        return school_id != self.default_school_id and school_id not in self._kept
+
+    def _use(self, school_id):
+        # Called with self._lock held
+        dataset = self._datasets.get(school_id)
+        if dataset is not None:
+            self._datasets.move_to_end(school_id)
+            dataset.last_used = time.monotonic()
+        return dataset
+
+    def get(self, school_id):
+        """Returns a school's dataset, loading it (and evicting the least recently used) if needed."""
+        with self._lock:
+            dataset = self._use(school_id)
+            if dataset is not None:
+                return dataset
+            loading_lock = self._loading.setdefault(school_id, threading.Lock())
+        # Loading reads the school's saved feed, so it happens outside the registry lock: other
+        # schools stay available meanwhile, and only callers wanting this school wait for it
+        with loading_lock:
+            with self._lock:
+                dataset = self._use(school_id)
+                if dataset is not None:
+                    return dataset
+            dataset = SchoolDataset(self.profiles[school_id], self._feed_listeners)
+            with self._lock:
+                self._datasets[school_id] = dataset
+                self._loading.pop(school_id, None)
+                logger.info(f"Loaded dataset for school {school_id}")
+                for evicted_id in [key for key in self._datasets if self._evictable(key)]:
+                    if len(self._datasets) <= self.max_loaded or evicted_id == school_id:
+                        break
+                    del self._datasets[evicted_id]
+                    logger.info(f"Evicted least recently used dataset for school {evicted_id}")
+                return self._use(school_id)
+
+    def loaded_dataset(self, school_id):
+        """Returns a school's dataset if it is in memory (counting as a use), else None without loading it."""
+        with self._lock:
+            return self._use(school_id)
+
+    def for_guild(self, guild_id):
+        """Returns the dataset of the school a guild is bound to."""
+        return self.get(self.school_for_guild(guild_id))
+
+    def loaded(self):
+        """Returns the currently loaded datasets, most recently used last."""
+        with self._lock:
+            return list(self._datasets.values())
+
+    def evict_idle(self):
+        """
+        Drops datasets that haven't been used for idle_seconds, except the default school and those
+        passed to keep_loaded(). Returns the evicted school IDs.
+        """
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [school_id for school_id, dataset in self._datasets.items()
+                    if dataset.last_used < cutoff and self._evictable(school_id)]
+            for school_id in idle:
+                del self._datasets[school_id]
+        if idle:
+            logger.info(f"Evicted idle dataset(s): {', '.join(idle)}")
+        return idle
+
+
+# Shared registry used by the bot
+datasets = DatasetRegistry(
+    max_loaded=int(os.getenv('MAX_LOADED_SCHOOLS', '4')),
+    idle_seconds=int(os.getenv('SCHOOL_IDLE_SECONDS', '3600')),
+)
@@ -0,0 +1,196 @@
+"""
+Cache of upstream responses shared by every bot process on the machine.
+
+When the bot runs as several shard processes, each would otherwise fetch the event schedule,
+weather and timetable on its own. Entries live in a SQLite database (WAL mode, so readers never
+block), and a per-key lease makes sure only one process fetches a stale entry while the others
+wait for its result. Set SHARED_CACHE=0 to keep the cache inside the process instead.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from metrics import metrics
+from subscriptions import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH', os.path.join(DATA_DIR, 'shared_cache.sqlite3'))
+# A fetch lease lasts the fetch's time budget plus this many seconds, so it can't expire mid-fetch
+LEASE_MARGIN = 5
+
+
+def _cache_name(key):
+    # Metrics are kept per kind of entry ('event_feed', 'weather', 'http'), not per URL
+    return key.split(':', 1)[0]
+
+
+class CacheEntry:
+    """A cached upstream response: raw bytes, when they were fetched, and metadata such as ETag."""
+
+    __slots__ = ('value', 'fetched_at', 'meta')
+
+    def __init__(self, value, fetched_at=None, meta=None):
+        self.value = value
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.meta = meta or {}
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+
+class MemoryCache:
+    """In-process cache with the same interface as SQLiteCache; concurrent fetches of a key are merged."""
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+
+    def get_or_fetch(self, key, max_age, fetch, fetch_budget=10):
+        """
+        Returns the entry for key if it is at most max_age seconds old, otherwise fetch(previous entry or None).
+
+        fetch must return a CacheEntry; exceptions it raises are passed to the caller. Blocking (it
+        may wait for another thread's fetch): call it off the event loop.
+        """
+        entry = self.get(key)
+        if entry is not None and entry.age() <= max_age:
+            metrics.cache(_cache_name(key), True)
+            return entry
+        metrics.cache(_cache_name(key), False)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another thread may have fetched it while we waited for the lock
+            entry = self.get(key)
+            if entry is not None and entry.age() <= max_age:
+                return entry
+            entry = fetch(entry)
+            self.put(key, entry)
+            return entry
+
+
+class SQLiteCache:
+    """Cache stored in a SQLite file so that every process on the machine shares it."""
+
+    def __init__(self, path=SHARED_CACHE_PATH, poll_interval=0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so each thread gets its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, fetched_at REAL, meta TEXT)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires_at REAL)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value, fetched_at, meta FROM entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(bytes(row[0]), row[1], json.loads(row[2]) if row[2] else {})
+
+    def put(self, key, entry):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO entries (key, value, fetched_at, meta) VALUES (?, ?, ?, ?)',
+            (key, sqlite3.Binary(entry.value), entry.fetched_at, json.dumps(entry.meta))
+        )
+
+    def _try_lease(self, key, owner, lease_seconds):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT owner, expires_at FROM leases WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            connection.execute(
+                'INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)',
+                (key, owner, now + lease_seconds)
+            )
+            return True
+        finally:
+            connection.execute('COMMIT')
+
+    def _release(self, key, owner):
+        self._connection().execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, owner))
+
+    def get_or_fetch(self, key, max_age, fetch, fetch_budget=10):
+        """
+        Returns the entry for key if it is at most max_age seconds old, otherwise fetches it.
+
+        Only the process holding the key's lease calls fetch(previous entry or None); the others poll
+        until the new entry appears, or take over the lease if its holder dies. The lease lasts
+        fetch_budget (the longest fetch can take, retries included) plus LEASE_MARGIN seconds.
+        fetch must return a CacheEntry; exceptions it raises are passed to the caller. Blocking (it
+        sleeps while polling): call it off the event loop.
+        """
+        entry = self.get(key)
+        if entry is not None and entry.age() <= max_age:
+            metrics.cache(_cache_name(key), True)
+            return entry
+        metrics.cache(_cache_name(key), False)
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        lease_seconds = fetch_budget + LEASE_MARGIN
+        while True:
+            if self._try_lease(key, owner, lease_seconds):
+                try:
+                    entry = self.get(key)
+                    if entry is not None and entry.age() <= max_age:
+                        return entry
+                    entry = fetch(entry)
+                    self.put(key, entry)
+                    return entry
+                finally:
+                    self._release(key, owner)
+            time.sleep(self.poll_interval)
+            entry = self.get(key)
+            if entry is not None and entry.age() <= max_age:
+                return entry
+
+
+def _create_cache():
+    if os.getenv('SHARED_CACHE', '1') == '0':
+        return MemoryCache()
+    try:
+        return SQLiteCache()
+    except sqlite3.Error as e:
+        logger.error(f"Shared cache unavailable at {os.path.abspath(SHARED_CACHE_PATH)}, using an in-process cache: {e}")
+        return MemoryCache()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the cache used for all upstream fetches, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _create_cache()
+    return _cache
@@ -0,0 +1,72 @@
+"""
+Coalescing of identical concurrent work on the event loop.
+
+When many users click the same button or run the same command at once (e.g. ➡️ on a class's
+timetable at the start of the day), only the first call builds the reply; the others wait for it
+and share the result. compute should await its slow part (e.g. with asyncio.to_thread) so that
+others can join while it runs; a result is also reused for `linger` seconds after it is built.
+Keys include the version of the data used, so a shared result is never older than the data it
+came from.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from metrics import metrics
+
+
+class SingleFlight:
+    """Shares one in-flight (or just finished) computation per key among all callers."""
+
+    def __init__(self, name, linger=2.0, max_recent=128):
+        self.name = name
+        self.linger = linger
+        self.max_recent = max_recent
+        self._calls = {}              # key -> asyncio.Future of the computation in flight
+        self._recent = OrderedDict()  # key -> (expires at, result), most recently finished last
+
+    async def run(self, key, compute):
+        """
+        Returns the result of `await compute()`, shared with every other caller using the same key
+        while it runs and for `linger` seconds after it succeeds. Results must not be modified.
+
+        Exceptions are passed to the callers waiting at the time, and are not reused afterwards.
+        """
+        recent = self._recent.get(key)
+        if recent is not None:
+            if recent[0] > time.monotonic():
+                metrics.cache(self.name, True)
+                return recent[1]
+            del self._recent[key]
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.cache(self.name, True)
+            # shield: one waiter being cancelled mustn't cancel the computation for the others
+            return await asyncio.shield(future)
+        metrics.cache(self.name, False)
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved, so there is no "exception never retrieved" warning without waiters
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            self._remember(key, result)
+        finally:
+            del self._calls[key]
+        return result
+
+    def _remember(self, key, result):
+        # Bounded, so a spread of distinct requests doesn't keep thousands of replies alive
+        self._recent[key] = (time.monotonic() + self.linger, result)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    def __len__(self):
+        return len(self._calls) + len(self._recent)
@@ -0,0 +1,106 @@
+import gzip
+import json
+import os
+import threading
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', os.path.join('data', 'upstream_snapshot.json.gz'))
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def _file_lock():
+    """Holds an exclusive lock on SNAPSHOT_PATH + '.lock', shared by every process writing the snapshot."""
+    directory = os.path.dirname(SNAPSHOT_PATH) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with open(f"{SNAPSHOT_PATH}.lock", 'a+b') as lock_file:
+        if msvcrt is not None:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if msvcrt is not None:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _read():
+    try:
+        with gzip.open(SNAPSHOT_PATH, 'rt', encoding='utf-8') as file:
+            data = json.load(file)
+        if not isinstance(data, dict):
+            raise ValueError("snapshot root is not an object")
+        return data
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring unreadable upstream snapshot at {os.path.abspath(SNAPSHOT_PATH)}: {e}")
+        return {}
+
+
+def _write(data):
+    directory = os.path.dirname(SNAPSHOT_PATH) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    # Compact JSON + gzip keeps a full year's feed to a few KB
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as file:
+            file.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, SNAPSHOT_PATH)
+
+
+def load_section(name):
+    """
+    Returns a saved section of the snapshot (e.g., the event feed or the weather forecast).
+
+    Args:
+        name (str): Section name
+
+    Returns:
+        dict: The saved section, or None if it has never been saved
+    """
+    with _lock:
+        section = _read().get(name)
+    if section is not None:
+        logger.info(f"Loaded '{name}' from upstream snapshot {os.path.abspath(SNAPSHOT_PATH)}")
+    return section
+
+
+def save_section(name, payload):
+    """
+    Stores a section and rewrites the snapshot file atomically.
+
+    Other bot processes save their own sections to the same file, so the file is re-read under a
+    file lock and only this section is replaced.
+
+    Args:
+        name (str): Section name
+        payload (dict): JSON-serialisable data for the section
+    """
+    with _lock:
+        try:
+            with _file_lock():
+                sections = _read()
+                sections[name] = payload
+                _write(sections)
+        except OSError as e:
+            logger.error(f"Failed to write upstream snapshot: {e}")
@@ -0,0 +1,125 @@
+"""
+Startup timing for bot.py.
+
+Inside the bot, mark() records how long each startup phase took and timed_import() records how
+long each lazily imported subsystem took to load; report() formats both.
+
+Run `python startup_profile.py` for an `-X importtime` breakdown of the bot's module-level imports,
+slowest first.
+"""
+import argparse
+import ast
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+_phases = []   # (name, seconds since the previous phase)
+_imports = {}  # module name -> seconds taken to import
+_last_mark = _started
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+
+def mark(phase):
+    """Records the end of a startup phase (e.g. 'imports', 'login', 'ready')."""
+    global _last_mark
+    now = time.perf_counter()
+    with _lock:
+        _phases.append((phase, now - _last_mark))
+        _last_mark = now
+
+
+def timed_import(module_name):
+    """Imports a module, recording how long the first import took."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    with _lock:
+        _imports.setdefault(module_name, time.perf_counter() - start)
+    return module
+
+
+def elapsed():
+    """Seconds since this module was first imported (i.e. since the bot started)."""
+    return time.perf_counter() - _started
+
+
+def report():
+    """Returns a multi-line summary of startup phases and lazy imports."""
+    with _lock:
+        lines = [f"Startup report ({elapsed():.2f}s since start):"]
+        lines += [f"  {name:<24} {seconds * 1000:8.1f} ms" for name, seconds in _phases]
+        if _imports:
+            lines.append("  Lazy imports:")
+            lines += [
+                f"    {name:<22} {seconds * 1000:8.1f} ms"
+                for name, seconds in sorted(_imports.items(), key=lambda item: item[1], reverse=True)
+            ]
+    return "\n".join(lines)
+
+
+def bot_imports(path=BOT_PATH):
+    """
+    Returns the modules bot.py imports at load time (its module-level import statements), in order.
+
+    Read from the source rather than listed here, so the report can't drift from what bot.py imports.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        tree = ast.parse(file.read(), filename=path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        modules += [name for name in names if name not in modules]
+    return modules
+
+
+def importtime_report(modules, top=25):
+    """
+    Runs a fresh interpreter with -X importtime and returns the slowest imports.
+
+    Args:
+        modules (list): Module names to import
+        top (int): Number of entries to return
+
+    Returns:
+        list: (cumulative microseconds, self microseconds, module name), slowest first
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', '; '.join(f"import {name}" for name in modules)],
+        capture_output=True, text=True, cwd=os.path.dirname(BOT_PATH)
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        entries.append((int(cumulative_us), int(self_us), name.strip()))
+    if result.returncode != 0 and not entries:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show which imports slow down the bot's startup")
+    parser.add_argument('modules', nargs='*', help="Modules to import (defaults to bot.py's)")
+    parser.add_argument('--top', type=int, default=25, help="Number of imports to show")
+    args = parser.parse_args()
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, name in importtime_report(args.modules or bot_imports(), args.top):
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
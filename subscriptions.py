@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+
+
+def write_json_atomic(path, data):
+    """
+    Writes JSON to a file atomically, so readers never see a half-written file.
+
+    Args:
+        path (str): Destination file path
+        data: JSON-serialisable data
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # Per-process temporary name: shard processes may write the same file at once
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class ChannelSubscriptions:
+    """A persisted set of channel IDs subscribed to a kind of notification."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._channels = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return set(int(channel_id) for channel_id in json.load(file))
+        except FileNotFoundError:
+            return set()
+        except (json.JSONDecodeError, TypeError, ValueError):
+            logger.error(f"Invalid subscriptions file at {os.path.abspath(self.path)}, starting empty")
+            return set()
+
+    def _save(self):
+        write_json_atomic(self.path, sorted(self._channels))
+
+    def add(self, channel_id):
+        """Subscribes a channel. Returns False if it was already subscribed."""
+        with self._lock:
+            if channel_id in self._channels:
+                return False
+            self._channels.add(channel_id)
+            self._save()
+            return True
+
+    def remove(self, channel_id):
+        """Unsubscribes a channel. Returns False if it was not subscribed."""
+        with self._lock:
+            if channel_id not in self._channels:
+                return False
+            self._channels.discard(channel_id)
+            self._save()
+            return True
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channels
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._channels))
+
+    def __len__(self):
+        return len(self._channels)
+
+
+# Channels that receive a notice when the event schedule changes
+activity_alert_channels = ChannelSubscriptions(os.path.join(DATA_DIR, 'activity_alerts.json'))
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Keep test runs away from the bot's shared cache, snapshots and logs
+_scratch_dir = tempfile.mkdtemp(prefix='event-schedule-test-')
+os.environ.setdefault('SHARED_CACHE', '0')
+os.environ.setdefault('SNAPSHOT_PATH', os.path.join(_scratch_dir, 'upstream_snapshot.json.gz'))
+os.environ.setdefault('LOG_DIR', os.path.join(_scratch_dir, 'log'))
@@ -0,0 +1,145 @@
+from datetime import date
+
+from event_feed import ActivityIndex, DayIndex, EventFeed, diff_rows, row_hash
+
+
+def make_row(am=None, pm=None, remark=''):
+    slots = {}
+    if am is not None:
+        slots['AM'] = am
+    if pm is not None:
+        slots['PM'] = pm
+    return {'slots': slots, 'remark': remark}
+
+
+ROWS = {
+    '2/9/2024': make_row(am={'S1': ['Orientation'], 'otherActivities': ['Assembly']}),
+    '3/9/2024': make_row(am={'S3': ['Maths test']}, pm={'S3': ['Debate practice']}, remark='Uniform check'),
+}
+
+
+def test_diff_rows_first_load_adds_every_date():
+    diff, hashes = diff_rows({}, {}, ROWS)
+    assert sorted(diff.added) == sorted(ROWS)
+    assert diff.changed == [] and diff.removed == []
+    assert hashes == {key: row_hash(row) for key, row in ROWS.items()}
+    assert diff.entries['2/9/2024'] == ([('AM', 'S1: Orientation'), ('AM', 'Assembly')], [])
+
+
+def test_diff_rows_reports_added_removed_and_changed_dates():
+    _, hashes = diff_rows({}, {}, ROWS)
+    new_rows = {
+        '3/9/2024': make_row(am={'S3': ['Maths test']}, pm={'S3': ['Music lesson']}, remark='Uniform check'),
+        '4/9/2024': make_row(am={'S2': ['Sports day']}),
+    }
+    diff, _ = diff_rows(ROWS, hashes, new_rows)
+    assert diff.added == ['4/9/2024']
+    assert diff.removed == ['2/9/2024']
+    assert diff.changed == ['3/9/2024']
+    assert diff.entries['3/9/2024'] == ([('PM', 'S3: Music lesson')], [('PM', 'S3: Debate practice')])
+    assert diff.entries['2/9/2024'] == ([], [('AM', 'S1: Orientation'), ('AM', 'Assembly')])
+    assert diff.dates() == ['2/9/2024', '3/9/2024', '4/9/2024']
+    assert len(diff) == 3
+
+
+def test_diff_rows_ignores_key_order_within_a_row():
+    _, hashes = diff_rows({}, {}, ROWS)
+    reordered = {
+        '3/9/2024': {'remark': 'Uniform check', 'slots': {'PM': {'S3': ['Debate practice']}, 'AM': {'S3': ['Maths test']}}},
+        '2/9/2024': ROWS['2/9/2024'],
+    }
+    diff, _ = diff_rows(ROWS, hashes, reordered)
+    assert not diff
+
+
+def test_diff_rows_reordered_activities_change_the_date_without_entry_changes():
+    rows = {'5/9/2024': make_row(am={'S1': ['Art', 'Drama']})}
+    _, hashes = diff_rows({}, {}, rows)
+    diff, _ = diff_rows(rows, hashes, {'5/9/2024': make_row(am={'S1': ['Drama', 'Art']})})
+    assert diff.changed == ['5/9/2024']
+    assert diff.entries['5/9/2024'] == ([], [])
+
+
+def test_activity_index_reindexes_and_removes_rows():
+    index = ActivityIndex()
+    index.index_row('3/9/2024', ROWS['3/9/2024'])
+    assert [match['activity'] for match in index.search('debate')] == ['S3: Debate practice']
+
+    index.index_row('3/9/2024', make_row(pm={'S3': ['Music lesson']}))
+    assert index.search('debate') == []
+    assert index.search('music') == [{'date': '03/09/2024', 'slot': 'PM', 'activity': 'S3: Music lesson'}]
+
+    index.remove_row('3/9/2024')
+    assert index.search('music') == []
+    assert len(index) == 0
+    assert index._postings == {}
+
+
+def test_activity_index_matches_every_query_token():
+    index = ActivityIndex()
+    for key, row in ROWS.items():
+        index.index_row(key, row)
+    assert [match['activity'] for match in index.search('maths test')] == ['S3: Maths test']
+    assert index.search('maths debate') == []
+
+
+def test_day_index_filters_by_grade_and_falls_back_to_closest_date():
+    index = DayIndex()
+    for key, row in ROWS.items():
+        index.index_row(key, row)
+
+    date_key, slots, remark = index.find(date(2024, 9, 3))
+    assert date_key == '3/9/2024' and remark == 'Uniform check'
+    assert [slot.name for slot in slots] == ['AM', 'PM']
+
+    _, s1_slots, _ = index.find(date(2024, 9, 3), grade='S1')
+    assert s1_slots == ()
+
+    # After the last date, the last date; between two equally close dates, the earlier one
+    assert index.find(date(2024, 9, 10))[0] == '3/9/2024'
+    index.index_row('5/9/2024', make_row(am={'S1': ['Art']}))
+    assert index.find(date(2024, 9, 4))[0] == '3/9/2024'
+
+
+def test_day_index_tracks_slot_names_through_updates():
+    index = DayIndex()
+    for key, row in ROWS.items():
+        index.index_row(key, row)
+    assert index.slot_names() == ['AM', 'PM']
+
+    index.index_row('3/9/2024', make_row(am={'S3': ['Maths test']}))
+    assert index.slot_names() == ['AM']
+    index.remove_row('2/9/2024')
+    index.remove_row('3/9/2024')
+    assert index.slot_names() == []
+    assert index.find(date(2024, 9, 3)) is None
+    assert len(index) == 0
+
+
+def test_event_feed_update_reindexes_only_changed_dates_and_notifies_listeners():
+    feed = EventFeed('http://feed.invalid/event-schedule')
+    diffs = []
+    feed.add_listener(diffs.append)
+
+    first = feed.update(dict(ROWS))
+    assert sorted(first.added) == sorted(ROWS)
+    assert diffs == []  # the first load isn't a change
+
+    indexed = []
+    index_row = feed.days.index_row
+    feed.days.index_row = lambda key, row: (indexed.append(key), index_row(key, row))
+    new_rows = dict(ROWS)
+    new_rows['3/9/2024'] = make_row(am={'S3': ['Maths test']}, remark='Uniform check')
+    del new_rows['2/9/2024']
+    diff = feed.update(new_rows)
+
+    assert indexed == ['3/9/2024']
+    assert diff.changed == ['3/9/2024'] and diff.removed == ['2/9/2024']
+    assert diffs == [diff]
+    assert feed.index.search('debate') == []
+    assert feed.index.search('orientation') == []
+    assert feed.days.find(date(2024, 9, 2))[0] == '3/9/2024'
+    assert feed.days.slot_names() == ['AM']
+
+    assert not feed.update(dict(new_rows))
+    assert len(diffs) == 1
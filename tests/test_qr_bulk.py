@@ -0,0 +1,128 @@
+import csv
+import io
+import zipfile
+
+import pytest
+
+import qr_bulk
+from qr_bulk import BulkQRError, build_qr_zip, parse_url_list
+from qr_code import cached_qr_code, QR_TARGET_SIZE
+
+
+@pytest.fixture(scope='module', autouse=True)
+def worker_pool():
+    yield
+    if qr_bulk._pool is not None:
+        qr_bulk._pool.shutdown(wait=True)
+        qr_bulk._pool = None
+
+
+def parse(text):
+    return parse_url_list(text.encode('utf-8'))
+
+
+def test_parse_keeps_commas_inside_urls():
+    entries, skipped = parse(
+        "https://example.com/search?q=a,b&tags=x,y\n"
+        "Maths room,https://example.com/rooms?ids=1,2,3\n"
+        "https://example.com/a,b, Library\n"
+    )
+    assert entries == [
+        ('https://example.com/search?q=a,b&tags=x,y', None),
+        ('https://example.com/rooms?ids=1,2,3', 'Maths room'),
+        ('https://example.com/a,b', 'Library'),
+    ]
+    assert skipped == []
+
+
+def test_parse_label_forms_and_quoted_csv():
+    entries, _ = parse(
+        "https://example.com/hall, Main hall\n"
+        "https://example.com/gym\tGym\n"
+        "Office;https://example.com/office\n"
+        '"Room 1, Block A",https://example.com/r1\n'
+        '"https://example.com/x?a=1,2",Quoted\n'
+    )
+    assert entries == [
+        ('https://example.com/hall', 'Main hall'),
+        ('https://example.com/gym', 'Gym'),
+        ('https://example.com/office', 'Office'),
+        ('https://example.com/r1', 'Room 1, Block A'),
+        ('https://example.com/x?a=1,2', 'Quoted'),
+    ]
+
+
+def test_parse_skips_blank_lines_comments_and_a_header_row():
+    entries, skipped = parse("label,url\n\n# staff rooms\n   \nStaff,https://example.com/staff\n")
+    assert entries == [('https://example.com/staff', 'Staff')]
+    assert skipped == []
+
+
+def test_parse_reports_bad_lines_by_number():
+    entries, skipped = parse("https://example.com/ok\nnot a url\nftp://example.com/file\n\nlabel only,\n")
+    assert entries == [('https://example.com/ok', None)]
+    assert skipped == [
+        "line 2: no http:// or https:// URL",
+        "line 3: no http:// or https:// URL",
+        "line 5: no http:// or https:// URL",
+    ]
+
+
+def test_parse_rejects_files_without_urls_or_with_too_many():
+    with pytest.raises(BulkQRError, match="No URLs found"):
+        parse("label,url\n# nothing here\n")
+    with pytest.raises(BulkQRError, match="UTF-8"):
+        parse_url_list(b'\xff\xfe\x00bad')
+    with pytest.raises(BulkQRError, match="Too many URLs"):
+        parse(''.join(f"https://example.com/{i}\n" for i in range(qr_bulk.MAX_URLS + 1)))
+
+
+def test_build_qr_zip_renders_a_small_batch():
+    entries = [
+        ('https://example.com/bulk-png/1', 'Room 1'),
+        ('https://example.com/bulk-png/2', None),
+        ('https://example.com/bulk-png/1', 'Room 1'),
+    ]
+    data = build_qr_zip(entries, 'solid', color='#123456', fmt='png')
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        infos = {info.filename: info for info in archive.infolist()}
+        assert list(infos) == ['001_Room 1.png', '002_example.com_bulk-png_2.png', '003_Room 1.png', 'manifest.csv']
+        for name in list(infos)[:3]:
+            assert infos[name].compress_type == zipfile.ZIP_STORED
+            assert archive.read(name).startswith(b'\x89PNG')
+        manifest = list(csv.reader(io.StringIO(archive.read('manifest.csv').decode())))
+    assert manifest == [
+        ['file', 'label', 'url'],
+        ['001_Room 1.png', 'Room 1', 'https://example.com/bulk-png/1'],
+        ['002_example.com_bulk-png_2.png', '', 'https://example.com/bulk-png/2'],
+        ['003_Room 1.png', 'Room 1', 'https://example.com/bulk-png/1'],
+    ]
+    # Rendered codes are cached in the parent for the next request
+    assert cached_qr_code('https://example.com/bulk-png/2', 'solid', '#123456', QR_TARGET_SIZE, 'png')
+
+
+def test_build_qr_zip_deflates_svg_and_serves_cached_codes_without_the_pool(monkeypatch):
+    entries = [('https://example.com/bulk-svg', 'Poster')]
+    first = build_qr_zip(entries, 'solid', fmt='svg')
+
+    def no_pool():
+        raise AssertionError("cached codes shouldn't be rendered again")
+
+    monkeypatch.setattr(qr_bulk, '_worker_pool', no_pool)
+    assert build_qr_zip(entries, 'solid', fmt='svg') == first
+    with zipfile.ZipFile(io.BytesIO(first)) as archive:
+        info = archive.getinfo('001_Poster.svg')
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert b'<svg' in archive.read(info)
+
+
+def test_build_qr_zip_gives_up_after_the_render_timeout(monkeypatch):
+    monkeypatch.setattr(qr_bulk, 'QR_RENDER_TIMEOUT', 0)
+    with pytest.raises(BulkQRError, match="took too long"):
+        build_qr_zip([('https://example.com/bulk-timeout', None)], 'solid')
+
+
+def test_build_qr_zip_rejects_unknown_colors():
+    with pytest.raises(BulkQRError, match="Unknown color"):
+        build_qr_zip([('https://example.com/bulk-color', None)], 'solid', color='not-a-color')
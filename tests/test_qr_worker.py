@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+
+
+def loaded_modules(names):
+    """Runs in a QR worker: which of names that process has imported."""
+    return [name for name in names if name in sys.modules]
+
+
+@pytest.mark.parametrize('entry_script', ['main.py', 'bot.py'])
+def test_qr_worker_does_not_import_the_bot(tmp_path, entry_script):
+    # Start the "bot" the way it is deployed, with a stand-in bot module whose main() uses the QR
+    # pool, so the worker is spawned while the real entry script is __main__. With one worker, the
+    # process that rendered a code is the one reporting its modules
+    driver = tmp_path / 'driver.py'
+    driver.write_text(textwrap.dedent(f"""
+        import runpy, sys, types
+        sys.path[:0] = [{ROOT!r}, {TESTS!r}]
+
+        def main():
+            import qr_bulk, test_qr_worker
+            pool = qr_bulk._worker_pool()
+            assert pool.submit(qr_bulk._render, 'https://example.com', 'solid', None, 320, 'png').result(timeout=60)
+            print(','.join(pool.submit(test_qr_worker.loaded_modules, ['discord', 'bot', 'qr_code']).result(timeout=60)))
+
+        sys.modules['bot'] = types.SimpleNamespace(main=main)
+        runpy.run_path({os.path.join(ROOT, entry_script)!r}, run_name='__main__')
+    """))
+    result = subprocess.run([sys.executable, str(driver)], capture_output=True, text=True, timeout=120, cwd=ROOT,
+                            env=dict(os.environ, QR_WORKERS='1'))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'qr_code'
@@ -0,0 +1,252 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, hedged, retry
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleep_calls.append(seconds)
+        self.now += seconds
+
+    sleep_calls = None
+
+
+class MaxJitter:
+    """Stands in for random: always the largest backoff."""
+
+    @staticmethod
+    def uniform(low, high):
+        return high
+
+
+class UpstreamDown(Exception):
+    pass
+
+
+def failing():
+    raise UpstreamDown("down")
+
+
+def make_clock():
+    clock = FakeClock()
+    clock.sleep_calls = []
+    return clock
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    clock = make_clock()
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30, clock=clock)
+    for _ in range(2):
+        with pytest.raises(UpstreamDown):
+            breaker.call(failing)
+        assert breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(UpstreamDown):
+        breaker.call(failing)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: calls.append(1))
+    assert calls == []
+    clock.now += 10
+    assert breaker.retry_in() == 20
+
+
+def test_breaker_success_resets_the_failure_count():
+    breaker = CircuitBreaker('test', failure_threshold=2, clock=make_clock())
+    with pytest.raises(UpstreamDown):
+        breaker.call(failing)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    with pytest.raises(UpstreamDown):
+        breaker.call(failing)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_success_closes_the_breaker():
+    clock = make_clock()
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30, clock=clock)
+    with pytest.raises(UpstreamDown):
+        breaker.call(failing)
+    clock.now += 30
+    assert breaker.retry_in() == 0
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_half_open_trial_failure_reopens_the_breaker():
+    clock = make_clock()
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30, clock=clock)
+    for _ in range(3):
+        with pytest.raises(UpstreamDown):
+            breaker.call(failing)
+    clock.now += 30
+    with pytest.raises(UpstreamDown):
+        breaker.call(failing)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_at == clock.now
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+
+
+def test_half_open_lets_only_one_trial_through():
+    clock = make_clock()
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30, clock=clock)
+    with pytest.raises(UpstreamDown):
+        breaker.call(failing)
+    clock.now += 30
+
+    def trial():
+        # A second caller arriving while the trial runs is rejected
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: 'second')
+        return 'trial'
+
+    assert breaker.call(trial) == 'trial'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_ignores_exceptions_outside_failure_types():
+    breaker = CircuitBreaker('test', failure_threshold=1, clock=make_clock())
+    with pytest.raises(KeyError):
+        breaker.call(lambda: {}['missing'], failure_types=(UpstreamDown,))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_backs_off_exponentially_until_success():
+    clock = make_clock()
+    results = iter([UpstreamDown(), UpstreamDown(), 'ok'])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert retry(flaky, attempts=3, base_delay=0.2, max_delay=2.0, clock=clock, sleep=clock.sleep, rng=MaxJitter) == 'ok'
+    assert clock.sleep_calls == [0.2, 0.4]
+
+
+def test_retry_gives_up_after_attempts_and_caps_delay():
+    clock = make_clock()
+    calls = []
+
+    def down():
+        calls.append(clock.now)
+        raise UpstreamDown("down")
+
+    with pytest.raises(UpstreamDown):
+        retry(down, attempts=4, base_delay=1.0, max_delay=1.5, clock=clock, sleep=clock.sleep, rng=MaxJitter)
+    assert len(calls) == 4
+    assert clock.sleep_calls == [1.0, 1.5, 1.5]
+
+
+def test_retry_does_not_sleep_past_the_deadline():
+    clock = make_clock()
+    calls = []
+
+    def down():
+        calls.append(clock.now)
+        raise UpstreamDown("down")
+
+    with pytest.raises(UpstreamDown):
+        retry(down, attempts=5, base_delay=1.0, max_delay=10.0, deadline=clock.now + 2.5,
+              clock=clock, sleep=clock.sleep, rng=MaxJitter)
+    # Sleeps 1s, then 2s would end at the deadline, so the second failure is raised instead
+    assert clock.sleep_calls == [1.0]
+    assert len(calls) == 2
+
+
+def test_retry_stops_on_non_retryable_errors():
+    clock = make_clock()
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        retry(bad_request, should_retry=lambda e: not isinstance(e, ValueError), clock=clock, sleep=clock.sleep)
+    assert calls == [1]
+    assert clock.sleep_calls == []
+
+
+def test_hedged_returns_a_fast_first_call_without_hedging():
+    calls = []
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        assert hedged(lambda: calls.append(1) or 'fast', hedge_after=5, pool=pool) == 'fast'
+    assert calls == [1]
+
+
+def test_hedged_returns_the_second_copy_when_the_first_is_slow():
+    release = threading.Event()
+    calls = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            calls.append(1)
+            number = len(calls)
+        if number == 1:
+            release.wait(5)
+            return 'slow'
+        return 'hedge'
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        try:
+            assert hedged(call, hedge_after=0.01, pool=pool) == 'hedge'
+        finally:
+            release.set()
+    assert len(calls) == 2
+
+
+class StubPool:
+    """Executor whose futures only finish when the test says so; nothing runs on its own."""
+
+    def __init__(self, on_submit=None):
+        self.futures = []
+        self.on_submit = on_submit
+
+    def submit(self, func):
+        future = Future()
+        self.futures.append(future)
+        if self.on_submit:
+            self.on_submit(self.futures)
+        return future
+
+
+def test_hedged_cancels_a_copy_that_has_not_started():
+    def first_finishes_once_hedged(futures):
+        if len(futures) == 2:
+            futures[0].set_result('first')
+
+    pool = StubPool(on_submit=first_finishes_once_hedged)
+    assert hedged(lambda: None, hedge_after=0, pool=pool) == 'first'
+    first, hedge = pool.futures
+    assert hedge.cancelled()
+
+
+def test_hedged_leaves_a_running_copy_to_finish():
+    def first_finishes_once_hedged(futures):
+        if len(futures) == 2:
+            futures[1].set_running_or_notify_cancel()
+            futures[0].set_result('first')
+
+    pool = StubPool(on_submit=first_finishes_once_hedged)
+    assert hedged(lambda: None, hedge_after=0, pool=pool) == 'first'
+    assert not pool.futures[1].cancelled()
+
+
+def test_hedged_raises_when_both_copies_fail():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        with pytest.raises(UpstreamDown):
+            hedged(failing, hedge_after=0, pool=pool)
@@ -1,264 +1,197 @@
-import json
 from datetime import datetime, timedelta
 import os
 import logging
-import requests
-from requests.exceptions import RequestException
+import threading
+from collections import OrderedDict
+from event_feed import activity_feed, FeedError, display_date
+from timetable_store import get_timetable_store
+from schedule import Result, Lesson, DayTimetable, DayActivities, PERIODS, GRADES
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def get_cycle_day(date_str):
+# Lesson tuples kept per (timetable version, class, cycle day)
+LESSON_CACHE_SIZE = 4096
+_lessons = OrderedDict()
+_lessons_lock = threading.Lock()
+
+def _load_timetable_store(store_loader=None):
+    """
+    Returns timetable data (compiled timetable.bin or the JSON files).
+    
+    Args:
+        store_loader (callable): Returns the store to use (defaults to the shared store)
+    
+    Returns:
+        tuple: (store, None) on success or (None, error message)
+    """
+    try:
+        return (store_loader or get_timetable_store)(), None
+    except FileNotFoundError as e:
+        file_name = os.path.basename(e.filename or '')
+        error_msg = f"Error: {file_name} file not found at {os.path.abspath(e.filename or '')}. Please ensure the 'test_data' folder contains '{file_name}'."
+        logger.error(error_msg)
+        return None, error_msg
+    except ValueError as e:
+        error_msg = f"Error: Invalid timetable data: {str(e)}"
+        logger.error(error_msg)
+        return None, error_msg
+
+def get_cycle_day(date_str, store=None):
     """
     Retrieves the cycle day for a given date from cycleal.json.
     
     Args:
         date_str (str): Date in DD/MM/YYYY format (e.g., '03/09/2024')
+        store: Timetable data to use (defaults to the shared store)
         
     Returns:
-        str: Cycle day (e.g., 'A', 'B', or '/' for no school day)
+        Result: Cycle day (e.g., 'A', 'B', or '/' for no school day) or error message
     """
     try:
         # Normalize and validate date format
         date_obj = datetime.strptime(date_str, '%d/%m/%Y')
         normalized_date = date_obj.strftime('%d/%m/%Y')
-        
-        # Use relative path for test_data
-        file_path = os.path.join('test_data', 'cycleal.json')
-        resolved_path = os.path.abspath(file_path)
-        logger.info(f"Attempting to load cycleal.json: {resolved_path}")
-        
-        with open(file_path, 'r', encoding='utf-8') as file:
-            cycle_data = json.load(file)
+    except ValueError:
+        return Result.failure("Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)")
+    
+    try:
+        if store is None:
+            store, error_msg = _load_timetable_store()
+            if error_msg:
+                return Result.failure(error_msg)
         
         # Check if date exists in cycleal.json
-        if normalized_date not in cycle_data:
-            return f"Error: Date {normalized_date} not found in cycleal.json"
+        cycle_day = store.cycle_day(normalized_date)
+        if cycle_day is None:
+            return Result.failure(f"Error: Date {normalized_date} not found in cycleal.json")
         
-        return cycle_data[normalized_date]
-    except FileNotFoundError:
-        error_msg = f"Error: cycleal.json file not found at {resolved_path}. Please ensure the 'test_data' folder contains 'cycleal.json'."
-        logger.error(error_msg)
-        return error_msg
-    except ValueError:
-        return "Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)"
+        return Result(cycle_day)
     except Exception as e:
-        return f"Error: {str(e)}"
+        return Result.failure(f"Error: {str(e)}")
 
-def get_timetable(class_name, date_str):
+def _day_lessons(store, class_name, cycle_day):
+    """
+    Returns a class's lessons on a cycle day as a tuple of Lesson (standardized to Lesson 1–6), or None.
+    The tuple is shared by every date with that cycle day until the timetable changes.
+    """
+    key = (store.version, class_name, cycle_day)
+    with _lessons_lock:
+        lessons = _lessons.get(key)
+        if lessons is not None:
+            _lessons.move_to_end(key)
+            return lessons
+    timetable = store.lessons(class_name, cycle_day)
+    if timetable is None:
+        return None
+    lessons = tuple(
+        Lesson(min(index, PERIODS), subject, venue)
+        for index, (subject, venue) in enumerate(timetable, start=1)
+    )
+    with _lessons_lock:
+        _lessons[key] = lessons
+        while len(_lessons) > LESSON_CACHE_SIZE:
+            _lessons.popitem(last=False)
+    return lessons
+
+def get_timetable(class_name, date_str, store_loader=None):
     """
     Retrieves the timetable for a given class and date, standardizing periods as Lesson 1–6.
     
     Args:
         class_name (str): Class name (e.g., '1A', '2B', '3C')
         date_str (str): Date in DD/MM/YYYY format (e.g., '03/09/2024')
+        store_loader (callable): Returns the timetable data to use, e.g. a school's (defaults to the shared store)
         
     Returns:
-        list: List of timetable entries (strings like 'Lesson X: Subject') or error message
+        Result: DayTimetable (with no lessons on non-school days) or error message
     """
     try:
         # Normalize and validate date format
         date_obj = datetime.strptime(date_str, '%d/%m/%Y')
         normalized_date = date_obj.strftime('%d/%m/%Y')
+    except ValueError:
+        return Result.failure("Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)")
+    
+    try:
+        # Use one store for the whole lookup so a sync can't swap data in between
+        store, error_msg = _load_timetable_store(store_loader)
+        if error_msg:
+            return Result.failure(error_msg)
         
         # Get cycle day
-        cycle_day = get_cycle_day(normalized_date)
-        
-        # Handle non-school days or errors
-        if cycle_day == '/':
-            return f"No school on {normalized_date}"
-        elif cycle_day.startswith("Error"):
+        cycle_day = get_cycle_day(normalized_date, store)
+        if not cycle_day.ok:
             return cycle_day
         
-        # Load timetable data
-        file_path = os.path.join('test_data', 'timetale.json')
-        resolved_path = os.path.abspath(file_path)
-        logger.info(f"Attempting to load timetale.json: {resolved_path}")
-        
-        with open(file_path, 'r', encoding='utf-8') as file:
-            timetable_data = json.load(file)
+        # Handle non-school days
+        if cycle_day.value == '/':
+            return Result(DayTimetable(class_name, normalized_date, '/'))
         
         # Validate class name
-        if class_name not in timetable_data:
-            return f"Error: Class {class_name} not found in timetale.json"
+        if not store.has_class(class_name):
+            return Result.failure(f"Error: Class {class_name} not found in timetale.json")
         
         # Validate cycle day for the class
-        if cycle_day not in timetable_data[class_name]:
-            return f"Error: Cycle day {cycle_day} not found for class {class_name}"
+        lessons = _day_lessons(store, class_name, cycle_day.value)
+        if lessons is None:
+            return Result.failure(f"Error: Cycle day {cycle_day.value} not found for class {class_name}")
         
-        # Get timetable entries
-        timetable = timetable_data[class_name][cycle_day]
-        
-        # Standardize to Lesson 1–6
-        formatted_timetable = []
-        for index, item in enumerate(timetable, start=1):
-            lesson_num = min(index, 6)
-            if isinstance(item, dict):
-                try:
-                    subject = item.get('subject', 'Unknown')
-                    formatted_timetable.append(f"Lesson {lesson_num}: {subject}")
-                except (KeyError, TypeError):
-                    return f"Error: Invalid timetable entry format for class {class_name} on cycle day {cycle_day}"
-            elif isinstance(item, str):
-                formatted_timetable.append(f"Lesson {lesson_num}: {item}")
-            else:
-                return f"Error: Invalid timetable entry type for class {class_name} on cycle day {cycle_day}"
-        
-        # Pad with empty lessons if fewer than 6
-        while len(formatted_timetable) < 6:
-            formatted_timetable.append(f"Lesson {len(formatted_timetable) + 1}: None")
-        
-        return formatted_timetable
-    except FileNotFoundError:
-        error_msg = f"Error: timetale.json file not found at {resolved_path}. Please ensure the 'test_data' folder contains 'timetale.json'."
-        logger.error(error_msg)
-        return error_msg
-    except ValueError:
-        return "Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)"
+        return Result(DayTimetable(class_name, normalized_date, cycle_day.value, lessons))
     except Exception as e:
-        return f"Error: {str(e)}"
+        return Result.failure(f"Error: {str(e)}")
 
-def get_activities(date_str):
+def get_activities(date_str, feed=None, grade=None, slot=None):
     """
     Retrieves all activities and remark for a given date from the server.
     If the date is not found, returns activities and remark for the closest available date.
+    If the server is unavailable, the last saved copy of the schedule is used and the result
+    includes a 'stale' notice.
     
     Args:
         date_str (str): Date in DD/MM/YYYY format (e.g., '03/09/2024')
+        feed (EventFeed): Event-schedule feed to use (defaults to the shared feed)
+        grade (str): Only include this grade's activities and whole-school ones (e.g., 'S3')
+        slot (str): Only include this slot (e.g., 'AM', 'PM')
         
     Returns:
-        dict: Dictionary with slot names as keys and lists of activities as values, remark, or error message
+        Result: DayActivities or error message
     """
     try:
         # Normalize and validate date format
         date_obj = datetime.strptime(date_str, '%d/%m/%Y')
-        # Remove leading zeros for JSON search (e.g., '03/09/2024' -> '3/9/2024')
-        search_date = f"{int(date_obj.day)}/{int(date_obj.month)}/{date_obj.year}"
         normalized_date = date_obj.strftime('%d/%m/%Y')
+        if grade is not None and grade not in GRADES:
+            return Result.failure(f"Error: Unknown grade {grade}. Use one of {', '.join(GRADES)}.")
         
-        # Fetch data from URL
-        url = "https://iot.spyc.hk/event-schedule"
-        logger.info(f"Attempting to fetch activities from: {url}")
-        response = requests.get(url, timeout=5)
-        
-        # Check HTTP status
-        if response.status_code != 200:
-            error_msg = f"Error: Failed to fetch activities. HTTP {response.status_code}"
-            logger.error(error_msg)
-            return error_msg
-        
-        # Parse JSON
+        # Fetch data from the server (or the recent/saved copy); this also refreshes the indexes
+        if feed is None:
+            feed = activity_feed
         try:
-            event_data = response.json()
-        except ValueError:
-            error_msg = "Error: Invalid JSON data received from server"
+            event_data, stale = feed.get()
+        except FeedError as e:
+            error_msg = str(e)
             logger.error(error_msg)
-            return error_msg
+            return Result.failure(error_msg)
         
         logger.info(f"Successfully fetched activities data for date: {normalized_date}")
-        
-        # Get all available dates
-        available_dates = list(event_data['rows'].keys())
-        if not available_dates:
-            return "Error: No dates found in server data"
-        
-        # Check if the requested date exists
-        if search_date in event_data['rows']:
-            date_data = event_data['rows'][search_date]['slots']
-            remark = event_data['rows'][search_date].get('remark', '')
-            activities = get_activities_for_date(date_data, normalized_date)
-            return {'activities': activities, 'remark': remark}
-        else:
-            # Find the closest date
-            target_date = date_obj
-            closest_date = None
-            min_diff = None
-            
-            for date_key in available_dates:
-                try:
-                    # Parse date_key, assuming it might be in D/M/YYYY or DD/MM/YYYY
-                    try:
-                        available_date = datetime.strptime(date_key, '%d/%m/%Y')
-                    except ValueError:
-                        # Try parsing with leading zeros
-                        parts = date_key.split('/')
-                        day, month, year = int(parts[0]), int(parts[1]), int(parts[2])
-                        available_date = datetime.strptime(f"{day:02d}/{month:02d}/{year}", '%d/%m/%Y')
-                    
-                    diff = abs((target_date - available_date).days)
-                    if min_diff is None or diff < min_diff:
-                        min_diff = diff
-                        closest_date = date_key
-                except ValueError:
-                    continue
-            
-            if closest_date is None:
-                return "Error: No valid dates found in server data"
-            
-            date_data = event_data['rows'][closest_date]['slots']
-            remark = event_data['rows'][closest_date].get('remark', '')
-            # Convert closest_date to DD/MM/YYYY for display
-            closest_date_obj = datetime.strptime(closest_date, '%d/%m/%Y')
-            closest_date_normalized = closest_date_obj.strftime('%d/%m/%Y')
-            activities = get_activities_for_date(date_data, closest_date_normalized)
-            return {
-                'message': f"No activities found for {normalized_date}. Showing activities for closest date: {closest_date_normalized}",
-                'activities': activities,
-                'remark': remark
-            }
+        stale_since = feed.fetched_at_display() if stale else None
+        
+        if not event_data['rows']:
+            return Result.failure("Error: No dates found in server data")
+        
+        # The requested date, or the closest date in the feed
+        found = feed.days.find(date_obj.date(), grade)
+        if found is None:
+            return Result.failure("Error: No valid dates found in server data")
+        date_key, slots, remark = found
+        if slot:
+            slots = [entry for entry in slots if entry.name == slot]
+        return Result(DayActivities(display_date(date_key), slots, remark, requested_date=normalized_date,
+                                    stale_since=stale_since, grade=grade, slot=slot))
     
-    except requests.Timeout:
-        error_msg = "Error: Request to server timed out. Please try again later."
-        logger.error(error_msg)
-        return error_msg
-    except requests.ConnectionError:
-        error_msg = "Error: Failed to connect to server. Check your internet connection."
-        logger.error(error_msg)
-        return error_msg
-    except RequestException as e:
-        error_msg = f"Error: Failed to fetch activities: {str(e)}"
-        logger.error(error_msg)
-        return error_msg
     except ValueError:
-        return "Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)"
+        return Result.failure("Error: Invalid date format. Use DD/MM/YYYY (e.g., 03/09/2024)")
     except Exception as e:
         error_msg = f"Error: {str(e)}"
         logger.error(error_msg)
-        return error_msg
-
-def get_activities_for_date(date_data, date_str):
-    """
-    Helper function to extract activities from date_data for a given date.
-    
-    Args:
-        date_data (dict): Slot data for the date
-        date_str (str): Date in DD/MM/YYYY format for display
-        
-    Returns:
-        dict: Dictionary with slot names as keys and lists of activities as values
-    """
-    activities = {}
-    
-    # Iterate through each slot (e.g., AM, PM, AM_L, etc.)
-    for slot_name, slot_data in date_data.items():
-        slot_activities = []
-        
-        # Collect activities from S1 to S6
-        for grade in ['S1', 'S2', 'S3', 'S4', 'S5', 'S6']:
-            if slot_data[grade]:
-                slot_activities.extend([f"{grade}: {activity}" for activity in slot_data[grade]])
-        
-        # Collect other activities
-        if slot_data['otherActivities']:
-            slot_activities.extend(slot_data['otherActivities'])
-        
-        # Only add slot to activities if there are activities
-        if slot_activities:
-            activities[slot_name] = slot_activities
-    
-    # Return message if no activities found
-    if not activities:
-        return {'message': f"No activities scheduled on {date_str}"}
-    
-    return activities
\ No newline at end of file
+        return Result.failure(error_msg)
@@ -0,0 +1,170 @@
+"""
+Renders a class's whole timetable cycle (cycle days x lessons, with venues) as a PNG grid.
+
+Fonts and the empty grid for each cycle shape are built once and reused; each rendered image is
+memoized per (class, timetable version), so it is only drawn again after the timetable changes.
+Rendering takes tens of milliseconds, so call render_week off the event loop.
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+# TrueType font to draw with (falls back to DejaVu Sans, then Pillow's built-in font)
+TIMETABLE_FONT = os.getenv('TIMETABLE_FONT')
+FONT_CANDIDATES = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+)
+# Rendered images kept in memory
+RENDER_CACHE_SIZE = 64
+PERIODS = 6
+
+TITLE_HEIGHT = 44
+HEADER_HEIGHT = 32
+LABEL_WIDTH = 84
+CELL_WIDTH = 132
+CELL_HEIGHT = 58
+PADDING = 6
+ACCENT = (0x00, 0xb7, 0xeb)
+GRID_COLOR = (210, 214, 220)
+TEXT_COLOR = (33, 37, 41)
+MUTED_COLOR = (100, 108, 118)
+
+_rendered = OrderedDict()  # (class name, timetable version) -> PNG bytes
+_rendered_lock = threading.Lock()
+_render_locks = {}  # class name -> lock held while it is drawn, so concurrent requests draw it once
+
+
+@lru_cache(maxsize=8)
+def _font(size):
+    for path in filter(None, (TIMETABLE_FONT,) + FONT_CANDIDATES):
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow before 10.1 has a single bitmap size
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=128)
+def _subject_color(subject):
+    # A light, stable background per subject so the same lesson stands out across the week
+    digest = hashlib.md5(subject.encode('utf-8')).digest()
+    return tuple(200 + byte % 48 for byte in digest[:3])
+
+
+@lru_cache(maxsize=8)
+def _template(cycle_days, periods):
+    """Empty grid with the cycle-day header and lesson labels for one cycle shape."""
+    width = LABEL_WIDTH + CELL_WIDTH * len(cycle_days)
+    height = TITLE_HEIGHT + HEADER_HEIGHT + CELL_HEIGHT * periods
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, TITLE_HEIGHT, width, TITLE_HEIGHT + HEADER_HEIGHT), fill=ACCENT)
+    header_font = _font(16)
+    for index, cycle_day in enumerate(cycle_days):
+        x = LABEL_WIDTH + index * CELL_WIDTH
+        draw.text((x + CELL_WIDTH / 2, TITLE_HEIGHT + HEADER_HEIGHT / 2), f"Day {cycle_day}",
+                  font=header_font, fill='white', anchor='mm')
+    for period in range(periods):
+        y = TITLE_HEIGHT + HEADER_HEIGHT + period * CELL_HEIGHT
+        draw.text((LABEL_WIDTH / 2, y + CELL_HEIGHT / 2), f"Lesson {period + 1}",
+                  font=_font(14), fill=MUTED_COLOR, anchor='mm')
+    for index in range(len(cycle_days) + 1):
+        x = LABEL_WIDTH + index * CELL_WIDTH
+        draw.line((x, TITLE_HEIGHT, x, height), fill=GRID_COLOR)
+    for period in range(periods + 1):
+        y = TITLE_HEIGHT + HEADER_HEIGHT + period * CELL_HEIGHT
+        draw.line((0, y, width, y), fill=GRID_COLOR)
+    return image
+
+
+def _fit(draw, text, font, width):
+    """Shortens text with an ellipsis until it fits in width pixels."""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > width:
+        text = text[:-1]
+    return text + "…"
+
+
+def _compact(text):
+    # 'ENG / ENG / ENG' (split classes) reads better as 'ENG'
+    parts = [part.strip() for part in (text or '').split('/')]
+    return " / ".join(dict.fromkeys(part for part in parts if part))
+
+
+def _draw_week(store, class_name, cycle_days):
+    image = _template(tuple(cycle_days), PERIODS).copy()
+    draw = ImageDraw.Draw(image)
+    draw.text((PADDING * 2, TITLE_HEIGHT / 2), f"Timetable for {class_name}",
+              font=_font(20), fill=TEXT_COLOR, anchor='lm')
+    subject_font = _font(14)
+    venue_font = _font(12)
+    text_width = CELL_WIDTH - 2 * PADDING
+    for column, cycle_day in enumerate(cycle_days):
+        x = LABEL_WIDTH + column * CELL_WIDTH
+        for row, (subject, venue) in enumerate((store.lessons(class_name, cycle_day) or [])[:PERIODS]):
+            subject = _compact(subject)
+            if not subject:
+                continue
+            y = TITLE_HEIGHT + HEADER_HEIGHT + row * CELL_HEIGHT
+            draw.rectangle((x + 1, y + 1, x + CELL_WIDTH - 1, y + CELL_HEIGHT - 1), fill=_subject_color(subject))
+            draw.text((x + PADDING, y + PADDING), _fit(draw, subject, subject_font, text_width),
+                      font=subject_font, fill=TEXT_COLOR)
+            venue = _compact(venue)
+            if venue:
+                draw.text((x + PADDING, y + CELL_HEIGHT - PADDING), _fit(draw, venue, venue_font, text_width),
+                          font=venue_font, fill=MUTED_COLOR, anchor='ld')
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def render_week(store, class_name):
+    """
+    Renders every cycle day of a class's timetable as one PNG.
+
+    Args:
+        store: Timetable store (JsonTimetable or CompiledTimetable)
+        class_name (str): Class name (e.g., '3A')
+
+    Returns:
+        bytes: PNG image, or None if the class has no timetable
+    """
+    key = (class_name, store.version)
+    png = _cached(key)
+    if png is not None:
+        return png
+    with _rendered_lock:
+        class_lock = _render_locks.setdefault(class_name, threading.Lock())
+    with class_lock:
+        # Another request may have drawn it while we waited
+        png = _cached(key)
+        if png is not None:
+            return png
+        cycle_days = store.cycle_days(class_name)
+        if not cycle_days:
+            return None
+        png = _draw_week(store, class_name, cycle_days)
+        with _rendered_lock:
+            _rendered[key] = png
+            while len(_rendered) > RENDER_CACHE_SIZE:
+                _rendered.popitem(last=False)
+    return png
+
+
+def _cached(key):
+    with _rendered_lock:
+        png = _rendered.get(key)
+        if png is not None:
+            _rendered.move_to_end(key)
+        return png
@@ -0,0 +1,411 @@
+"""
+Timetable and cycle-calendar storage.
+
+The JSON files in test_data are the source of truth. `python timetable_store.py` compiles them
+into a compact binary file (timetable.bin) which is memory-mapped at startup, so loading is
+near-instant and the pages are shared by every process that maps the same file.
+
+Binary layout (little-endian):
+    header      magic 'ETTB', format version (u16), periods per day (u16), string count (u32),
+                class count (u32), cycle-day count (u32), date count (u32), source digest (20 bytes)
+    strings     (string count + 1) u32 offsets, then the UTF-8 string blob padded to 4 bytes
+    cycle days  cycle-day count u32 string ids (e.g. 'A'..'H')
+    classes     class count u32 string ids, sorted by name
+    counts      class count x cycle-day count u16 lesson counts (0xFFFF: day not in the class's timetable)
+    periods     class count x cycle-day count x periods per day records of (subject id u32, venue id u32)
+    calendar    date count records of (date ordinal u32, string id u32), sorted by date
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import logging
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+TIMETABLE_JSON = os.path.join('test_data', 'timetale.json')
+CYCLE_JSON = os.path.join('test_data', 'cycleal.json')
+TIMETABLE_BIN = os.path.join('test_data', 'timetable.bin')
+# Written by timetable_sync.py from the live endpoints; preferred over test_data when present
+SYNCED_BIN = os.path.join('data', 'timetable_synced.bin')
+
+MAGIC = b'ETTB'
+FORMAT_VERSION = 1
+NO_STRING = 0xFFFFFFFF
+NO_DAY = 0xFFFF
+# Lookups already holding a replaced store get this many seconds to finish before it is closed
+STORE_CLOSE_DELAY = 60
+
+_HEADER = struct.Struct('<4sHHIIII20s')
+_U32 = struct.Struct('<I')
+_U16 = struct.Struct('<H')
+_PERIOD = struct.Struct('<II')
+_DATE = struct.Struct('<II')
+
+
+def _parse_lesson(item, class_name, cycle_day):
+    """Returns (subject, venue) for a timetable entry, mirroring the forms get_timetable accepts."""
+    if isinstance(item, dict):
+        subject = item.get('subject', 'Unknown')
+        venue = item.get('venue')
+        if not isinstance(subject, str) or not (venue is None or isinstance(venue, str)):
+            raise ValueError(f"Invalid timetable entry format for class {class_name} on cycle day {cycle_day}")
+        # Interned: classes share a handful of subjects and rooms, and there can be hundreds of classes
+        return sys.intern(subject), sys.intern(venue) if venue is not None else None
+    if isinstance(item, str):
+        return sys.intern(item), None
+    raise ValueError(f"Invalid timetable entry type for class {class_name} on cycle day {cycle_day}")
+
+
+class JsonTimetable:
+    """Timetable data parsed from the JSON source files and kept in memory."""
+
+    def __init__(self, timetable_data, cycle_data, version):
+        self.version = version
+        self._cycle_data = cycle_data
+        self._lessons = {
+            class_name: {
+                cycle_day: [_parse_lesson(item, class_name, cycle_day) for item in items]
+                for cycle_day, items in days.items()
+            }
+            for class_name, days in timetable_data.items()
+        }
+
+    @classmethod
+    def from_files(cls, timetable_path=TIMETABLE_JSON, cycle_path=CYCLE_JSON):
+        with open(timetable_path, 'rb') as file:
+            timetable_bytes = file.read()
+        with open(cycle_path, 'rb') as file:
+            cycle_bytes = file.read()
+        return cls.from_bytes(timetable_bytes, cycle_bytes)
+
+    @classmethod
+    def from_bytes(cls, timetable_bytes, cycle_bytes):
+        version = source_digest(timetable_bytes, cycle_bytes).hex()[:12]
+        return cls(json.loads(timetable_bytes), json.loads(cycle_bytes), version)
+
+    def classes(self):
+        return list(self._lessons.keys())
+
+    def has_class(self, class_name):
+        return class_name in self._lessons
+
+    def cycle_days(self, class_name):
+        return sorted(self._lessons.get(class_name, {}))
+
+    def cycle_day(self, normalized_date):
+        return self._cycle_data.get(normalized_date)
+
+    def lessons(self, class_name, cycle_day):
+        return self._lessons.get(class_name, {}).get(cycle_day)
+
+
+class CompiledTimetable:
+    """Read-only view over a memory-mapped timetable.bin file."""
+
+    def __init__(self, path=TIMETABLE_BIN):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, format_version, self._periods, self._n_strings, n_classes,
+         n_days, self._n_dates, digest) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} compiled timetable")
+        self.version = digest.hex()[:12]
+
+        offset = _HEADER.size
+        self._string_offsets = offset
+        offset += (self._n_strings + 1) * 4
+        self._string_blob = offset
+        offset += _align(self._string_at_offset(self._n_strings))
+        self._day_ids = [self._u32(offset + i * 4) for i in range(n_days)]
+        offset += n_days * 4
+        class_ids = [self._u32(offset + i * 4) for i in range(n_classes)]
+        offset += n_classes * 4
+        self._counts = offset
+        offset += _align(n_classes * n_days * 2)
+        self._period_records = offset
+        offset += n_classes * n_days * self._periods * _PERIOD.size
+        self._calendar = offset
+
+        self._strings = {}
+        self._cycle_days = {}  # 'DD/MM/YYYY' -> cycle day, for dates in the calendar looked up so far
+        self._class_index = {self.string(string_id): i for i, string_id in enumerate(class_ids)}
+        self._day_index = {self.string(string_id): i for i, string_id in enumerate(self._day_ids)}
+
+    def _u32(self, offset):
+        return _U32.unpack_from(self._map, offset)[0]
+
+    def _string_at_offset(self, string_id):
+        return self._u32(self._string_offsets + string_id * 4)
+
+    def string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        value = self._strings.get(string_id)
+        if value is None:
+            start = self._string_blob + self._string_at_offset(string_id)
+            end = self._string_blob + self._string_at_offset(string_id + 1)
+            value = self._strings[string_id] = sys.intern(self._map[start:end].decode('utf-8'))
+        return value
+
+    def classes(self):
+        return list(self._class_index.keys())
+
+    def has_class(self, class_name):
+        return class_name in self._class_index
+
+    def cycle_days(self, class_name):
+        if class_name not in self._class_index:
+            return []
+        return sorted(day for day in self._day_index if self.lessons(class_name, day) is not None)
+
+    def cycle_day(self, normalized_date):
+        cycle_day = self._cycle_days.get(normalized_date)
+        if cycle_day is not None:
+            return cycle_day
+        ordinal = _date_ordinal(normalized_date)
+        if ordinal is None:
+            return None
+        low, high = 0, self._n_dates
+        while low < high:
+            mid = (low + high) // 2
+            mid_ordinal, string_id = _DATE.unpack_from(self._map, self._calendar + mid * _DATE.size)
+            if mid_ordinal == ordinal:
+                # At most one entry per calendar date, so this stays as small as the calendar
+                cycle_day = self._cycle_days[normalized_date] = self.string(string_id)
+                return cycle_day
+            if mid_ordinal < ordinal:
+                low = mid + 1
+            else:
+                high = mid
+        return None
+
+    def lessons(self, class_name, cycle_day):
+        class_index = self._class_index.get(class_name)
+        day_index = self._day_index.get(cycle_day)
+        if class_index is None or day_index is None:
+            return None
+        cell = class_index * len(self._day_ids) + day_index
+        count = _U16.unpack_from(self._map, self._counts + cell * 2)[0]
+        if count == NO_DAY:
+            return None
+        base = self._period_records + cell * self._periods * _PERIOD.size
+        return [
+            (self.string(subject_id), self.string(venue_id))
+            for subject_id, venue_id in (_PERIOD.unpack_from(self._map, base + i * _PERIOD.size) for i in range(count))
+        ]
+
+    def close(self):
+        self._map.close()
+
+
+def _date_ordinal(normalized_date):
+    """Ordinal of a 'DD/MM/YYYY' date, or None if it isn't one. Sliced by hand: strptime is the slowest part of a lookup."""
+    if len(normalized_date) != 10 or normalized_date[2] != '/' or normalized_date[5] != '/':
+        return None
+    try:
+        return date(int(normalized_date[6:]), int(normalized_date[3:5]), int(normalized_date[:2])).toordinal()
+    except ValueError:
+        return None
+
+
+def _align(size):
+    return (size + 3) & ~3
+
+
+def source_digest(timetable_bytes, cycle_bytes):
+    return hashlib.sha1(timetable_bytes + b'\0' + cycle_bytes).digest()
+
+
+def compile_timetable(timetable_path=TIMETABLE_JSON, cycle_path=CYCLE_JSON, out_path=TIMETABLE_BIN):
+    """
+    Compiles the JSON timetable and cycle calendar into the binary format described above.
+
+    Args:
+        timetable_path (str): Path to timetale.json
+        cycle_path (str): Path to cycleal.json
+        out_path (str): Where to write the compiled file (written atomically)
+
+    Returns:
+        int: Size of the compiled file in bytes
+    """
+    with open(timetable_path, 'rb') as file:
+        timetable_bytes = file.read()
+    with open(cycle_path, 'rb') as file:
+        cycle_bytes = file.read()
+    return compile_timetable_bytes(timetable_bytes, cycle_bytes, out_path)
+
+
+def compile_timetable_bytes(timetable_bytes, cycle_bytes, out_path=TIMETABLE_BIN):
+    """Same as compile_timetable, for JSON documents already in memory."""
+    source = JsonTimetable.from_bytes(timetable_bytes, cycle_bytes)
+    cycle_data = source._cycle_data
+
+    strings = []
+    string_ids = {}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    class_names = sorted(source.classes())
+    days = sorted({day for name in class_names for day in source._lessons[name]})
+    periods = max((len(source._lessons[name][day]) for name in class_names for day in source._lessons[name]), default=0)
+    class_ids = [intern(name) for name in class_names]
+    day_ids = [intern(day) for day in days]
+
+    counts = bytearray()
+    records = bytearray()
+    for name in class_names:
+        for day in days:
+            lessons = source.lessons(name, day)
+            counts += _U16.pack(NO_DAY if lessons is None else len(lessons))
+            lessons = lessons or []
+            for i in range(periods):
+                subject, venue = lessons[i] if i < len(lessons) else (None, None)
+                records += _PERIOD.pack(intern(subject), intern(venue))
+
+    calendar = bytearray()
+    for ordinal, value in sorted(
+        (datetime.strptime(date_str, '%d/%m/%Y').toordinal(), value) for date_str, value in cycle_data.items()
+    ):
+        calendar += _DATE.pack(ordinal, intern(value))
+
+    blob = bytearray()
+    offsets = bytearray()
+    for value in strings:
+        offsets += _U32.pack(len(blob))
+        blob += value.encode('utf-8')
+    offsets += _U32.pack(len(blob))
+    blob += b'\0' * (_align(len(blob)) - len(blob))
+    counts += b'\0' * (_align(len(counts)) - len(counts))
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, periods, len(strings), len(class_names), len(days),
+                          len(cycle_data), source_digest(timetable_bytes, cycle_bytes))
+    data = b''.join([header, offsets, blob, b''.join(_U32.pack(i) for i in day_ids),
+                     b''.join(_U32.pack(i) for i in class_ids), counts, records, calendar])
+
+    directory = os.path.dirname(out_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    # Replacing (rather than rewriting) the file keeps existing mappings of the old version valid
+    os.replace(tmp_path, out_path)
+    return len(data)
+
+
+def _compiled_is_current(bin_path, timetable_path, cycle_path):
+    try:
+        compiled_mtime = os.path.getmtime(bin_path)
+    except OSError:
+        return False
+    for source_path in (timetable_path, cycle_path):
+        try:
+            if os.path.getmtime(source_path) > compiled_mtime:
+                return False
+        except OSError:
+            continue
+    return True
+
+
+def load_timetable_store(timetable_path=TIMETABLE_JSON, cycle_path=CYCLE_JSON, bin_path=TIMETABLE_BIN,
+                         synced_path=SYNCED_BIN):
+    """
+    Loads timetable data, preferring the last synced copy, then the compiled file when it is at least
+    as new as the JSON sources.
+
+    Args:
+        timetable_path (str): Path to timetale.json
+        cycle_path (str): Path to cycleal.json
+        bin_path (str): Path to the file compiled from those JSON files
+        synced_path (str): Path to the file written by timetable sync, or None
+
+    Returns:
+        JsonTimetable or CompiledTimetable
+
+    Raises:
+        FileNotFoundError: If neither the compiled file nor the JSON sources exist
+    """
+    if synced_path and os.path.exists(synced_path):
+        try:
+            store = CompiledTimetable(synced_path)
+            logger.info(f"Loaded synced timetable: {os.path.abspath(synced_path)} (version {store.version})")
+            return store
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Failed to load synced timetable, falling back to test_data: {e}")
+    if _compiled_is_current(bin_path, timetable_path, cycle_path):
+        try:
+            store = CompiledTimetable(bin_path)
+            logger.info(f"Loaded compiled timetable: {os.path.abspath(bin_path)} (version {store.version})")
+            return store
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Failed to load compiled timetable, falling back to JSON: {e}")
+    logger.info(f"Loading timetable JSON: {os.path.abspath(timetable_path)}, {os.path.abspath(cycle_path)}")
+    return JsonTimetable.from_files(timetable_path, cycle_path)
+
+
+_store = None
+
+
+def get_timetable_store():
+    """
+    Returns the shared timetable data, loading it on first use.
+
+    Callers that need several lookups to agree (e.g. cycle day then lessons) should hold on to
+    the returned store rather than calling this again, as it may be swapped in between.
+    """
+    global _store
+    if _store is None:
+        _store = load_timetable_store()
+    return _store
+
+
+def set_timetable_store(store):
+    """
+    Replaces the shared timetable data with a fully built store.
+
+    The swap is a single reference assignment, so lookups see either the old or the new data,
+    never a mix. The old store stays usable for lookups already holding it, then is closed.
+    """
+    global _store
+    previous, _store = _store, store
+    close_replaced_store(previous, store)
+
+
+def close_replaced_store(previous, store):
+    """
+    Closes a replaced store's memory map after STORE_CLOSE_DELAY seconds, so that lookups still
+    holding it can finish first. Stores without a file (JsonTimetable) are left alone.
+    """
+    if previous is None or previous is store or not hasattr(previous, 'close'):
+        return
+    timer = threading.Timer(STORE_CLOSE_DELAY, previous.close)
+    timer.daemon = True
+    timer.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile timetale.json and cycleal.json into timetable.bin")
+    parser.add_argument('--timetable', default=TIMETABLE_JSON, help="Path to timetale.json")
+    parser.add_argument('--cycle', default=CYCLE_JSON, help="Path to cycleal.json")
+    parser.add_argument('--out', default=TIMETABLE_BIN, help="Output path for the compiled timetable")
+    args = parser.parse_args()
+    size = compile_timetable(args.timetable, args.cycle, args.out)
+    json_size = os.path.getsize(args.timetable) + os.path.getsize(args.cycle)
+    print(f"Wrote {args.out}: {size} bytes (JSON sources: {json_size} bytes)")
+
+
+if __name__ == '__main__':
+    main()
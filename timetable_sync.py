@@ -0,0 +1,157 @@
+import json
+import threading
+import logging
+from datetime import datetime
+import requests
+from requests.exceptions import RequestException
+from event_feed import SCHOOL_API_BASE_URL
+from shared_cache import get_cache, CacheEntry
+from metrics import metrics
+from timetable_store import CompiledTimetable, compile_timetable_bytes, set_timetable_store, SYNCED_BIN
+
+logger = logging.getLogger(__name__)
+
+TIMETABLE_URL = f"{SCHOOL_API_BASE_URL}/timetable"
+CYCLE_URL = f"{SCHOOL_API_BASE_URL}/cyclecal"
+# Responses this recent (in seconds) are reused from the shared cache instead of asking the server again
+SHARED_MAX_AGE = 300
+
+
+class SyncError(Exception):
+    """Raised when the timetable endpoints return something that can't be used."""
+
+
+def validate_timetable_data(timetable_data):
+    """
+    Checks the shape of the /timetable response: {class: {cycle day: [lesson, ...]}}.
+
+    Raises:
+        SyncError: If the data doesn't match
+    """
+    if not isinstance(timetable_data, dict) or not timetable_data:
+        raise SyncError("timetable must be a non-empty object of classes")
+    for class_name, days in timetable_data.items():
+        if not isinstance(days, dict) or not days:
+            raise SyncError(f"class {class_name} must map cycle days to lessons")
+        for cycle_day, lessons in days.items():
+            if not isinstance(lessons, list):
+                raise SyncError(f"class {class_name} cycle day {cycle_day} must be a list of lessons")
+            for lesson in lessons:
+                if isinstance(lesson, str):
+                    continue
+                if not isinstance(lesson, dict) or not isinstance(lesson.get('subject', ''), str):
+                    raise SyncError(f"class {class_name} cycle day {cycle_day} has an invalid lesson")
+
+
+def validate_cycle_data(cycle_data):
+    """
+    Checks the shape of the /cyclecal response: {'DD/MM/YYYY': cycle day or '/'}.
+
+    Raises:
+        SyncError: If the data doesn't match
+    """
+    if not isinstance(cycle_data, dict) or not cycle_data:
+        raise SyncError("cycle calendar must be a non-empty object of dates")
+    for date_str, cycle_day in cycle_data.items():
+        try:
+            datetime.strptime(date_str, '%d/%m/%Y')
+        except (TypeError, ValueError):
+            raise SyncError(f"cycle calendar has an invalid date: {date_str}")
+        if not isinstance(cycle_day, str) or not cycle_day:
+            raise SyncError(f"cycle calendar has an invalid cycle day for {date_str}")
+
+
+class _Endpoint:
+    """The last good response from one endpoint; fetches go through the shared cache with conditional requests."""
+
+    def __init__(self, url, max_age=SHARED_MAX_AGE):
+        self.url = url
+        self.max_age = max_age
+        self.body = None
+
+    def _fetch_entry(self, previous, timeout):
+        headers = {}
+        if previous is not None:
+            if previous.meta.get('etag'):
+                headers['If-None-Match'] = previous.meta['etag']
+            if previous.meta.get('last_modified'):
+                headers['If-Modified-Since'] = previous.meta['last_modified']
+        with metrics.timer('upstream', 'timetable_sync'):
+            response = requests.get(self.url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and previous is not None:
+            return CacheEntry(previous.value, meta=previous.meta)
+        if response.status_code != 200:
+            raise SyncError(f"{self.url} returned HTTP {response.status_code}")
+        return CacheEntry(response.content, meta={
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        })
+
+    def fetch(self, timeout):
+        """Returns the new response body, or None if it is unchanged since the last accepted one."""
+        entry = get_cache().get_or_fetch(f"http:{self.url}", self.max_age,
+                                         lambda previous: self._fetch_entry(previous, timeout), fetch_budget=timeout)
+        if entry.value == self.body:
+            return None
+        return entry.value
+
+    def accept(self, body):
+        self.body = body
+
+
+class TimetableSync:
+    """Fetches /timetable and /cyclecal and hot-swaps the timetable store (via on_update) when they change."""
+
+    def __init__(self, timetable_url=TIMETABLE_URL, cycle_url=CYCLE_URL, out_path=SYNCED_BIN, timeout=10,
+                 on_update=set_timetable_store):
+        self.timetable = _Endpoint(timetable_url)
+        self.cycle = _Endpoint(cycle_url)
+        self.out_path = out_path
+        self.on_update = on_update
+        self.timeout = timeout
+        self.version = None
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """
+        Fetches both endpoints conditionally and, if either changed, validates the data, compiles
+        and loads a new store, then swaps it in. Blocking: run it off the event loop.
+
+        Returns:
+            bool: True if a new timetable was swapped in
+
+        Raises:
+            SyncError: If an endpoint fails or returns invalid data (the current store is kept)
+        """
+        with self._lock:
+            try:
+                timetable_body = self.timetable.fetch(self.timeout)
+                cycle_body = self.cycle.fetch(self.timeout)
+            except RequestException as e:
+                raise SyncError(f"Failed to fetch timetable data: {str(e)}")
+
+            self.synced_at = datetime.now()
+            if timetable_body is None and cycle_body is None:
+                logger.info("Timetable and cycle calendar not modified since last sync")
+                return False
+
+            timetable_bytes = timetable_body if timetable_body is not None else self.timetable.body
+            cycle_bytes = cycle_body if cycle_body is not None else self.cycle.body
+            try:
+                validate_timetable_data(json.loads(timetable_bytes))
+                validate_cycle_data(json.loads(cycle_bytes))
+                compile_timetable_bytes(timetable_bytes, cycle_bytes, self.out_path)
+                store = CompiledTimetable(self.out_path)
+            except ValueError as e:
+                raise SyncError(f"Invalid timetable data: {str(e)}")
+
+            # Only remember responses once they have produced a usable store
+            self.timetable.accept(timetable_bytes)
+            self.cycle.accept(cycle_bytes)
+            changed = store.version != self.version
+            self.version = store.version
+            self.on_update(store)
+            logger.info(f"Timetable synced from {self.timetable.url} and {self.cycle.url} (version {store.version})")
+            return changed
+
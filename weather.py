@@ -1,22 +1,94 @@
-
+import json
+import os
+from datetime import datetime
 import requests as req
+import snapshot
+from shared_cache import get_cache, CacheEntry
+from metrics import metrics
 
-def get_weather():
-    """Fetch 9-day weather forecast from Hong Kong Observatory API."""
+__all__ = ['get_weather', 'get_weather_report', 'restore_weather_snapshot']
+
+# Point HKO_API_BASE_URL at fake_upstream.py to run against local fixtures
+HKO_API_BASE_URL = os.getenv('HKO_API_BASE_URL', "https://data.weather.gov.hk").rstrip('/')
+WEATHER_URL = f"{HKO_API_BASE_URL}/weatherAPI/opendata/weather.php"
+# The 9-day forecast is only updated a few times a day, so a forecast this recent (in seconds) is reused
+WEATHER_MAX_AGE = 600
+# Seconds the forecast request may take
+WEATHER_TIMEOUT = 5
+
+# Last good forecast, restored from the on-disk snapshot at startup
+_last_forecast = {'forecast': None, 'fetched_at': None}
+
+
+def restore_weather_snapshot():
+    """Load the last good forecast from the on-disk snapshot. Returns True if one was found."""
+    saved = snapshot.load_section('weather')
+    if not saved or not saved.get('forecast'):
+        return False
+    _last_forecast.update(forecast=saved['forecast'], fetched_at=saved.get('fetched_at'))
+    return True
+
+
+@metrics.timed('upstream', 'hko')
+def _fetch_forecast(url=WEATHER_URL):
+    data = "fnd"
+    lang = "tc"
+    response = req.get(f"{url}?dataType={data}&lang={lang}", timeout=WEATHER_TIMEOUT)
+    n = response.json()
+    if not isinstance(n, dict) or 'weatherForecast' not in n:
+        raise ValueError("Invalid response from weather API")
+    return [
+        f"{n['weatherForecast'][i]['forecastDate']} : {n['weatherForecast'][i]['forecastWeather']}"
+        for i in range(min(9, len(n['weatherForecast'])))
+    ]
+
+
+def _fetch_entry(previous, url=WEATHER_URL):
+    forecast_list = _fetch_forecast(url)
+    return CacheEntry(json.dumps(forecast_list, ensure_ascii=False).encode('utf-8'))
+
+
+def get_weather_report(url=WEATHER_URL):
+    """
+    Fetch the 9-day forecast, falling back to the last good forecast if the API fails.
+
+    Args:
+        url (str): Weather API endpoint (defaults to the HKO open data API)
+
+    Returns:
+        dict: 'forecast' (list of strings, or a single error string), 'stale' (True if the saved
+        forecast is being served) and 'fetched_at' (when the forecast was fetched)
+    """
     try:
-        url = "https://data.weather.gov.hk/weatherAPI/opendata/weather.php"
-        data = "fnd"
-        lang = "tc"
-        response = req.get(f"{url}?dataType={data}&lang={lang}")
-        n = eval(response.text)
-        if not isinstance(n, dict) or 'weatherForecast' not in n:
-            return ["Error: Invalid response from weather API"]
-        forecast_list = [
-            f"{n['weatherForecast'][i]['forecastDate']} : {n['weatherForecast'][i]['forecastWeather']}"
-            for i in range(min(9, len(n['weatherForecast'])))
-        ]
-        return forecast_list
+        # Shared with the other bot processes, so only one of them calls the API
+        entry = get_cache().get_or_fetch(f"weather:{url}?dataType=fnd&lang=tc", WEATHER_MAX_AGE,
+                                         lambda previous: _fetch_entry(previous, url), fetch_budget=WEATHER_TIMEOUT)
+        forecast_list = json.loads(entry.value)
+    except ValueError:
+        forecast_list = None
+        error = "Error: Invalid response from weather API"
     except Exception:
-        return ["Error: Failed to fetch weather data"]
-    
-# print(get_weather())  # Example usage
\ No newline at end of file
+        forecast_list = None
+        error = "Error: Failed to fetch weather data"
+
+    if forecast_list:
+        if entry.fetched_at != _last_forecast['fetched_at']:
+            _last_forecast.update(forecast=forecast_list, fetched_at=entry.fetched_at)
+            snapshot.save_section('weather', dict(_last_forecast))
+        return {'forecast': forecast_list, 'stale': False, 'fetched_at': _fetch_time_display()}
+    if _last_forecast['forecast'] or restore_weather_snapshot():
+        return {'forecast': _last_forecast['forecast'], 'stale': True, 'fetched_at': _fetch_time_display()}
+    return {'forecast': [error], 'stale': False, 'fetched_at': None}
+
+
+def _fetch_time_display():
+    if _last_forecast['fetched_at'] is None:
+        return None
+    return datetime.fromtimestamp(_last_forecast['fetched_at']).strftime('%d/%m/%Y %H:%M')
+
+
+def get_weather():
+    """Fetch 9-day weather forecast from Hong Kong Observatory API."""
+    return get_weather_report()['forecast']
+
+# print(get_weather())  # Example usage